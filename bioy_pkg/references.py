@@ -0,0 +1,435 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Reference data for classifier
+
+Loading of the seq_info, taxonomy and rank thresholds files and of
+refpacks: a directory of numpy .npy files holding all three already
+parsed and joined.  Refpack arrays are memory mapped when read so
+concurrent processes share the pages of the largest arrays.  The
+specimen map and weights are loaded as QseqidMaps, which may be
+cached and memory mapped the same way.
+"""
+
+import logging
+import os
+import shutil
+
+import numpy
+import pandas
+
+from bioy_pkg import utils, _data as datadir
+from bioy_pkg.taxtable import TaxTable
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RANK_THRESHOLDS = os.path.join(datadir, 'rank_thresholds.csv')
+
+
+def read_seq_info(filename):
+    """Read a seq_info file indexed by seqname (as `sseqid') with columns
+    tax_id and accession.
+    """
+
+    seq_info = pandas.read_csv(
+        filename,
+        usecols=['seqname', 'tax_id', 'accession'],
+        dtype=dict(seqname=str, tax_id=str, accession=str))
+    seq_info = seq_info.set_index('seqname')
+    # rename index to match blast results column name
+    seq_info.index.name = 'sseqid'
+    return seq_info
+
+
+def load_rank_thresholds(path=DEFAULT_RANK_THRESHOLDS, usecols=None):
+    """Load a rank-thresholds file.  If no argument is specified the default
+    rank_threshold_defaults.csv file will be loaded.
+    """
+
+    return pandas.read_csv(
+        path,
+        comment='#',
+        usecols=['tax_id'] + usecols,
+        dtype=dict(tax_id=str)).set_index('tax_id')
+
+
+def read_rank_thresholds(ranks, path=None):
+    """Load the default rank thresholds for columns `ranks' overridden
+    by any in the rank-thresholds file `path'.  Columns are renamed
+    {rank}_threshold.
+    """
+
+    thresholds = load_rank_thresholds(usecols=ranks)
+
+    if path:
+        thresholds = thresholds.append(
+            load_rank_thresholds(path=path, usecols=ranks))
+        # overwrite with user defined tax_id threshold
+        thresholds = thresholds.groupby(level=0, sort=False).last()
+
+    thresholds.columns = ['{}_threshold'.format(c) if c in ranks else c
+                          for c in thresholds.columns]
+    return thresholds
+
+
+def resolve_thresholds(taxonomy, thresholds):
+    """Resolve every node in TaxTable `taxonomy' to its effective rank
+    thresholds: those of the most specific member of its lineage
+    listed in `thresholds'.
+
+    Returns two arrays indexed by node code; the row of `thresholds'
+    to use and the index of the rank at which it was found.  Both are
+    -1 for nodes without any thresholds.
+    """
+
+    defined = numpy.zeros(len(taxonomy), dtype=bool)
+    codes = taxonomy.codes(thresholds.index)
+    defined[codes[codes >= 0]] = True
+
+    matches, ranks = taxonomy.resolve(numpy.arange(len(taxonomy)), defined)
+
+    rows = thresholds.index.get_indexer(taxonomy.tax_ids.take(matches))
+    rows[matches < 0] = -1
+
+    return rows.astype(numpy.int32), ranks.astype(numpy.int32)
+
+
+def cached_thresholds(cache_dir, filenames, taxonomy, thresholds):
+    """Return resolve_thresholds(taxonomy, thresholds) from `cache_dir'
+    if it was computed from files with the same contents as
+    `filenames', otherwise resolve and save it there.
+    """
+
+    path = os.path.join(
+        cache_dir, 'thresholds-{}.npz'.format(utils.checksum(*filenames)))
+
+    if os.path.isfile(path):
+        log.info('loading resolved thresholds from ' + path)
+        cached = numpy.load(path)
+        return cached['rows'], cached['ranks']
+
+    rows, ranks = resolve_thresholds(taxonomy, thresholds)
+
+    # write then rename so concurrent runs never read a partial file
+    utils.mkdir(cache_dir)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        numpy.savez(f, rows=rows, ranks=ranks)
+    os.rename(tmp, path)
+
+    return rows, ranks
+
+
+def _to_bytes(values):
+    """Fixed width string array from values with '' for missing values
+    """
+
+    return pandas.Series(values).fillna('').values.astype(str)
+
+
+def _to_objects(values):
+    """Object array from a fixed width string array with NaN for ''
+    """
+
+    values = values.astype(object)
+    values[values == ''] = numpy.nan
+    return values
+
+
+def write_refpack(path, taxonomy, seq_info, thresholds, resolved):
+    """Write TaxTable `taxonomy', `seq_info' and rank `thresholds' along
+    with their `resolved' thresholds (see resolve_thresholds) to the
+    directory `path'.  `seq_info' is written as a SeqInfo coded by
+    `taxonomy'.
+    """
+
+    rows, ranks = resolved
+    seq_info = SeqInfo.from_frame(seq_info, taxonomy)
+
+    arrays = dict(
+        tax_ids=_to_bytes(taxonomy.tax_ids),
+        parents=taxonomy.parents,
+        node_ranks=_to_bytes(taxonomy.node_ranks),
+        names=_to_bytes(taxonomy.names),
+        ranks=_to_bytes(taxonomy.ranks),
+        lineages=taxonomy.lineages,
+        seqnames=seq_info.seqnames.qseqids,
+        seq_offsets=seq_info.seqnames.offsets,
+        seq_codes=seq_info.seqnames.values,
+        seq_tax_codes=seq_info.tax_codes,
+        accessions=seq_info.accessions,
+        threshold_tax_ids=_to_bytes(thresholds.index),
+        thresholds=thresholds.to_records(index=False),
+        threshold_rows=rows,
+        threshold_ranks=ranks)
+
+    utils.mkdir(path)
+    for name, values in arrays.items():
+        numpy.save(os.path.join(path, name + '.npy'), values)
+
+
+def read_refpack(path):
+    """Read a refpack directory written by write_refpack.  Returns a
+    TaxTable, a SeqInfo, the rank thresholds DataFrame and the resolved
+    thresholds.  The SeqInfo arrays are memory mapped as written, so
+    they are shared by concurrent processes rather than decoded by
+    each of them.
+    """
+
+    def load(name):
+        return numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+    taxonomy = TaxTable(
+        tax_ids=load('tax_ids'),
+        parents=load('parents'),
+        node_ranks=_to_objects(load('node_ranks')),
+        names=_to_objects(load('names')),
+        ranks=load('ranks').tolist(),
+        lineages=load('lineages'))
+
+    seq_info = SeqInfo(
+        QseqidMap(load('seqnames'), load('seq_offsets'), load('seq_codes')),
+        load('seq_tax_codes'),
+        load('accessions'))
+
+    thresholds = pandas.DataFrame.from_records(
+        numpy.asarray(load('thresholds')))
+    thresholds.index = pandas.Index(
+        load('threshold_tax_ids').astype(object), name='tax_id')
+
+    resolved = load('threshold_rows'), load('threshold_ranks')
+
+    return taxonomy, seq_info, thresholds, resolved
+
+
+class QseqidMap(object):
+    """Values of a column by qseqid, held in arrays sorted by qseqid and
+    looked up by binary search rather than through a hashed index, so
+    they can be memory mapped and shared by concurrent processes.
+
+    The values of unique qseqid i are values[offsets[i]:offsets[i + 1]].
+    String values are held as integer codes into `labels'.
+    """
+
+    def __init__(self, qseqids, offsets, values, labels=None):
+        self.qseqids = qseqids
+        self.offsets = offsets
+        self.values = values
+        self.labels = labels
+
+    @classmethod
+    def from_series(cls, s):
+        """Build from Series `s' of values indexed by qseqid.  A qseqid
+        may have several values, kept in order.
+        """
+
+        qseqids = numpy.asarray(s.index, dtype=str)
+        order = numpy.argsort(qseqids, kind='mergesort')
+        qseqids = qseqids[order]
+
+        first = numpy.ones(len(qseqids), dtype=bool)
+        first[1:] = qseqids[1:] != qseqids[:-1]
+        offsets = numpy.append(numpy.flatnonzero(first), len(qseqids))
+
+        if s.dtype == object:
+            codes, labels = pandas.factorize(s.values)
+            # missing values are coded as a final '' label
+            codes[codes < 0] = len(labels)
+            values = codes.astype(numpy.int32)
+            labels = _to_bytes(list(labels) + [None])
+        else:
+            values, labels = s.values, None
+
+        return cls(qseqids[first], offsets, values[order], labels)
+
+    def __len__(self):
+        return len(self.qseqids)
+
+    def lookup(self, qseqids, keep_missing=False):
+        """Return the positions of the rows of array `qseqids' repeated
+        for each of their values, and the positions of those values.
+        Rows without a value are dropped, or kept with value position
+        -1 if `keep_missing'.
+        """
+
+        codes, uniques = pandas.factorize(qseqids)
+        uniques = numpy.asarray(uniques, dtype=str)
+
+        # searching in sorted order reads the keys sequentially
+        order = uniques.argsort()
+        found = numpy.empty(len(uniques), dtype=numpy.int64)
+        found[order] = numpy.searchsorted(self.qseqids, uniques[order])
+
+        # uniques[matched] are qseqids[found]
+        matched = numpy.flatnonzero(found < len(self))
+        found = found[matched]
+        keep = self.qseqids[found] == uniques[matched]
+        matched, found = matched[keep], found[keep]
+
+        starts = numpy.full(len(uniques), -1, dtype=numpy.int64)
+        counts = numpy.zeros(len(uniques), dtype=numpy.int64)
+        starts[matched] = self.offsets[found]
+        counts[matched] = self.offsets[found + 1] - starts[matched]
+        starts, counts = starts[codes], counts[codes]
+
+        if keep_missing:
+            counts = numpy.maximum(counts, 1)
+
+        rows = numpy.repeat(numpy.arange(len(qseqids)), counts)
+        positions = numpy.repeat(starts, counts)
+        if len(rows) > len(qseqids):
+            # qseqids with several values
+            offsets = numpy.arange(len(rows)) - numpy.repeat(
+                counts.cumsum() - counts, counts)
+            positions[positions >= 0] += offsets[positions >= 0]
+
+        return rows, positions
+
+    def take(self, positions):
+        """Values at `positions' with NaN for -1
+        """
+
+        missing = positions < 0
+        if len(self.values):
+            # a copy, since the values may be a read-only memory map
+            values = numpy.array(self.values[positions])
+        else:
+            values = numpy.zeros(len(positions), dtype=self.values.dtype)
+        if self.labels is not None:
+            values = _to_objects(self.labels).take(values)
+        elif missing.any():
+            values = values.astype(float)
+        values[missing] = numpy.nan
+        return values
+
+    def join(self, df, column, how='inner'):
+        """Join the values of each qseqid of DataFrame `df' as `column',
+        repeating rows for qseqids with several values as
+        DataFrame.join does.  `how' is 'inner' or 'left'.
+        """
+
+        rows, positions = self.lookup(
+            df['qseqid'].values, keep_missing=how == 'left')
+        df = df.take(rows).copy()
+        df[column] = self.take(positions)
+        return df
+
+    def save(self, path):
+        arrays = dict(
+            qseqids=self.qseqids, offsets=self.offsets, values=self.values)
+        if self.labels is not None:
+            arrays['labels'] = self.labels
+
+        utils.mkdir(path)
+        for name, values in arrays.items():
+            numpy.save(os.path.join(path, name + '.npy'), values)
+
+    @classmethod
+    def load(cls, path):
+        def load(name):
+            filename = os.path.join(path, name + '.npy')
+            if os.path.exists(filename):
+                return numpy.load(filename, mmap_mode='r')
+
+        return cls(load('qseqids'), load('offsets'), load('values'),
+                   load('labels'))
+
+
+class SeqInfo(object):
+    """The taxonomy code and accession of each seq_info row, identified
+    by position as its seq_code.  The rows of each seqname are found by
+    binary search of a QseqidMap of seqnames to seq_codes; a seqname
+    listed more than once has each of its rows in file order.
+    Accessions are held as a fixed width string array.
+    """
+
+    def __init__(self, seqnames, tax_codes, accessions):
+        self.seqnames = seqnames
+        self.tax_codes = tax_codes
+        self.accessions = accessions
+
+    @classmethod
+    def from_frame(cls, seq_info, taxonomy):
+        """Build from DataFrame `seq_info' (see read_seq_info) with tax_ids
+        coded by TaxTable `taxonomy'
+        """
+
+        seq_codes = pandas.Series(
+            numpy.arange(len(seq_info)), index=seq_info.index)
+        return cls(QseqidMap.from_series(seq_codes),
+                   taxonomy.codes(seq_info['tax_id']),
+                   _to_bytes(seq_info['accession']))
+
+    def __len__(self):
+        return len(self.tax_codes)
+
+    def lookup(self, sseqids):
+        """Return the positions of the rows of array `sseqids' repeated
+        for each of their seq_info rows, and the seq_codes of those
+        rows.  Rows without a seq_info row are dropped.
+        """
+
+        rows, positions = self.seqnames.lookup(sseqids)
+        return rows, self.seqnames.values[positions]
+
+    def accession(self, seq_codes):
+        """Return the accessions of `seq_codes' with NaN for missing
+        values
+        """
+
+        return _to_objects(self.accessions.take(seq_codes))
+
+
+def read_qseqid_map(filename, column, dtype):
+    """Read a headerless csv file of qseqids and their `column' values of
+    type `dtype' as a QseqidMap.  Duplicate rows are dropped.
+    """
+
+    df = pandas.read_csv(
+        filename,
+        names=['qseqid', column],
+        usecols=['qseqid', column],
+        dtype=dict(qseqid=str, **{column: dtype}))
+    df = df.drop_duplicates()
+    return QseqidMap.from_series(df.set_index('qseqid')[column])
+
+
+def cached_qseqid_map(cache_dir, filename, column, dtype):
+    """Return read_qseqid_map(filename, column, dtype) memory mapped from
+    `cache_dir' if it was read from a file with the same contents as
+    `filename', otherwise read and save it there.
+    """
+
+    path = os.path.join(cache_dir, '{}-{}'.format(
+        column, utils.checksum(filename)))
+
+    if not os.path.isdir(path):
+        qseqid_map = read_qseqid_map(filename, column, dtype)
+
+        # write then rename so concurrent runs never read a partial map
+        utils.mkdir(cache_dir)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        qseqid_map.save(tmp)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # saved meanwhile by a concurrent run
+            if not os.path.isdir(path):
+                raise
+            shutil.rmtree(tmp)
+
+    log.info('loading {} map from {}'.format(column, path))
+    return QseqidMap.load(path)
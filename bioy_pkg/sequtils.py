@@ -18,12 +18,13 @@ import contextlib
 import tempfile
 import logging
 import numpy
+import os
 import re
 import subprocess
 import utils
 
 from cStringIO import StringIO
-from itertools import tee, izip_longest, groupby, takewhile, izip
+from itertools import tee, izip_longest, groupby, takewhile, izip, islice, chain
 from collections import Counter, defaultdict, namedtuple
 from operator import itemgetter
 from subprocess import Popen, PIPE
@@ -39,6 +40,12 @@ USEARCH_HEADER = ['qseqid', 'sseqid', 'pident', 'length',
 # use BLAST_FORMAT_DEFAULT as input to blastn -outfmt
 BLAST_FORMAT_DEFAULT = "qseqid,sseqid,pident,qstart,qend,qlen,qcovs"
 BLAST_HEADER_DEFAULT = BLAST_FORMAT_DEFAULT.split(',')
+# blast -outfmt fields written as numbers to columnar files
+BLAST_NUMERIC_FIELDS = {
+    'qlen', 'slen', 'qstart', 'qend', 'sstart', 'send', 'evalue',
+    'bitscore', 'score', 'length', 'pident', 'nident', 'mismatch',
+    'positive', 'gapopen', 'gaps', 'ppos', 'qframe', 'sframe', 'qcovs',
+    'qcovhsp'}
 
 ERRORS = ['snp', 'indel', 'homoindel', 'compound']
 
@@ -123,6 +130,57 @@ UNCLASSIFIED_REGEX = re.compile(
                                r'vent\b',
                                ])))
 
+def _concatenate(seqs):
+    """Join strings `seqs' into a single uint8 buffer.  Returns the
+    buffer and an array of len(seqs) + 1 offsets delimiting each
+    string.
+    """
+
+    lengths = numpy.fromiter(
+        (len(s) for s in seqs), dtype=numpy.int64, count=len(seqs))
+    offsets = numpy.zeros(len(seqs) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+
+    buf = numpy.frombuffer(''.join(seqs), dtype=numpy.uint8)
+    return buf, offsets
+
+
+def _split(buf, offsets):
+    """Inverse of _concatenate"""
+
+    buf = buf.tostring()
+    return [buf[a:b] for a, b in izip(offsets[:-1], offsets[1:])]
+
+
+def homoencode_many(seqs):
+    """Run length encode a batch of strings
+
+    Returns a list of 2-tuples (rle_seq, counts) as in homoencode,
+    except that counts are numpy arrays.  Runs are found at once
+    over a single buffer of all of the sequences.
+    """
+
+    seqs = [str(s).upper() for s in seqs]
+    buf, offsets = _concatenate(seqs)
+
+    assert not (buf == ord(gap)).any()
+
+    # a run starts at each change of character and each sequence
+    is_start = numpy.ones(len(buf), dtype=bool)
+    numpy.not_equal(buf[1:], buf[:-1], out=is_start[1:])
+    is_start[offsets[:-1][offsets[:-1] < len(buf)]] = True
+
+    starts = numpy.flatnonzero(is_start)
+    counts = numpy.diff(numpy.append(starts, len(buf)))
+
+    # the runs belonging to each sequence
+    run_offsets = numpy.searchsorted(starts, offsets)
+    chars = _split(buf[starts], run_offsets)
+
+    return [(c, counts[a:b]) for c, a, b in
+            izip(chars, run_offsets[:-1], run_offsets[1:])]
+
+
 def homoencode(seq):
     """Run length encode a string
 
@@ -133,15 +191,8 @@ def homoencode(seq):
     For example, homoencode('AATGGGC') ==> ('ATGC', [2,1,3,1])
     """
 
-    assert gap not in seq
-
-    seq = seq.upper()
-    seq = groupby(seq)
-    seq = ((c, len(list(g))) for c, g in seq)
-
-    chars, counts = izip(*seq)
-
-    return ''.join(chars), list(counts)
+    rle_seq, counts = homoencode_many([seq])[0]
+    return rle_seq, counts.tolist()
 
 
 def homodecodealignment(seq1, counts1, seq2, counts2, insertion=homogap):
@@ -151,38 +202,94 @@ def homodecodealignment(seq1, counts1, seq2, counts2, insertion=homogap):
     normal encoding. *seq1* and *seq2* should be aligned, run length
     encoded sequences. *counts1* and *counts2* are their corresponding
     counts.
+
+    Each column is expanded to the longer of its two homopolymers: a
+    gap opposite a base is widened to the length of the base, and the
+    shorter of two bases is padded with *insertion*.
     """
 
     assert len(seq1.replace(gap, '').replace(insertion, '')) == len(counts1)
     assert len(seq2.replace(gap, '').replace(insertion, '')) == len(counts2)
 
-    if not seq1:
-        return seq1, homodecode(seq2, counts2)
-    if not seq2:
-        return homodecode(seq1, counts1), seq2
-
-    assert not seq1[0] == seq2[0] == gap
-
-    if seq1[0] == gap:
-        suff1, suff2 = homodecodealignment(
-            seq1[1:], counts1, seq2[1:], counts2[1:])
-        deseq1 = gap * counts2[0] + suff1
-        deseq2 = seq2[0] * counts2[0] + suff2
-    elif seq2[0] == gap:
-        suff1, suff2 = homodecodealignment(
-            seq1[1:], counts1[1:], seq2[1:], counts2)
-        deseq1 = seq1[0] * counts1[0] + suff1
-        deseq2 = gap * counts1[0] + suff2
-    else:
-        m = max(counts1[0], counts2[0])
-        suff1, suff2 = homodecodealignment(
-            seq1[1:], counts1[1:], seq2[1:], counts2[1:])
-        deseq1 = seq1[0] * counts1[0] + insertion * (m - counts1[0]) + suff1
-        deseq2 = seq2[0] * counts2[0] + insertion * (m - counts2[0]) + suff2
+    ncols = min(len(seq1), len(seq2))
+    cols1 = numpy.frombuffer(seq1[:ncols], dtype=numpy.uint8)
+    cols2 = numpy.frombuffer(seq2[:ncols], dtype=numpy.uint8)
+    gaps1, gaps2 = cols1 == ord(gap), cols2 == ord(gap)
+
+    assert not (gaps1 & gaps2).any()
+
+    # run lengths of each column, 0 opposite gaps
+    lengths1 = numpy.zeros(ncols, dtype=numpy.int64)
+    lengths2 = numpy.zeros(ncols, dtype=numpy.int64)
+    bases1, bases2 = numpy.flatnonzero(~gaps1), numpy.flatnonzero(~gaps2)
+    lengths1[bases1] = numpy.asarray(counts1, dtype=numpy.int64)[:len(bases1)]
+    lengths2[bases2] = numpy.asarray(counts2, dtype=numpy.int64)[:len(bases2)]
+    widths = numpy.maximum(lengths1, lengths2)
+
+    def expand(cols, gaps, lengths):
+        # each column is a run of its character followed by insertions
+        lengths = numpy.where(gaps, widths, lengths)
+        chars = numpy.empty((ncols, 2), dtype=numpy.uint8)
+        chars[:, 0] = cols
+        chars[:, 1] = ord(insertion)
+        repeats = numpy.column_stack([lengths, widths - lengths])
+        return numpy.repeat(chars.ravel(), repeats.ravel()).tostring()
+
+    deseq1 = expand(cols1, gaps1, lengths1)
+    deseq2 = expand(cols2, gaps2, lengths2)
+
+    # any unaligned remainder is decoded on its own
+    if len(seq1) > ncols:
+        deseq1 += homodecode(seq1[ncols:], counts1[len(bases1):])
+    if len(seq2) > ncols:
+        deseq2 += homodecode(seq2[ncols:], counts2[len(bases2):])
 
     return deseq1, deseq2
 
 
+def homodecode_many(seqs, counts, insertion=homogap):
+    """Expand a batch of run length encoded sequences.
+
+    *seqs* are run length encoded strings and *counts* the
+    corresponding sequences of homopolymer lengths as in homodecode.
+    Every sequence is expanded by a single numpy.repeat over a buffer
+    of all of the sequences.
+    """
+
+    if not len(seqs):
+        return []
+
+    buf, offsets = _concatenate(seqs)
+    counts = [numpy.asarray(c, dtype=numpy.int64) for c in counts]
+    ncounts = numpy.array([len(c) for c in counts], dtype=numpy.int64)
+    count_offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+    numpy.cumsum(ncounts, out=count_offsets[1:])
+    counts = numpy.concatenate(counts)
+
+    # number of bases preceding each character within its sequence
+    seq_ids = numpy.repeat(
+        numpy.arange(len(seqs)), numpy.diff(offsets))
+    is_gap = (buf == ord(gap)) | (buf == ord(insertion))
+    preceding = numpy.zeros(len(buf) + 1, dtype=numpy.int64)
+    numpy.cumsum(~is_gap, out=preceding[1:])
+    preceding = preceding[:-1] - preceding[offsets[:-1]][seq_ids]
+
+    # characters past the last count are left as they are
+    decoded = preceding < ncounts[seq_ids]
+    bases = numpy.flatnonzero(decoded & ~is_gap)
+
+    repeats = numpy.ones(len(buf), dtype=numpy.int64)
+    repeats[bases] = counts[count_offsets[seq_ids[bases]] + preceding[bases]]
+
+    buf = buf.copy()
+    buf[decoded & is_gap] = ord(gap)
+
+    out_offsets = numpy.zeros(len(buf) + 1, dtype=numpy.int64)
+    numpy.cumsum(repeats, out=out_offsets[1:])
+
+    return _split(numpy.repeat(buf, repeats), out_offsets[offsets])
+
+
 def homodecode(seq, counts, insertion=homogap):
     """Expand a run length encoded sequence.
 
@@ -196,12 +303,7 @@ def homodecode(seq, counts, insertion=homogap):
     *seq* that are not - or = (both representations for gaps.
     """
 
-    if not seq or not counts:
-        return seq
-    elif seq[0] == gap or seq[0] == insertion:
-        return gap + homodecode(seq[1:], counts)
-    else:
-        return seq[0] * counts[0] + homodecode(seq[1:], counts[1:])
+    return homodecode_many([seq], [counts], insertion=insertion)[0]
 
 
 def to_ascii(nums):
@@ -212,10 +314,11 @@ def to_ascii(nums):
     encodings, so we're asuming that values > 78 are not plausible.
     """
 
-    if max(nums) > 78:
+    nums = numpy.asarray(nums)
+    if len(nums) and nums.max() > 78:
         raise ValueError('values over 78 are not allowed')
 
-    return ''.join([chr(i + 48) for i in nums])
+    return (nums + 48).astype(numpy.uint8).tostring()
 
 
 def from_ascii(chars):
@@ -225,6 +328,103 @@ def from_ascii(chars):
     return [ord(c) - 48 for c in chars]
 
 
+class RleIndex(object):
+    """Run length counts by read name.  Counts are packed into a single
+    uint8 array, with read names sorted and looked up by binary search
+    rather than through a dict, so an index saved with `save' can be
+    memory mapped instead of parsed.
+
+    The counts of read names[i] are counts[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, names, offsets, counts):
+        self.names = names
+        self.offsets = offsets
+        self.counts = counts
+
+    @classmethod
+    def from_ascii(cls, rles):
+        """Build from a dict of read names and to_ascii encoded counts
+        """
+
+        names = sorted(rles)
+        rles = [rles[n] for n in names]
+
+        offsets = numpy.zeros(len(rles) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(r) for r in rles], out=offsets[1:])
+        counts = numpy.frombuffer(''.join(rles), dtype=numpy.uint8) - 48
+
+        return cls(numpy.array(names, dtype=str), offsets, counts)
+
+    @classmethod
+    def read_csv(cls, handle):
+        """Read a csv file with columns name,rle as written by `bioy
+        rlencode'.  A header row is skipped.
+        """
+
+        rles = dict(row for row in csv.reader(handle) if row != ['name', 'rle'])
+        return cls.from_ascii(rles)
+
+    def write_csv(self, handle):
+        writer = csv.writer(handle)
+        for name, counts in self.iteritems():
+            writer.writerow([name, to_ascii(counts)])
+
+    def __len__(self):
+        return len(self.names)
+
+    def _find(self, name):
+        i = numpy.searchsorted(self.names, name)
+        if i < len(self.names) and self.names[i] == name:
+            return i
+        return -1
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    def __getitem__(self, name):
+        """Counts of read `name' as a list, as from_ascii returns them
+        """
+
+        i = self._find(name)
+        if i < 0:
+            raise KeyError(name)
+        return self.counts[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def iteritems(self):
+        for i, name in enumerate(self.names):
+            yield name, self.counts[self.offsets[i]:self.offsets[i + 1]]
+
+    def save(self, path):
+        utils.mkdir(path)
+        for name in ['names', 'offsets', 'counts']:
+            numpy.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path):
+        def load(name):
+            return numpy.load(
+                os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        return cls(load('names'), load('offsets'), load('counts'))
+
+
+def read_rle(path):
+    """Return an RleIndex memory mapped from directory `path' written
+    by `bioy rlepack', or read from a csv file of to_ascii encoded
+    counts.  Suitable as an argparse type.
+    """
+
+    if os.path.isdir(path):
+        return RleIndex.load(path)
+
+    with utils.opener(path) as handle:
+        return RleIndex.read_csv(handle)
+
+
 def cons_rle(c, ceiling=False):
     """
     Choose a consensus run length given counts of run lengths in
@@ -308,20 +508,109 @@ def get_rle_counts(seqs, rlelist):
             for i in xrange(len(char_counter))]
 
 
+# columns of tallies in consensus, in sorted order for breaking ties
+CONS_SYMBOLS = sorted(gap + homogap + 'ACGT')
+
+
+def _cons_members():
+    """Return a (256, len(CONS_SYMBOLS)) boolean array of the bases of
+    each byte value and a boolean array of the byte values in CAPUI
+    """
+
+    members = numpy.zeros((256, len(CONS_SYMBOLS)), dtype=bool)
+    known = numpy.zeros(256, dtype=bool)
+    for char, bases in CAPUI.items():
+        members[ord(char)] = [b in bases for b in CONS_SYMBOLS]
+        known[ord(char)] = True
+    return members, known
+
+CONS_MEMBERS, CONS_KNOWN = _cons_members()
+
+
+def alignment_matrix(seqs):
+    """Return aligned sequences `seqs' as a 2D uint8 array with a row
+    for each sequence, and a boolean array of the same shape marking
+    positions within each sequence (rows shorter than the longest
+    sequence are padded with 0).
+    """
+
+    lengths = numpy.array([len(s) for s in seqs], dtype=numpy.int64)
+    ncols = lengths.max() if len(lengths) else 0
+
+    matrix = numpy.zeros((len(seqs), ncols), dtype=numpy.uint8)
+    for row, s in izip(matrix, seqs):
+        row[:len(s)] = numpy.frombuffer(s, dtype=numpy.uint8)
+
+    within = numpy.arange(ncols) < lengths[:, None]
+    return matrix, within
+
+
 def consensus(seqs, rlelist=None, degap=True):
     """
     Calculate a consensus for an iterable of SeqRecord objects. seqs
     are decoded using corresponding lists of read length counts in
     `rlelist` if provided. Gaps are removed if degap is True.
+
+    The result is that of cons_char and cons_rle applied to each
+    column tallied by get_char_counts or get_rle_counts, but the
+    alignment is tallied as a matrix with numpy.
     """
 
+    matrix, within = alignment_matrix([s.seq for s in seqs])
+    if not matrix.size:
+        return ''
+
+    unknown = within & ~CONS_KNOWN[matrix]
+    if unknown.any():
+        raise KeyError(chr(matrix[unknown][0]))
+
+    # bases of each column, IUPAC codes counting once for each base
+    tallies = numpy.column_stack(
+        [(CONS_MEMBERS[matrix, i] & within).sum(axis=0)
+         for i in xrange(len(CONS_SYMBOLS))])
+
+    # gaps when more than half, otherwise the most common bases
+    gap_col = CONS_SYMBOLS.index(gap)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        gaps = tallies[:, gap_col] / tallies.sum(axis=1).astype(float) > 0.5
+    tallies[:, gap_col] = 0
+    top = tallies == tallies.max(axis=1)[:, None]
+    top &= tallies > 0
+
+    # the IUPAC code of each distinct set of most common bases
+    bits = 1 << numpy.arange(len(CONS_SYMBOLS))
+    keys, inverse = numpy.unique(
+        top[~gaps].dot(bits), return_inverse=True)
+    codes = []
+    for key in keys:
+        tied = tuple(b for b, bit in zip(CONS_SYMBOLS, bits) if key & bit)
+        codes.append(ord(IUPAC[tied]))
+
+    cons = numpy.empty(matrix.shape[1], dtype=numpy.uint8)
+    cons[gaps] = ord(gap)
+    cons[~gaps] = numpy.array(codes, dtype=numpy.uint8)[inverse]
+
     if rlelist:
-        cons = [cons_char(c) * cons_rle(n)
-                for c, n in get_rle_counts(seqs, rlelist)]
-    else:
-        cons = [cons_char(c) for c in get_char_counts(seqs)]
+        # the most common run length of each column, or the smallest
+        # of the most common; gaps count as run lengths of 1
+        assert len(rlelist) == len(matrix)
+        bases = within & (matrix != ord(gap))
+        rlelist = [numpy.asarray(r, dtype=numpy.int64) for r in rlelist]
+        assert (bases.sum(axis=1) == [len(r) for r in rlelist]).all()
+
+        rles = numpy.ones(matrix.shape, dtype=numpy.int64)
+        rles[bases] = numpy.concatenate(rlelist)
+
+        cols = numpy.broadcast_to(numpy.arange(matrix.shape[1]), matrix.shape)
+        width = rles.max() + 1
+        counts = numpy.bincount(
+            (cols * width + rles)[within], minlength=matrix.shape[1] * width)
+        modes = counts.reshape(-1, width).argmax(axis=1)
+
+        cons = numpy.repeat(cons, modes)
 
-    return ''.join(cons).replace(gap, '') if degap else ''.join(cons)
+    cons = cons.tostring()
+    return cons.replace(gap, '') if degap else cons
 
 
 @contextlib.contextmanager
@@ -781,6 +1070,24 @@ def compound_assignment(assignments, taxonomy):
     return format_taxonomy(*assignments, asterisk='*')
 
 
+def compound_assignments(assignments, taxonomy):
+    """
+    Return the compound_assignment of each set of two-tuples
+    (tax_id, is_starred) in the iterable 'assignments'.  Each distinct
+    set is formatted once and its name reused for the others.
+    """
+
+    names = {}
+    result = []
+    for a in assignments:
+        key = frozenset(a)
+        if key not in names:
+            names[key] = compound_assignment(key, taxonomy)
+        result.append(names[key])
+
+    return result
+
+
 def condense_ids(assignments,
                  taxonomy,
                  ranks=RANKS,
@@ -874,33 +1181,131 @@ def correct_copy_numbers(assignments, copy_numbers):
 SeqLite = namedtuple('SeqLite', 'id, description, seq')
 
 
-def fastalite(handle, limit=None):
+def _fasta_blocks(handle, blocksize):
+    """Read fasta file `handle' in blocks of `blocksize' characters (or
+    as the strings of other iterables) and yield text ending where a
+    record starts, so that records are never split between blocks.
     """
-    Return a sequence of namedtupe objects given fasta format open
-    file-like object `handle`. Sequence is a list if `readfile` is
-    True, an iterator otherwise.
+
+    read = getattr(handle, 'read', None)
+    blocks = iter(lambda: read(blocksize), '') if read else iter(handle)
+
+    pending = []
+    newline = True  # whether the last block ended a line
+    for block in blocks:
+        if not block:
+            continue
+
+        end = block.rfind('\n>') + 1
+        if end or (newline and block.startswith('>')):
+            pending.append(block[:end])
+            yield ''.join(pending)
+            pending = [block[end:]]
+        else:
+            pending.append(block)
+        newline = block.endswith('\n')
+
+    yield ''.join(pending)
+
+
+# characters other than those str.strip removes from within lines
+_fasta_nonblank = ''.join(
+    c for c in map(chr, range(256)) if c not in ' \t\r\x0b\x0c')
+
+
+def _fasta_records(text):
+    """Return the stripped headers of the records in `text', starting
+    with '>', and their sequence lines, each stripped, joined
     """
-    limit = limit or -1
+
+    # usually each record is a header and a single sequence line,
+    # which is so if there are as many headers as every other line
+    count = 2 * (text.count('\n>') + 1)
+    if text.count('\n', 0, -1) + 1 == count:
+        lines = text.split('\n')
+        if not lines[-1]:
+            lines.pop()
+        headers = lines[0::2]
+        if ('\n' + '\n'.join(headers)).count('\n>') == len(headers):
+            return ([h[1:].strip() for h in headers],
+                    [s.strip() for s in lines[1::2]])
+
+    headers, seqs = [], []
+    start = 1
+    while start:
+        end = text.find('\n>', start) + 1
+        stop = end or len(text)
+        newline = text.find('\n', start, stop)
+        if newline < 0:
+            newline = stop
+        headers.append(text[start:newline].strip())
+
+        seq = text[newline + 1:stop]
+        if seq.translate(None, _fasta_nonblank):
+            seq = ''.join([line.strip() for line in seq.split('\n')])
+        else:
+            seq = seq.replace('\n', '')
+        seqs.append(seq)
+
+        start = end and end + 1
+
+    return headers, seqs
+
+
+def fastalite(handle, limit=None, blocksize=1 << 20):
+    """
+    Return an iterator of SeqLite namedtuple objects given fasta
+    format open file-like object `handle`, reading no more than
+    `limit` records.  The file is read in blocks of `blocksize`
+    characters and the records of each block are parsed together.
+    The final record is omitted if its sequence is empty.
+    """
+
+    remaining = limit if limit > 0 else None
+
+    blocks = _fasta_blocks(handle, blocksize)
+
+    # skip any text before the first record
+    for text in blocks:
+        start = 0 if text.startswith('>') else text.find('\n>') + 1
+        if start or text.startswith('>'):
+            blocks = chain([text[start:]], blocks)
+            break
 
     name, seq = '', ''
-    for line in handle:
-        if line.startswith('>'):
-            if limit != 0:
-                limit -= 1
-            else:
-                break
+    for text in blocks:
+        if not text:
+            continue
 
-            if name:
-                yield SeqLite(name.split()[0], name, seq)
+        names, seqs = _fasta_records(text)
+        if remaining is not None:
+            names, seqs = names[:remaining], seqs[:remaining]
+            remaining -= len(names)
 
-            name, seq = line[1:].strip(), ''
-        else:
-            seq += line.strip()
+        # all but the last record read are followed by another
+        names[:0], seqs[:0] = [name], [seq]
+        name, seq = names.pop(), seqs.pop()
+        for n, s in izip(names, seqs):
+            if n:
+                yield SeqLite(n.split()[0], n, s)
+
+        if remaining == 0:
+            break
 
     if name and seq:
         yield SeqLite(name.split()[0], name, seq)
 
 
+def fastalite_batches(handle, size=1000, limit=None, blocksize=1 << 20):
+    """
+    Return an iterator of lists of up to `size` SeqLite objects read
+    from `handle` by fastalite.
+    """
+
+    seqs = fastalite(handle, limit=limit, blocksize=blocksize)
+    return iter(lambda: list(islice(seqs, size)), [])
+
+
 # Taken from Connor McCoy's Deenurp
 
 
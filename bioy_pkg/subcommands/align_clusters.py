@@ -28,8 +28,8 @@ from os import path
 import random
 
 from bioy_pkg.sequtils import SeqLite, fastalite, \
-    homodecode, from_ascii, fasta_tempfile
-from bioy_pkg.utils import chunker, Opener, Csv2Dict
+    homodecode, fasta_tempfile, read_rle
+from bioy_pkg.utils import chunker, Opener
 
 log = logging.getLogger(__name__)
 
@@ -43,9 +43,10 @@ def build_parser(parser):
                         help = """output of `bioy denoise --readmap`
                         (csv file with columns readname,clustername)""")
     parser.add_argument('-r', '--rlefile',
-                        type = Csv2Dict('name', 'rle', fieldnames=['name', 'rle']),
+                        type = read_rle,
                         help="""An optional file containing run
-                        length encoding for infile (.csv.bz2)""")
+                        length encoding for infile (.csv.bz2 or a
+                        directory from `bioy rlepack`)""")
     parser.add_argument('-d', '--outdir', help='output directory', default='.')
     parser.add_argument('--pattern',
                         help = """A regular expression matching cluster names""")
@@ -64,7 +65,7 @@ def action(args):
 
     if args.rlefile:
         def rlemap(seq):
-            decoded = homodecode(seq.seq, from_ascii(args.rlefile[seq.id]))
+            decoded = homodecode(seq.seq, args.rlefile[seq.id])
             return SeqLite(seq.id, seq.description, decoded)
 
     groups = groupby(csv.reader(args.readmap), itemgetter(1))
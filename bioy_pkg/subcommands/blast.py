@@ -67,14 +67,17 @@ qcovhsp means Query Coverage Per HSP
 import logging
 import sys
 
+import pandas
+
 from csv import DictWriter
 from cStringIO import StringIO
 from itertools import chain, groupby
 from operator import itemgetter
 from subprocess import Popen, PIPE
 
-from bioy_pkg.sequtils import BLAST_HEADER_DEFAULT, BLAST_FORMAT_DEFAULT, fastalite
-from bioy_pkg.utils import opener, Opener
+from bioy_pkg.sequtils import (BLAST_HEADER_DEFAULT, BLAST_FORMAT_DEFAULT,
+                               BLAST_NUMERIC_FIELDS, fastalite)
+from bioy_pkg.utils import opener, Opener, columnar_format, write_columnar
 
 log = logging.getLogger(__name__)
 
@@ -85,7 +88,10 @@ def build_parser(parser):
     parser.add_argument('-o', '--out',
             type = Opener('w'),
             default = sys.stdout,
-            help = 'tabulated BLAST results with the following default headers {}'.format(BLAST_HEADER_DEFAULT))
+            help = """tabulated BLAST results with the following default
+                      headers {}; written as a typed columnar file if
+                      ending in .parquet, .pq or .feather (requires
+                      pyarrow)""".format(BLAST_HEADER_DEFAULT))
     parser.add_argument('-d', '--database',
             help = 'blast database path for local blasts')
     parser.add_argument('-r', '--remote-database', choices=['nt','nr'],
@@ -149,6 +155,13 @@ def action(args):
     if args.dry_run:
         sys.exit(0)
 
+    out_format = columnar_format(args.out.name)
+    if out_format:
+        try:
+            import pyarrow  # noqa
+        except ImportError:
+            sys.exit('{} --out requires pyarrow'.format(out_format))
+
     pipe = Popen(command, stdout = PIPE, stderr = PIPE)
 
     results, errors = pipe.communicate()
@@ -192,6 +205,13 @@ def action(args):
         # append to lines
         lines = chain(lines, nohits)
 
+    if out_format:
+        lines = pandas.DataFrame(list(lines), columns = header)
+        for field in BLAST_NUMERIC_FIELDS.intersection(header):
+            lines[field] = pandas.to_numeric(lines[field])
+        write_columnar(lines, args.out, out_format)
+        return
+
     out = DictWriter(args.out,
                      fieldnames = header,
                      extrasaction = 'ignore')
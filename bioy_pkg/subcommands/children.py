@@ -23,6 +23,9 @@ import sys
 
 from operator import itemgetter
 
+import numpy as np
+
+from bioy_pkg.taxtable import TaxTable
 from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
@@ -44,40 +47,35 @@ def build_parser(parser):
             [parent_name,parent_id,parent_rank,tax_name,tax_id,rank]""")
 
 def action(args):
-    taxonomy = csv.DictReader(args.taxonomy)
-    ranks = taxonomy.fieldnames[4:]
+    taxonomy = TaxTable.read_csv(args.taxonomy)
 
-    tax = {}
+    # tax_ids are children of the most specific parent in their lineage
+    parents = taxonomy.codes(list(args.taxids))
+    defined = np.zeros(len(taxonomy), dtype=bool)
+    defined[parents[parents >= 0]] = True
+    parents, _ = taxonomy.resolve(np.arange(len(taxonomy)), defined)
 
     # filter out claves
-    dropped = total = 0
-    for t in taxonomy:
-        parent_id = set(itemgetter(*ranks)(t)) & args.taxids
-        if parent_id:
-            t['parent_id'], = parent_id
-            tax[t['tax_id']] = t
-        else:
-            dropped += 1
-        total += 1
+    children = np.flatnonzero(parents >= 0)
+    parents = parents[children]
+    total, dropped = len(taxonomy), len(taxonomy) - len(children)
 
     log.info('dropped {} of {} records ({:.2%}) as not children'.format(
         dropped, total, float(dropped) / total))
 
-    # add parent_name and parent_rank
-    for t in tax.values():
-        parent = tax[t['parent_id']]
-        t['parent_name'] = parent['tax_name']
-        t['parent_rank'] = parent['rank']
+    rows = zip(taxonomy.names[parents],
+               taxonomy.tax_ids[parents],
+               taxonomy.node_ranks[parents],
+               taxonomy.names[children],
+               taxonomy.tax_ids[children],
+               taxonomy.node_ranks[children])
 
     # sort by parent_name and tax_name ??
-    rows = sorted(tax.values(), key = itemgetter('parent_name', 'tax_name'))
+    rows = sorted(rows, key = itemgetter(0, 3))
 
     # output
     fieldnames = ['parent_name', 'parent_id', 'parent_rank',
                   'tax_name', 'tax_id', 'rank']
-    out = csv.DictWriter(args.out,
-                         extrasaction = 'ignore',
-                         fieldnames = fieldnames)
-    out.writeheader()
+    out = csv.writer(args.out)
+    out.writerow(fieldnames)
     out.writerows(rows)
-
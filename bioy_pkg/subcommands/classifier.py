@@ -86,6 +86,11 @@ A csv file with columns **qseqid**, **sseqid**, **pident**,
 .. note:: The actual header is optional if using default blast out format but
           if present make sure to use the --has-header switch
 
+A blast_file ending in .parquet, .pq or .feather (as written by ``bioy
+blast`` and ``bioy usearch``) is read as a typed columnar file with the
+columns named in the file; only the columns used are read.  Requires
+pyarrow.
+
 seq_info
 ========
 
@@ -180,226 +185,362 @@ assigned tax_ids of a higher threshold that *could* represent invalid tax_ids
 (tax_ids that may *not* have passed the rank threshold).
 """
 
+import cPickle
+import hashlib
+import itertools
 import os
 import sys
 import logging
 
+import numpy as np
 import pandas as pd
-import math
 
-from bioy_pkg import sequtils, _data as datadir
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from bioy_pkg import sequtils, utils
+from bioy_pkg.references import (
+    DEFAULT_RANK_THRESHOLDS, read_seq_info, read_rank_thresholds,
+    resolve_thresholds, cached_thresholds, read_refpack, read_qseqid_map,
+    cached_qseqid_map, SeqInfo)
+from bioy_pkg.taxtable import TaxTable
 
 log = logging.getLogger(__name__)
 
 ASSIGNMENT_TAX_ID = 'assignment_tax_id'
 
+# change when classify_hits results saved by save_specimens change
+SPECIMEN_CACHE_VERSION = 1
+
+# --details-out file extensions written as HDF5
+HDF5_EXTENSIONS = {'.h5', '.hdf5'}
+
 
 def raw_filtering(blast_results, min_coverage=None,
                   max_identity=None, min_identity=None):
     """run raw hi, low and coverage filters and output log information
     """
 
-    blast_results_len = len(blast_results)
+    filters = [
+        (min_coverage, 'qcovs', np.greater_equal,
+         'dropping {} sequences below coverage threshold'),
+        (max_identity, 'pident', np.less_equal,
+         'dropping {} sequences above max_identity'),
+        (min_identity, 'pident', np.greater_equal,
+         'dropping {} sequences below min_identity')]
+
+    keep = np.ones(len(blast_results), dtype=bool)
+    for threshold, column, op, msg in filters:
+        if threshold:
+            with np.errstate(invalid='ignore'):
+                passed = op(blast_results[column].values, threshold)
+            # report the hits dropped by each filter in turn
+            len_diff = (keep & ~passed).sum()
+            if len_diff:
+                log.warn(msg.format(len_diff))
+            keep &= passed
+
+    if keep.all():
+        return blast_results
+
+    return blast_results[keep]
+
+
+def best_n_hits(df, best_n):
+    """Filter all hits with more mismatches than the Nth best hit of
+    each (specimen, qseqid).
+
+    A hit is kept if fewer than `best_n' hits of its qseqid have fewer
+    mismatches, so its rank by mismatches (ties sharing the lowest
+    rank) is at most `best_n'.
+    """
 
-    if min_coverage:
-        # run raw hi, low and coverage filters
-        blast_results = blast_results[
-            blast_results['qcovs'] >= min_coverage]
+    groups = np.zeros(len(df), dtype=np.int64)
+    for k in ['specimen', 'qseqid']:
+        codes, uniques = pd.factorize(df[k])
+        groups = groups * len(uniques) + codes
 
-        blast_results_post_len = len(blast_results)
+    mismatch = df['mismatch'].values.astype(float)
+    order = np.lexsort((mismatch, groups))
+    groups, mismatch = groups[order], mismatch[order]
 
-        len_diff = blast_results_len - blast_results_post_len
-        if len_diff:
-            log.warn('dropping {} sequences below '
-                     'coverage threshold'.format(len_diff))
+    # positions of the first hit of each group and of each distinct
+    # mismatch value within a group
+    positions = np.arange(len(df))
+    group_start = np.ones(len(df), dtype=bool)
+    group_start[1:] = groups[1:] != groups[:-1]
+    value_start = group_start.copy()
+    value_start[1:] |= mismatch[1:] != mismatch[:-1]
 
-        blast_results_len = blast_results_post_len
+    group_start = np.maximum.accumulate(np.where(group_start, positions, 0))
+    value_start = np.maximum.accumulate(np.where(value_start, positions, 0))
 
-    if max_identity:
-        blast_results = blast_results[
-            blast_results['pident'] <= max_identity]
+    keep = np.empty(len(df), dtype=bool)
+    keep[order] = (value_start - group_start < best_n) & ~np.isnan(mismatch)
+    return df[keep]
 
-        blast_results_post_len = len(blast_results)
 
-        len_diff = blast_results_len - blast_results_post_len
-        if len_diff:
-            log.warn('dropping {} sequences above max_identity'.format(
-                len_diff))
+def round_up(s):
+    """round up any value of Series s < 0.01
+    """
+    return s.where(s >= 0.01, 0.01)
 
-        blast_results_len = blast_results_post_len
 
-    if min_identity:
-        blast_results = blast_results[
-            blast_results['pident'] >= min_identity]
+def group_labels(df, keys):
+    """Label the rows of `df', sorted by columns `keys', with the
+    consecutive integer of their group.  Returns the labels and the
+    first row of each group.
+    """
 
-        blast_results_post_len = len(blast_results)
+    same = np.ones(len(df), dtype=bool)
+    for k in keys:
+        values = df[k].values
+        same[1:] &= values[1:] == values[:-1]
+    same[:1] = False
+    return np.cumsum(~same) - 1, np.flatnonzero(~same)
 
-        len_diff = blast_results_len - blast_results_post_len
-        if len_diff:
-            log.warn('dropping {} sequences below min_identity'.format(
-                len_diff))
 
-        blast_results_len = blast_results_post_len
+def condense_ids(df, taxonomy, ranks, max_group_size, cache=None):
+    """
+    Return the condensed id of the assignment_tax_id of each hit, the
+    assignment_tax_ids of each (specimen, qseqid) being condensed
+    together.
 
-    return blast_results
+    Many qseqids share the same set of assignment_tax_ids so results
+    are kept in `cache', a utils.LRUCache, keyed on the set of tax_ids
+    and the condensing parameters.
+    """
 
+    keys = ['specimen', 'qseqid']
 
-def round_up(x):
-    """round up any x < 0.01
-    """
-    return max(0.01, x)
+    ids = df[keys + [ASSIGNMENT_TAX_ID]].drop_duplicates()
+    ids = ids.sort_values(by=keys + [ASSIGNMENT_TAX_ID])
+    _, starts = group_labels(ids, keys)
+    stops = np.append(starts[1:], len(ids))
 
+    tax_ids = ids[ASSIGNMENT_TAX_ID].values
+    condensed = np.empty(len(ids), dtype=object)
+    params = (max_group_size, tuple(ranks))
 
-def star(df, starred):
-    """Assign boolean if any items in the
-    dataframe are above the star threshold.
-    """
+    for start, stop in zip(starts, stops):
+        group = tax_ids[start:stop]
+        key = (frozenset(group), params)
+        mapping = cache.get(key) if cache is not None else None
+        if mapping is None:
+            mapping = sequtils.condense_ids(
+                group, taxonomy, ranks=ranks, max_size=max_group_size)
+            if cache is not None:
+                cache.put(key, mapping)
+        condensed[start:stop] = [mapping[t] for t in group]
 
-    df['starred'] = df.pident.apply(lambda x: x >= starred).any()
-    return df
+    ids['condensed_id'] = condensed
+    return df[ids.columns[:-1]].merge(ids, how='left')['condensed_id'].values
 
 
-def condense_ids(
-        df, tax_dict, ranks, max_group_size, threshold_assignments=False):
+def assignment_hashes(df, threshold_assignments=False):
     """
-    Create mapping from tax_id to its condensed id.  Also creates the
-    assignment hash on either the condensed_id or assignment_tax_id decided
-    by the --split-condensed-assignments switch.
-
-    By taking a hash of the set (frozenset) of ids the qseqid is given a
-    unique identifier (the hash).  Later, we will use this hash and
-    assign an ssignment name based on either the set of condensed_ids or
-    assignment_tax_ids.  The modivation for using a hash rather than
-    the actual assignment text for grouping is that the assignment text
-    can contains extra annotations that are independent of which
-    assignment group a qseqid belongs to such as a 100% id star.
+    Create the assignment hash of each hit on either the set of
+    condensed_ids or assignment_tax_ids of its qseqid, decided by the
+    --split-condensed-assignments switch.
+
+    Qseqids with the same set of ids share an assignment hash.  Later,
+    we will use this hash and assign an assignment name based on the
+    set of ids.  The motivation for using a hash rather than the actual
+    assignment text for grouping is that the assignment text can
+    contain extra annotations that are independent of which assignment
+    group a qseqid belongs to such as a 100% id star.
+
+    Hashes number the distinct sets in sorted order starting at 1 (0
+    is used for [no blast result]) so they are the same regardless of
+    process, blast result order or chunking.
     """
 
-    condensed = sequtils.condense_ids(
-        df[ASSIGNMENT_TAX_ID].unique(),
-        tax_dict,
-        ranks=ranks,
-        max_size=max_group_size)
+    keys = ['specimen', 'qseqid']
+    column = ASSIGNMENT_TAX_ID if threshold_assignments else 'condensed_id'
 
-    condensed = pd.DataFrame(
-        condensed.items(),
-        columns=[ASSIGNMENT_TAX_ID, 'condensed_id'])
-    condensed = condensed.set_index(ASSIGNMENT_TAX_ID)
+    ids = df[keys + [column]].drop_duplicates()
+    ids = ids.sort_values(by=keys + [column])
+    groups, starts = group_labels(ids, keys)
 
-    if threshold_assignments:
-        assignment_hash = hash(frozenset(condensed.index.unique()))
-    else:
-        assignment_hash = hash(frozenset(condensed['condensed_id'].unique()))
+    # concatenate the sorted ids of each qseqid into a single key
+    sets = np.add.reduceat(ids[column].values.astype(object) + '|', starts)
+    hashes = ids.iloc[starts][keys]
+    hashes['assignment_hash'] = pd.factorize(sets, sort=True)[0] + 1
+
+    return df[keys].merge(hashes, how='left')['assignment_hash'].values
 
-    condensed['assignment_hash'] = assignment_hash
-    return df.join(condensed, on=ASSIGNMENT_TAX_ID)
 
+def name_assignments(df, taxonomy, starred):
+    """Star condensed ids and create the compound assignment names of
+    each (specimen, assignment_hash) group.  Returns the starred and
+    assignment columns in the row order of `df'.
 
-def assign(df, tax_dict):
-    """Create str assignment based on tax_ids str and starred boolean.
+    A condensed id is starred in its group if any of its hits has a
+    pident of at least `starred'.  Many groups share the same set of
+    starred condensed ids, so each distinct set is named once.
     """
 
-    ids_stars = df.groupby(by=['condensed_id', 'starred']).groups.keys()
-    df['assignment'] = sequtils.compound_assignment(ids_stars, tax_dict)
-    return df
+    by = ['specimen', 'assignment_hash', 'condensed_id']
+    pident = df.groupby(by=by, sort=False)['pident'].transform('max')
+    stars = (pident >= starred).values
+
+    by = ['specimen', 'assignment_hash']
+    ids = df[by + ['condensed_id']].assign(starred=stars).drop_duplicates()
+    ids = ids.sort_values(by=by + ['condensed_id'])
+    _, starts = group_labels(ids, by)
+    stops = np.append(starts[1:], len(ids))
+
+    # concatenate the sorted, starred ids of each group into a single key
+    condensed, is_starred = ids['condensed_id'].values, ids['starred'].values
+    tokens = condensed.astype(object) + np.where(is_starred, '*|', '|')
+    keys = pd.factorize(np.add.reduceat(tokens, starts))[0]
 
+    # name the set of the first group with each key
+    _, first = np.unique(keys, return_index=True)
+    sets = [zip(condensed[starts[g]:stops[g]],
+                is_starred[starts[g]:stops[g]]) for g in first]
+    names = np.array(
+        sequtils.compound_assignments(sets, taxonomy), dtype=object)
 
-def assignment_id(df):
-    """Resets and drops the current dataframe's
-    index and sets it to the assignment_hash
+    groups = ids.iloc[starts][by]
+    groups['assignment'] = names[keys]
+    assignments = df[by].merge(groups, how='left')['assignment'].values
+
+    return pd.DataFrame({'starred': stars, 'assignment': assignments},
+                        index=df.index, columns=['starred', 'assignment'])
+
+
+def assignment_ids(output):
+    """Index `output', sorted by specimen, by specimen and the order of
+    each row within its specimen as assignment_id.
 
     assignment_id is treated as a string identifier to account
     for hits in details with no assignment or assignment_id
     """
-    df = df.reset_index(drop=True)  # specimen is retained in the group key
-    df.index.name = 'assignment_id'
-    df.index = df.index.astype(str)
-    return df
+
+    specimens = output.index.get_level_values('specimen')
+    ids = output.groupby(specimens, sort=False).cumcount()
+    output.index = pd.MultiIndex.from_arrays(
+        [specimens, ids.values.astype(str)],
+        names=['specimen', 'assignment_id'])
+    return output
 
 
-def best_rank(s, ranks):
-    """Create aggregate columns for assignments.
+def best_rank(df, by, ranks):
+    """Return the most common condensed_rank of each `by' group of `df'
+    as a Series indexed by `by'.  Ties go to the most specific rank.
 
     `ranks' are sorted with less specific first for example:
 
     ['root', 'kingdom', 'phylum', 'order', 'family',
      'genus', 'species_group', 'species']
 
-    so when sorting the indexes the most specific
-    rank will be in the iloc[-1] location
+    Groups without a condensed_rank ([no blast result]) are missing.
     """
 
-    value_counts = s.value_counts()
-    if len(value_counts) == 0:
-        # [no blast result]
-        return None
-    else:
-        def specificity(r):
-            return ranks.index(r) if r in ranks else -1
-        majority_rank = value_counts[value_counts == value_counts.max()]
-        majority_rank.name = 'rank'
-        majority_rank = majority_rank.to_frame()
-        majority_rank['specificity'] = majority_rank['rank'].apply(specificity)
-        majority_rank = majority_rank.sort_values(by=['specificity'])
-        # most precise rank is at the highest index (-1)
-        return majority_rank.iloc[-1].name
-
-
-def find_tax_id(series, valids, r, ranks):
-    """Return the most taxonomic specific tax_id available for the given
-    Series.  If a tax_id is already present in valids[r] then return None.
-    """
+    counts = df.groupby(by=by + ['condensed_rank'], sort=False).size()
+    counts = counts.reset_index(name='count')
+
+    specificity = pd.Series(np.arange(len(ranks)), index=ranks)
+    counts['specificity'] = counts['condensed_rank'].map(
+        specificity).fillna(-1)
 
-    index = ranks.index(r)
-    series = series[ranks[index:]]
-    series = series[~series.isnull()]
-    found = series.head(n=1)
-    key = found.index.values[0]
-    value = found.values[0]
-    return value if value not in valids[key].unique() else None
+    counts = counts.sort_values(by=['count', 'specificity'])
+    counts = counts.drop_duplicates(subset=by, keep='last')
+    return counts.set_index(by)['condensed_rank']
 
 
-def select_valid_hits(df, ranks):
+def select_valid_hits(df, taxonomy, thresholds, below_threshold=False):
     """Return valid hits of the most specific rank that passed their
     corresponding rank thresholds.  Hits that pass their rank thresholds
     but do not have a tax_id at that rank will be bumped to a less specific
     rank id and varified as a unique tax_id.
+
+    Hits are identified by their `tax_code' in TaxTable `taxonomy' and
+    the `threshold_row' of their rank `thresholds' (see
+    join_thresholds).  Every (specimen, qseqid) group is evaluated at
+    once using rank-by-hit arrays of codes; results are returned ordered
+    by specimen and qseqid as in a sorted groupby.
+
+    Returns the valid hits and, if `below_threshold', the remaining
+    hits split off by the same mask (otherwise None).
     """
 
-    for r in ranks:
-        thresholds = df['{}_threshold'.format(r)]
-        pidents = df['pident']
-        valid = df[thresholds < pidents]
+    keys = ['specimen', 'qseqid']
 
-        if valid.empty:
-            # Move to higher rank
-            continue
+    # groupby drops null keys
+    df = df[df[keys].notnull().all(axis=1)]
+    df = df.sort_values(by=keys)  # multi-column sorts are stable
 
-        tax_ids = valid[r]
-        na_ids = tax_ids.isnull()
+    if df.empty:
+        hits_below = df if below_threshold else None
+        df = df.copy()
+        df[ASSIGNMENT_TAX_ID] = None
+        df['assignment_threshold'] = None
+        return df, hits_below
 
-        # Occasionally tax_ids will be missing at a certain rank.
-        # If so use the next less specific tax_id available
-        if na_ids.all():
-            continue
+    # label each (specimen, qseqid) group with a consecutive integer
+    groups, starts = group_labels(df, keys)
 
-        if na_ids.any():
-            # bump up missing taxids
-            have_ids = valid[tax_ids.notnull()]
-            found_ids = valid[na_ids].apply(
-                find_tax_id, args=(have_ids, r, ranks), axis=1)
-            tax_ids = have_ids[r].append(found_ids)
+    rows = np.arange(len(df))
+    nranks = len(taxonomy.ranks)
 
-        valid[ASSIGNMENT_TAX_ID] = tax_ids
-        valid['assignment_threshold'] = thresholds
-        # return notnull() assignment_threshold valid values
-        return valid[valid[ASSIGNMENT_TAX_ID].notnull()]
+    # ranks ordered with most specific first
+    tax_ids = taxonomy.lineages[df['tax_code'].values][:, ::-1]
+    has_id = tax_ids >= 0
+    thresholds = thresholds[
+        ['{}_threshold'.format(r) for r in taxonomy.ranks[::-1]]]
+    thresholds = thresholds.values.astype(float)[df['threshold_row'].values]
+    with np.errstate(invalid='ignore'):
+        passed = thresholds < df['pident'].values.astype(float)[:, None]
 
-    # nothing passed
-    df[ASSIGNMENT_TAX_ID] = None
-    df['assignment_threshold'] = None
+    # the most specific rank per group with at least one passing tax_id
+    hits = passed & has_id
+    best = np.where(hits.any(axis=1), hits.argmax(axis=1), nranks)
+    best = np.minimum.reduceat(best, starts)[groups]
+    selected = best < nranks
+    best[~selected] = 0
 
-    return pd.DataFrame(columns=df.columns)
+    valid = selected & passed[rows, best]
+    have = valid & has_id[rows, best]
+
+    assignments = np.empty(len(df), dtype=np.int32)
+    assignments.fill(-1)
+    assignments[have] = tax_ids[rows[have], best[have]]
+
+    # Occasionally tax_ids will be missing at a certain rank.  If so use
+    # the next less specific tax_id available unless that id is already
+    # represented by a hit with a tax_id at the selected rank.
+    bumped = np.flatnonzero(valid & ~have)
+    if len(bumped):
+        below = np.arange(nranks) < best[bumped][:, None]
+        available = has_id[bumped] & ~below
+        found = available.any(axis=1)
+        bumped, available = bumped[found], available[found]
+        bumped_ranks = available.argmax(axis=1)
+
+        for r in np.unique(bumped_ranks):
+            these = bumped[bumped_ranks == r]
+            values = tax_ids[these, r]
+            existing = np.flatnonzero(have & np.in1d(groups, groups[these]))
+
+            codes, _ = pd.factorize(
+                np.concatenate([tax_ids[existing, r], values]))
+            codes = groups[np.concatenate([existing, these])] * (
+                codes.max() + 2) + codes
+            duplicate = np.in1d(codes[len(existing):], codes[:len(existing)])
+
+            assignments[these[~duplicate]] = values[~duplicate]
+
+    keep = assignments >= 0
+
+    hits_below = df[~keep] if below_threshold else None
+
+    df[ASSIGNMENT_TAX_ID] = taxonomy.take(assignments, 'tax_id')
+    df['assignment_threshold'] = np.where(
+        keep, thresholds[rows, best], np.nan)
+
+    return df[keep], hits_below
 
 
 def calculate_pct_references(df, pct_reference):
@@ -411,79 +552,317 @@ def calculate_pct_references(df, pct_reference):
     return df
 
 
-def pct(s):
-    """Calculate series pct something
-    """
-
-    return s / s.sum() * 100
-
-
-def load_rank_thresholds(
-        path=os.path.join(datadir, 'rank_thresholds.csv'), usecols=None):
-    """Load a rank-thresholds file.  If no argument is specified the default
-    rank_threshold_defaults.csv file will be loaded.
+def pct(df, column, level='specimen'):
+    """Calculate pct of `column' within each `level' group of `df'
     """
 
-    return pd.read_csv(
-        path,
-        comment='#',
-        usecols=['tax_id'] + usecols,
-        dtype=dict(tax_id=str)).set_index('tax_id')
+    total = df.groupby(level=level, sort=False)[column].transform('sum')
+    return df[column] / total * 100
 
 
 def copy_corrections(copy_numbers, blast_results, user_file=None):
     copy_numbers = pd.read_csv(
         copy_numbers,
         dtype=dict(tax_id=str, median=float),
-        usecols=['tax_id', 'median']).set_index('tax_id')
+        usecols=['tax_id', 'median']).set_index('tax_id')['median']
+    copy_numbers = copy_numbers.groupby(level=0, sort=False).last()
 
     # get root out (taxid: 1) and set it as the default correction value
-
-    # set index nana (no blast result) to the defaul value
-    default = copy_numbers.get_value('1', 'median')
-    default_entry = pd.DataFrame(default, index=[None], columns=['median'])
-    copy_numbers = copy_numbers.append(default_entry)
+    # for tax_ids not present and hits with no blast result
+    default = copy_numbers.loc['1']
 
     # do our copy number correction math
     corrections = blast_results[
         [ASSIGNMENT_TAX_ID, 'specimen', 'assignment_hash']]
     corrections = corrections.drop_duplicates()
-    corrections = corrections.set_index(ASSIGNMENT_TAX_ID)
-    corrections = corrections.join(copy_numbers)
-    # any tax_id not present will receive default tax_id
-    corrections['median'] = corrections['median'].fillna(default)
-    corrections = corrections.groupby(
-        by=['specimen', 'assignment_hash'], sort=False)
-    corrections = corrections['median'].mean()
-    return corrections
+    medians = corrections[ASSIGNMENT_TAX_ID].map(copy_numbers)
+    medians = medians.fillna(default)
+    corrections = medians.groupby(
+        by=[corrections['specimen'], corrections['assignment_hash']],
+        sort=False)
+    return corrections.mean()
 
 
-def join_thresholds(df, thresholds, ranks):
+def join_thresholds(df, taxonomy, resolved):
     """Thresholds are matched to thresholds by rank id.
 
     If a rank id is not present in the thresholds then the next specific
     rank id is used all the way up to `root'.  If the root id still does
     not match then a warning is issued with the taxname and the blast hit
     is dropped.
+
+    `resolved' are the threshold rows and ranks of each node in TaxTable
+    `taxonomy' from resolve_thresholds.  The row of each hit is added as
+    column `threshold_row' and hits are returned ordered by the
+    specificity of the matching rank.
     """
-    with_thresholds = pd.DataFrame(columns=df.columns)  # temp DFrame
 
-    for r in ranks:
-        with_thresholds = with_thresholds.append(
-            df.join(thresholds, on=r, how='inner'))
-        no_threshold = df[~df.index.isin(with_thresholds.index)]
-        df = no_threshold
+    codes = df['tax_code'].values
+    rows, ranks = (a.take(codes) for a in resolved)
 
     # issue warning messages for everything that did not join
-    if len(df) > 0:
-        tax_names = df['tax_name'].drop_duplicates()
+    no_threshold = ranks < 0
+    if no_threshold.any():
+        tax_names = taxonomy.take(codes[no_threshold], 'tax_name')
         msg = ('dropping blast hit `{}\', no valid '
                'taxonomic threshold information found')
-        tax_names.apply(lambda x: log.warn(msg.format(x)))
+        for tax_name in pd.unique(tax_names):
+            log.warn(msg.format(tax_name))
+
+    # most specific rank matches first, otherwise in blast results order
+    order = np.argsort(-ranks, kind='mergesort')
+    order = order[~no_threshold[order]]
+
+    with_thresholds = df.iloc[order].copy()
+    with_thresholds['threshold_row'] = rows[order]
 
     return with_thresholds
 
 
+def decode_hits(df, taxonomy, seq_info):
+    """Replace the integer `seq_code', `tax_code' and `threshold_row'
+    columns of hits with the tax_id, accession, tax_name and rank they
+    encode in TaxTable `taxonomy' and SeqInfo `seq_info'.
+    """
+
+    seq_codes = df['seq_code'].values
+    tax_codes = df['tax_code'].values
+
+    df = df.drop(['seq_code', 'tax_code', 'threshold_row'], axis=1)
+    df['tax_id'] = taxonomy.tax_ids.take(tax_codes)
+    df['accession'] = seq_info.accession(seq_codes)
+    df['tax_name'] = taxonomy.names.take(tax_codes)
+    df['rank'] = taxonomy.node_ranks.take(tax_codes)
+    return df
+
+
+def include_ref_ranks(df, taxonomy, ranks):
+    """Add {rank}_id and {rank}_name columns for each of `ranks' with the
+    tax_id and tax_name of the ancestor of each hit's tax_id at that
+    rank, read from the lineages of TaxTable `taxonomy'.  Hits without
+    an ancestor at a rank are given id 0 and no name.
+    """
+
+    codes = taxonomy.codes(df['tax_id'])
+    for rank in ranks:
+        ancestors = taxonomy.lineages[codes, taxonomy.ranks.index(rank)]
+        ids = taxonomy.take(ancestors, 'tax_id')
+        ids[ancestors < 0] = 0
+        df[rank + '_id'] = ids
+        df[rank + '_name'] = taxonomy.take(ancestors, 'tax_name')
+    return df
+
+
+def qseqid_chunks(chunks, limit=None):
+    """Regroup an iterable of blast result DataFrames so that all of
+    the hits for a qseqid are in the same chunk.  Hits for each qseqid
+    must be contiguous, as in blast output.  At most `limit' rows are
+    read if specified.
+    """
+
+    seen = set()
+    remainder = None
+    nrows = 0
+
+    def contiguous(chunk):
+        # test the chunk's qseqids against the set rather than hashing
+        # every qseqid seen so far again for each chunk
+        qseqids = chunk['qseqid'].unique()
+        if any(q in seen for q in qseqids):
+            raise ValueError('hits for each qseqid must be contiguous '
+                             'in blast_file when using --chunksize')
+        seen.update(qseqids)
+        return chunk
+
+    for chunk in chunks:
+        if limit is not None:
+            chunk = chunk.iloc[:limit - nrows]
+            nrows += len(chunk)
+
+        if remainder is not None:
+            chunk = pd.concat([remainder, chunk])
+
+        if not chunk.empty:
+            # hold back the hits of the last qseqid until the next chunk
+            qseqids = chunk['qseqid'].values
+            last = qseqids[::-1] != qseqids[-1]
+            split = len(chunk) - last.argmax() if last.any() else 0
+            chunk, remainder = chunk.iloc[:split], chunk.iloc[split:]
+
+            if not chunk.empty:
+                yield contiguous(chunk)
+
+        if limit is not None and nrows >= limit:
+            break
+
+    if remainder is not None and not remainder.empty:
+        yield contiguous(remainder)
+
+
+def frame_checksum(df, *keys):
+    """Return the sha1 hex digest of the columns and values of `df' and
+    any additional string `keys'.
+    """
+
+    sha1 = hashlib.sha1()
+    for key in keys:
+        sha1.update(key + '\0')
+    for c in df.columns:
+        values = df[c].values
+        sha1.update('{}:{}\0'.format(c, values.dtype))
+        if values.dtype == object:
+            sha1.update('\0'.join(map(str, values)))
+        else:
+            sha1.update(values.tobytes())
+    return sha1.hexdigest()
+
+
+def specimen_frames(blast_results):
+    """Yield (specimen, hits) for each specimen in blast_file order
+    """
+
+    for specimen, hits in blast_results.groupby('specimen', sort=False):
+        yield specimen, hits.sort_index(kind='mergesort')
+
+
+def load_specimens(cache_dir, blast_results, key):
+    """Load the classify_hits results of specimens whose hits, along
+    with `key' identifying the reference data and parameters, were
+    saved to `cache_dir' by save_specimens.  Returns the results of
+    the cached specimens, the hits of the remaining specimens and the
+    checksum of each remaining specimen.
+    """
+
+    cached, remaining, checksums = [], [], {}
+    for specimen, hits in specimen_frames(blast_results):
+        checksum = frame_checksum(hits, key)
+        path = os.path.join(cache_dir, 'specimen-{}.pkl'.format(checksum))
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                qseqids, columns, valid_hits, below = cPickle.load(f)
+            # restore the row labels of this run
+            for df in [qseqids, valid_hits, below]:
+                if df is not None:
+                    df.index = hits.index.take(df.index)
+            cached.append((qseqids, columns, valid_hits, below))
+        else:
+            remaining.append(hits)
+            checksums[specimen] = checksum
+
+    log.info('{} of {} specimens loaded from {}'.format(
+        len(cached), len(cached) + len(remaining), cache_dir))
+
+    if remaining:
+        remaining = pd.concat(remaining).sort_index(kind='mergesort')
+    else:
+        remaining = blast_results.iloc[:0]
+
+    return cached, remaining, checksums
+
+
+def save_specimens(cache_dir, blast_results, classified, checksums):
+    """Save the classify_hits results `classified' of the specimens in
+    `blast_results' to `cache_dir' for load_specimens.
+    """
+
+    qseqids, columns, valid_hits, below = zip(*classified)
+    qseqids = pd.concat(qseqids)
+    valid_hits = pd.concat(valid_hits)
+    below = pd.concat(below) if below[0] is not None else None
+
+    def select(df, specimen, hits):
+        if df is None:
+            return None
+        df = df[df['specimen'] == specimen].copy()
+        # row labels relative to the hits of this specimen
+        df.index = hits.index.get_indexer(df.index)
+        return df
+
+    utils.mkdir(cache_dir)
+    for specimen, hits in specimen_frames(blast_results):
+        results = (select(qseqids, specimen, hits),
+                   columns[0],
+                   select(valid_hits, specimen, hits),
+                   select(below, specimen, hits))
+
+        # write then rename so concurrent runs never read a partial file
+        path = os.path.join(
+            cache_dir, 'specimen-{}.pkl'.format(checksums[specimen]))
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            cPickle.dump(results, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+
+
+def partitions(s, n):
+    """Return up to `n' boolean masks splitting Series `s' into
+    partitions where all equal values are in the same partition.
+    """
+
+    codes = pd.factorize(s)[0] % n
+    masks = (codes == i for i in xrange(n))
+    return [m for m in masks if m.any()]
+
+
+# functions run by pool workers are inherited when the workers are
+# forked so the reference data they use is never pickled
+_worker_funcs = {}
+
+
+def _init_worker(funcs):
+    _worker_funcs.update(funcs)
+
+
+def _call_worker(job):
+    name, arg = job
+    return _worker_funcs[name](arg)
+
+
+def write_details(df, path, columns, threads=1, blocksize=100000):
+    """Write `columns' of `df' to `path' as csv, compressed according
+    to the file extension, or as HDF5 with key `details' for the
+    extensions in HDF5_EXTENSIONS.
+
+    Csv is formatted in blocks of `blocksize' rows.  With more than
+    one thread gzip blocks are compressed in parallel as consecutive
+    gzip members, and other files are compressed and written in a
+    background thread while the next block is formatted.  Bzip2 stays
+    a single stream as multi-stream files are truncated by the python
+    2 bz2 module.
+    """
+
+    if os.path.splitext(path)[-1] in HDF5_EXTENSIONS:
+        df[columns].to_hdf(path, 'details', mode='w',
+                           complevel=9, complib='bzip2')
+        return
+
+    starts = xrange(0, max(len(df), 1), blocksize)
+    blocks = (df.iloc[start:start + blocksize].to_csv(
+        None,
+        columns=columns,
+        header=start == 0,
+        index=False,
+        float_format='%.2f') for start in starts)
+
+    if threads > 1 and get_compression(path) == 'gzip':
+        pool = ThreadPool(threads)
+        with open(path, 'wb') as f:
+            for batch in utils.grouper(threads, blocks, pad=False):
+                for member in pool.map(utils.gzip_member, list(batch)):
+                    f.write(member)
+        pool.close()
+        pool.join()
+    elif threads > 1:
+        with utils.opener(path, 'w') as f, \
+                utils.background_writer(f) as write:
+            for block in blocks:
+                write(block)
+    else:
+        with utils.opener(path, 'w') as f:
+            for block in blocks:
+                f.write(block)
+
+
 def get_compression(io):
     if io is sys.stdout:
         compression = None
@@ -500,12 +879,16 @@ def build_parser(parser):
         'blast_file',
         help="""CSV tabular blast file of
                 query and subject hits, containing
-                at least {}.""".format(sequtils.BLAST_FORMAT_DEFAULT))
+                at least {}, or a parquet or feather
+                file (requires pyarrow).""".format(
+            sequtils.BLAST_FORMAT_DEFAULT))
     parser.add_argument(
         'seq_info',
-        help='File mapping reference seq name to tax_id')
+        help="""File mapping reference seq name to tax_id, or a refpack
+        directory compiled by `bioy refpack' in place of seq_info,
+        taxonomy and --rank-thresholds""")
     parser.add_argument(
-        'taxonomy',
+        'taxonomy', nargs='?',
         help="""Table defining the taxonomy for each tax_id""")
 
     # optional inputs
@@ -516,6 +899,17 @@ def build_parser(parser):
     parser.add_argument(
         '--rank-thresholds', metavar='CSV',
         help="""Columns [tax_id,ranks...]""")
+    parser.add_argument(
+        '--cache-dir', metavar='DIR',
+        help="""directory for caching reference data resolved from the
+        taxonomy and rank thresholds, and the --specimen-map and --weights
+        lookups, between runs.  Cached lookups are memory mapped and shared
+        by concurrent runs.""")
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help="""save the classified hits of each specimen in --cache-dir
+        and only classify specimens whose blast results, reference data
+        or options changed since they were saved""")
     parser.add_argument(
         '--specimen-map', metavar='CSV',
         help="""CSV file with columns (name, specimen) assigning sequences to
@@ -537,7 +931,14 @@ def build_parser(parser):
     parser.add_argument(
         '-O', '--details-out',
         metavar='FILE',
-        help="""Optional details of taxonomic assignments.""")
+        help="""Optional details of taxonomic assignments.  Written
+        as HDF5 with key `details' (requires PyTables) if FILE ends
+        with .h5 or .hdf5, otherwise as csv.""")
+
+    parser.add_argument(
+        '--profile-out', metavar='JSON',
+        help="""write the wall and cpu time, peak memory and rows in and
+        out of each stage of classification to a json file""")
 
     # switches and options
     parser.add_argument(
@@ -595,6 +996,11 @@ def build_parser(parser):
         '--pct-reference', action='store_true',
         help="""include column with percent sseqids per assignment_id
         (NOT IMPLEMENTED)""")
+    parser.add_argument(
+        '--condense-cache-size', metavar='INTEGER', default=100000, type=int,
+        help="""number of sets of assignment tax_ids to keep the condensed
+        ids of for reuse by other query sequences; 0 disables
+        [%(default)s]""")
     parser.add_argument(
         '--split-condensed-assignments',
         action='store_true',
@@ -602,6 +1008,13 @@ def build_parser(parser):
         help=('Do not combine common condensed assignments'))
     parser.add_argument(
         '--limit', type=int, help='limit number of blast results')
+    parser.add_argument(
+        '--chunksize', type=int, metavar='INTEGER',
+        help="""read, filter and classify blast results in chunks of about
+        INTEGER rows.  Hits for each qseqid must be contiguous in
+        blast_file.  The valid hits of every chunk are kept for the
+        summary and details so memory use still grows with the number of
+        valid hits, though by less without --details-out.""")
     parser.add_argument(
         '--best-n-hits', type=int,
         help="""for each query sequence, filter out all but the best N hits,
@@ -615,147 +1028,280 @@ def action(args):
     # pd.set_option('display.max_columns', None)
     # pd.set_option('display.max_rows', None)
 
+    if args.details_out and \
+            os.path.splitext(args.details_out)[-1] in HDF5_EXTENSIONS:
+        try:
+            import tables  # noqa
+        except ImportError:
+            sys.exit('HDF5 --details-out requires PyTables and '
+                     'dependencies (see README and requirements.txt)')
+
+    blast_format = utils.columnar_format(args.blast_file)
+    if blast_format:
+        try:
+            import pyarrow  # noqa
+        except ImportError:
+            sys.exit('{} blast_file requires pyarrow'.format(blast_format))
+
+    profiler = utils.StageProfiler()
+
+    if args.incremental:
+        if not args.cache_dir:
+            sys.exit('--incremental requires --cache-dir')
+        if args.chunksize:
+            sys.exit('--incremental cannot be used with --chunksize')
+
     # format blast data and add additional available information
     names = None if args.has_header else sequtils.BLAST_HEADER_DEFAULT
     header = 0 if args.has_header else None
     usecols = ['qseqid', 'sseqid', 'pident', 'qcovs']
     if args.best_n_hits:
         usecols.append('mismatch')
-    log.info('loading blast results')
-    blast_results = pd.read_csv(
-        args.blast_file,
-        dtype=dict(qseqid=str, sseqid=str, pident=float, coverage=float),
-        names=names,
-        na_filter=True,  # False is faster
-        header=header,
-        usecols=usecols,
-        nrows=args.limit)
-
-    if blast_results.empty:
+    with profiler.stage('load_blast'):
+        log.info('loading blast results')
+        if blast_format:
+            blast_chunks = utils.read_columnar(
+                args.blast_file, columns=usecols, chunksize=args.chunksize)
+            if not args.chunksize:
+                blast_chunks = blast_chunks.iloc[:args.limit]
+        else:
+            blast_chunks = pd.read_csv(
+                args.blast_file,
+                dtype=dict(qseqid=str, sseqid=str,
+                           pident=float, coverage=float),
+                names=names,
+                na_filter=True,  # False is faster
+                header=header,
+                usecols=usecols,
+                nrows=None if args.chunksize else args.limit,
+                chunksize=args.chunksize)
+
+        if args.chunksize:
+            blast_chunks = qseqid_chunks(blast_chunks, limit=args.limit)
+        else:
+            blast_chunks = [blast_chunks]
+
+        blast_chunks = (c for c in blast_chunks if not c.empty)
+        first_chunk = next(blast_chunks, None)
+        if first_chunk is not None:
+            blast_chunks = itertools.chain([first_chunk], blast_chunks)
+
+    if first_chunk is None:
         log.info('blast results empty, exiting.')
+        if args.profile_out:
+            profiler.write(args.profile_out)
         return
 
+    def load_qseqid_map(filename, column, dtype):
+        if args.cache_dir:
+            return cached_qseqid_map(args.cache_dir, filename, column, dtype)
+        return read_qseqid_map(filename, column, dtype)
+
     # load specimen-map
     if args.specimen_map:
         # if a specimen_map is defined and a qseqid is not included in the map
         # hits to that qseqid will be dropped (inner join)
-        spec_map = pd.read_csv(
-            args.specimen_map,
-            names=['qseqid', 'specimen'],
-            usecols=['qseqid', 'specimen'],
-            dtype=str)
-        spec_map = spec_map.drop_duplicates()
-        spec_map = spec_map.set_index('qseqid')
-        blast_results = blast_results.join(spec_map, on='qseqid', how='inner')
-    elif args.specimen:
-        blast_results['specimen'] = args.specimen
+        spec_map = load_qseqid_map(args.specimen_map, 'specimen', str)
+
+    with profiler.stage('load_references') as stage:
+        if os.path.isdir(args.seq_info):
+            if args.taxonomy or args.rank_thresholds:
+                sys.exit('a refpack replaces taxonomy and --rank-thresholds')
+            log.info('loading refpack ' + args.seq_info)
+            taxtable, seq_info, rank_thresholds, resolved_thresholds = \
+                read_refpack(args.seq_info)
+            ranks = taxtable.ranks
+        elif not args.taxonomy:
+            sys.exit('taxonomy is required unless seq_info is a refpack')
+        else:
+            # load seq_info as a bridge to the sequence taxonomy.  Additional
+            # columns can be specified to be included in the details-out file
+            # such as accession number
+            seq_info = read_seq_info(args.seq_info)
+
+            # load the full taxonomy table.  Rank specificity as ordered from
+            # left (less specific) to right (more specific)
+            taxtable = TaxTable.read_csv(args.taxonomy)
+            ranks = taxtable.ranks
+
+            # load the default rank thresholds and any additional
+            # thresholds specified by the user
+            rank_thresholds = read_rank_thresholds(ranks, args.rank_thresholds)
+
+            # resolve the thresholds of every tax_id once up front
+            if args.cache_dir:
+                threshold_files = [args.taxonomy, DEFAULT_RANK_THRESHOLDS]
+                if args.rank_thresholds:
+                    threshold_files.append(args.rank_thresholds)
+                resolved_thresholds = cached_thresholds(
+                    args.cache_dir, threshold_files, taxtable, rank_thresholds)
+            else:
+                resolved_thresholds = resolve_thresholds(
+                    taxtable, rank_thresholds)
+
+            # seq_info rows are identified by position in the blast results
+            seq_info = SeqInfo.from_frame(seq_info, taxtable)
+
+        stage['rows_out'] = len(seq_info)
+
+    details_columns = ['specimen', 'assignment_id', 'tax_name', 'rank',
+                       'assignment_tax_name', 'assignment_rank', 'pident',
+                       'tax_id', ASSIGNMENT_TAX_ID, 'condensed_id',
+                       'accession', 'qseqid', 'sseqid', 'starred',
+                       'assignment_threshold']
+
+    # The valid hits of every chunk are kept until all are classified.
+    # Unless details are written (or cached for later runs that may
+    # write them) only the columns the summary reads are kept.
+    if args.details_out or args.incremental:
+        summary_columns = None
     else:
-        blast_results['specimen'] = blast_results['qseqid']  # by qseqid
-
-    # get a set of qseqids for identifying [no blast hits] after filtering
-    qseqids = blast_results[['specimen', 'qseqid']].drop_duplicates()
-
-    blast_results_len = len(blast_results)
-
-    log.info('successfully loaded {} blast results for {} query '
-             'sequences'.format(blast_results_len, len(qseqids)))
-
-    blast_results = raw_filtering(blast_results)
-
-    # remove no blast hits
-    # no_blast_results will be added back later but we do not
-    # want to confuse these with blast results filter by joins
-    log.info('identifying no_blast_hits')
-    blast_results = blast_results[blast_results['sseqid'].notnull()]
-
-    # load seq_info as a bridge to the sequence taxonomy.  Additional
-    # columns can be specified to be included in the details-out file
-    # such as accession number
-    seq_info = pd.read_csv(
-        args.seq_info,
-        usecols=['seqname', 'tax_id', 'accession'],
-        dtype=dict(seqname=str, tax_id=str, accession=str))
-    seq_info = seq_info.set_index('seqname')
-    # rename index to match blast results column name
-    seq_info.index.name = 'sseqid'
-
-    # merge blast results with seq_info - do this early so that
-    # refseqs not represented in the blast results are discarded in
-    # the merge.
-    blast_results_len = len(blast_results)
-    log.info('joining seq_info file')
-    blast_results = blast_results.join(seq_info, on='sseqid', how='inner')
-    len_diff = blast_results_len - len(blast_results)
-    if len_diff:
-        log.warn('{} subject sequences dropped without '
-                 'records in seq_info file'.format(len_diff))
-
-    # load the full taxonomy table.  Rank specificity as ordered from
-    # left (less specific) to right (more specific)
-    taxonomy = pd.read_csv(args.taxonomy, dtype=str).set_index('tax_id')
-
-    # get the a list of rank columns ordered by specificity (see above)
-    # NOTE: we are assuming the rank columns
-    ranks = taxonomy.columns.tolist()
-    ranks = ranks[ranks.index('root'):]
-
-    # now combine just the rank columns to the blast results
-    blast_results_len = len(blast_results)
-    log.info('joining taxonomy file')
-    blast_results = blast_results.join(
-        taxonomy[['tax_name', 'rank'] + ranks], on='tax_id', how='inner')
-    len_diff = blast_results_len - len(blast_results)
-    if len_diff:
-        msg = '{} subject sequences dropped without records in taxonomy file'
-        log.warn(msg.format(len_diff))
-
-    # load the default rank thresholds
-    rank_thresholds = load_rank_thresholds(usecols=ranks)
-
-    # and any additional thresholds specified by the user
-    if args.rank_thresholds:
-        rank_thresholds = rank_thresholds.append(
-            load_rank_thresholds(path=args.rank_thresholds, usecols=ranks))
-        # overwrite with user defined tax_id threshold
-        rank_thresholds = rank_thresholds.groupby(level=0, sort=False).last()
-
-    rank_thresholds_cols = ['{}_threshold'.format(c) if c in ranks else c
-                            for c in rank_thresholds.columns]
-    rank_thresholds.columns = rank_thresholds_cols
-
-    log.info('joining thresholds file')
-    blast_results = join_thresholds(
-        blast_results, rank_thresholds, ranks[::-1])
-
-    # save the blast_results.columns in case groupby drops all columns
-    blast_results_columns = blast_results.columns
-
-    # assign assignment tax ids based on pident and thresholds
-    log.info('selecting valid hits')
-    blast_results_len = float(len(blast_results))
-
-    valid_hits = blast_results.groupby(
-        by=['specimen', 'qseqid'], group_keys=False)
-    valid_hits = valid_hits.apply(select_valid_hits, ranks[::-1])
-
-    if args.hits_below_threshold:
-        """
-        Store all the hits to append to blast_results details later
+        summary_columns = ['specimen', 'qseqid', 'pident', ASSIGNMENT_TAX_ID,
+                           'assignment_threshold', 'condensed_id']
+
+    # shared by the chunks classified in each process
+    condense_cache = utils.LRUCache(args.condense_cache_size)
+
+    def assign_specimens(blast_results):
+        if args.specimen_map:
+            blast_results = spec_map.join(
+                blast_results, 'specimen', how='inner')
+        elif args.specimen:
+            blast_results['specimen'] = args.specimen
+        else:
+            blast_results['specimen'] = blast_results['qseqid']  # by qseqid
+        return blast_results
+
+    blast_chunks = (assign_specimens(c) for c in blast_chunks)
+
+    if args.incremental:
+        # only classify the specimens without cached results
+        reference_files = [args.seq_info]
+        if os.path.isdir(args.seq_info):
+            reference_files = sorted(
+                os.path.join(args.seq_info, f)
+                for f in os.listdir(args.seq_info))
+        else:
+            reference_files += [args.taxonomy, DEFAULT_RANK_THRESHOLDS]
+            if args.rank_thresholds:
+                reference_files.append(args.rank_thresholds)
+        cache_key = repr((
+            SPECIMEN_CACHE_VERSION,
+            utils.checksum(*reference_files),
+            args.best_n_hits,
+            args.hits_below_threshold,
+            args.max_group_size))
+
+        with profiler.stage('load_specimens') as stage:
+            cached_specimens, remaining, specimen_checksums = load_specimens(
+                args.cache_dir, next(blast_chunks), cache_key)
+            if cached_specimens and remaining.empty:
+                blast_chunks = []
+            else:
+                blast_chunks = [remaining]
+            stage['rows_out'] = len(remaining)
+
+    if args.threads > 1 and not args.chunksize:
+        # keep all hits of a qseqid in the same partition
+        blast_chunks = [c[m] for c in blast_chunks
+                        for m in partitions(c['qseqid'], args.threads)]
+
+    def classify_hits(blast_results):
+        """Select and condense the valid hits of each query sequence.
+
+        Every step here depends only on the hits of a single qseqid
+        so blast results can be processed in qseqid-contiguous chunks.
         """
-        hits_below_threshold = blast_results[
-            ~blast_results.index.isin(valid_hits.index)]
 
-    blast_results = valid_hits
+        # get a set of qseqids for identifying [no blast hits] after filtering
+        qseqids = blast_results[['specimen', 'qseqid']].drop_duplicates()
+
+        blast_results_len = len(blast_results)
+
+        log.info('successfully loaded {} blast results for {} query '
+                 'sequences'.format(blast_results_len, len(qseqids)))
+
+        with profiler.stage('raw_filtering', len(blast_results)) as stage:
+            blast_results = raw_filtering(blast_results)
+
+            # remove no blast hits
+            # no_blast_results will be added back later but we do not
+            # want to confuse these with blast results filter by joins
+            log.info('identifying no_blast_hits')
+            blast_results = blast_results[blast_results['sseqid'].notnull()]
+            stage['rows_out'] = len(blast_results)
+
+        # encode blast results by seq_info row - do this early so that
+        # refseqs not represented in the blast results are discarded.
+        # Reference data is carried as integer codes from here on and
+        # decoded only for the hits that make it into the output.
+        with profiler.stage('seq_info_join', len(blast_results)) as stage:
+            log.info('joining seq_info file')
+            # as in a join, hits of a seqname listed more than once in
+            # seq_info are repeated for each of its rows
+            rows, seq_codes = seq_info.lookup(blast_results['sseqid'].values)
+            len_diff = len(blast_results) - len(np.unique(rows))
+            if len_diff:
+                log.warn('{} subject sequences dropped without '
+                         'records in seq_info file'.format(len_diff))
+            stage['rows_out'] = len(rows)
+
+        # now encode the taxonomy node of each hit
+        with profiler.stage('taxonomy_join', len(rows)) as stage:
+            log.info('joining taxonomy file')
+            tax_codes = seq_info.tax_codes.take(seq_codes)
+            in_taxonomy = tax_codes >= 0
+            len_diff = len(rows) - in_taxonomy.sum()
+            if len_diff:
+                msg = ('{} subject sequences dropped without records '
+                       'in taxonomy file')
+                log.warn(msg.format(len_diff))
+
+            blast_results = blast_results.iloc[rows[in_taxonomy]].copy()
+            blast_results['seq_code'] = seq_codes[in_taxonomy]
+            blast_results['tax_code'] = tax_codes[in_taxonomy]
+            stage['rows_out'] = len(blast_results)
+
+        # the specimen map join groups rows by key so restore the
+        # blast_file order to keep results independent of the other
+        # queries in the chunk
+        blast_results = blast_results.sort_index(kind='mergesort')
+
+        log.info('joining thresholds file')
+        with profiler.stage('join_thresholds', len(blast_results)) as stage:
+            blast_results = join_thresholds(
+                blast_results, taxtable, resolved_thresholds)
+            stage['rows_out'] = len(blast_results)
+
+        # save the decoded columns in case groupby drops all columns
+        blast_results_columns = decode_hits(
+            blast_results.iloc[:0], taxtable, seq_info).columns
+
+        # assign assignment tax ids based on pident and thresholds
+        log.info('selecting valid hits')
+        blast_results_len = float(len(blast_results))
+
+        with profiler.stage('select_valid_hits', len(blast_results)) as stage:
+            valid_hits, hits_below_threshold = select_valid_hits(
+                blast_results, taxtable, rank_thresholds,
+                below_threshold=args.hits_below_threshold)
+
+            if args.hits_below_threshold:
+                """
+                Store all the hits to append to blast_results details later
+                """
+                hits_below_threshold = decode_hits(
+                    hits_below_threshold, taxtable, seq_info)
+                deets_cols = hits_below_threshold.columns
+                deets_cols &= set(details_columns)
+                hits_below_threshold = hits_below_threshold[list(deets_cols)]
+            stage['rows_out'] = len(valid_hits)
 
-    if blast_results.empty:
-        log.info('all blast results filtered, returning [no blast results]')
-        assignment_columns = ['assignment_rank', 'assignment_threshold',
-                              'assignment_tax_name', 'condensed_id', 'starred',
-                              'assignment', 'assignment_hash',
-                              'condensed_rank', ASSIGNMENT_TAX_ID]
-        assignment_columns += blast_results_columns.tolist()
-        blast_results = pd.DataFrame(columns=assignment_columns)
-    else:
+        blast_results = valid_hits
+
+        if blast_results.empty:
+            return (qseqids, blast_results_columns,
+                    blast_results, hits_below_threshold)
 
         blast_results_post_len = len(blast_results)
         log.info('{} ({:.0%}) valid hits selected'.format(
@@ -765,18 +1311,9 @@ def action(args):
         if args.best_n_hits:
             blast_results_len = len(blast_results)
 
-            def filter_mismatches(df, best_n):
-                """
-                Filter all hits with more mismatches than the Nth best hit
-                """
-
-                threshold = df['mismatch'].nsmallest(best_n).iloc[-1]
-                return df[df['mismatch'] <= threshold]
-
-            # Filter hits for each query
-            blast_results = blast_results.groupby(
-                by=['specimen', 'qseqid'],
-                group_keys=False).apply(filter_mismatches, args.best_n_hits)
+            with profiler.stage('best_n_hits', blast_results_len) as stage:
+                blast_results = best_n_hits(blast_results, args.best_n_hits)
+                stage['rows_out'] = len(blast_results)
 
             blast_results_post_len = len(blast_results)
             log.info('{} ({:.0%}) hits remain after filtering '
@@ -784,74 +1321,155 @@ def action(args):
                          blast_results_post_len,
                          blast_results_post_len / blast_results_len))
 
-        # drop unneeded tax and threshold columns to free memory
-        for c in ranks + rank_thresholds_cols:
-            blast_results = blast_results.drop(c, axis=1)
-
-        # join with taxonomy for tax_name and rank
-        blast_results = blast_results.join(
-            taxonomy[['tax_name', 'rank']],
-            rsuffix='_assignment',
-            on=ASSIGNMENT_TAX_ID)
-
-        # no join(rprefix) (yet)
-        blast_results = blast_results.rename(
-            columns={'tax_name_assignment': 'assignment_tax_name',
-                     'rank_assignment': 'assignment_rank'})
+        with profiler.stage('decode', len(blast_results)) as stage:
+            blast_results = decode_hits(blast_results, taxtable, seq_info)
 
-        # TODO: this is relatively slow, need to integrate
-        # pandas into sequtils.condense_ids
-        tax_dict = {i: t.to_dict() for i, t in taxonomy.fillna('').iterrows()}
+            # join with taxonomy for tax_name and rank
+            codes = taxtable.codes(blast_results[ASSIGNMENT_TAX_ID])
+            blast_results['assignment_tax_name'] = taxtable.take(
+                codes, 'tax_name')
+            blast_results['assignment_rank'] = taxtable.take(codes, 'rank')
+            stage['rows_out'] = len(blast_results)
 
-        # create condensed assignment hashes by qseqid
+        # create condensed ids by qseqid
         msg = 'condensing group tax_ids to size {}'.format(args.max_group_size)
         log.info(msg)
-        blast_results = blast_results.groupby(
-            by=['specimen', 'qseqid'], sort=False, group_keys=False)
-        blast_results = blast_results.apply(
-            condense_ids,
-            tax_dict,
-            ranks,
-            args.max_group_size,
-            threshold_assignments=args.threshold_assignments)
-
-        blast_results = blast_results.join(
-            taxonomy[['rank']], on='condensed_id', rsuffix='_condensed')
-
-        blast_results = blast_results.rename(
-            columns={'rank_condensed': 'condensed_rank'})
-
-        # star condensed ids if one hit meets star threshold
-        by = ['specimen', 'assignment_hash', 'condensed_id']
-        blast_results = blast_results.groupby(
-            by=by, sort=False, group_keys=False)
-        blast_results = blast_results.apply(star, args.starred)
-
-        # assign names to assignment_hashes
-        blast_results = blast_results.sort_values(by='assignment_hash')
+        with profiler.stage('condense', len(blast_results)) as stage:
+            blast_results['condensed_id'] = condense_ids(
+                blast_results,
+                taxtable,
+                ranks,
+                args.max_group_size,
+                cache=condense_cache)
+            stage['rows_out'] = len(blast_results)
+        log.info('condense_ids cache: ' + condense_cache.stats())
+
+        if summary_columns:
+            blast_results = blast_results[summary_columns]
+
+        return (qseqids, blast_results_columns,
+                blast_results, hits_below_threshold)
+
+    def profiled(func):
+        # return the stages recorded by func along with its result so
+        # stages recorded in pool workers reach the main process
+        def wrapper(arg):
+            start = len(profiler.stages)
+            result = func(arg)
+            return result, profiler.pop(start)
+        return wrapper
+
+    workers = dict(
+        classify_hits=profiled(classify_hits),
+        name_assignments=profiled(lambda df: name_assignments(
+            df, taxtable, args.starred)))
+
+    if args.threads > 1:
+        pool = Pool(args.threads, _init_worker, (workers,))
+
+        def run(name, items):
+            return pool.map(_call_worker, [(name, i) for i in items])
+    else:
+        pool = None
+
+        def run(name, items):
+            return map(workers[name], items)
+
+    def pool_map(name, items):
+        results = []
+        for result, stages in run(name, items):
+            profiler.extend(stages)
+            results.append(result)
+        return results
+
+    # classify up to args.threads chunks at a time
+    classified = []
+    for chunks in utils.grouper(args.threads, blast_chunks, pad=False):
+        # chunks after the first are read as they are needed
+        with profiler.stage('load_blast') as stage:
+            chunks = list(chunks)
+            stage['rows_out'] = sum(len(c) for c in chunks)
+        classified.extend(pool_map('classify_hits', chunks))
+
+    if args.incremental:
+        if classified:
+            with profiler.stage('save_specimens', len(remaining)):
+                save_specimens(args.cache_dir, remaining, classified,
+                               specimen_checksums)
+        classified.extend(cached_specimens)
+
+    qseqids, blast_results_columns, valid_hits, hits_below_threshold = zip(
+        *classified)
+
+    # qseqids are indexed by their first row in the blast_file
+    qseqids = pd.concat(qseqids).sort_index(kind='mergesort')
+    qseqids = qseqids.drop_duplicates()
+    blast_results_columns = blast_results_columns[0]
+    if args.hits_below_threshold:
+        hits_below_threshold = pd.concat(hits_below_threshold)
+
+    valid_hits = [v for v in valid_hits if not v.empty]
+    if len(valid_hits) > 1:
+        # All hits of a qseqid are in the same chunk and each chunk is
+        # ordered by specimen and qseqid so a stable sort gives the same
+        # order as classifying all of the blast results at once.
+        blast_results = pd.concat(valid_hits)
+        blast_results = blast_results.sort_values(by=['specimen', 'qseqid'])
+    elif valid_hits:
+        blast_results = valid_hits[0]
+    else:
+        blast_results = pd.DataFrame()
+
+    if blast_results.empty:
+        log.info('all blast results filtered, returning [no blast results]')
+        assignment_columns = ['assignment_rank', 'assignment_threshold',
+                              'assignment_tax_name', 'condensed_id', 'starred',
+                              'assignment', 'assignment_hash',
+                              'condensed_rank', ASSIGNMENT_TAX_ID]
+        assignment_columns += blast_results_columns.tolist()
+        blast_results = pd.DataFrame(columns=assignment_columns)
+    else:
+        stage = profiler.start('assign', len(blast_results))
+
+        # hashes are numbered across all chunks
+        blast_results['assignment_hash'] = assignment_hashes(
+            blast_results, args.threshold_assignments)
+
+        blast_results['condensed_rank'] = taxtable.take(
+            taxtable.codes(blast_results['condensed_id']), 'rank')
+
+        # star condensed ids if one hit meets star threshold and assign
+        # names to assignment_hashes, partitioning workers by specimen
         log.info('creating compound assignments')
-        blast_results = blast_results.groupby(
-            by=['specimen', 'assignment_hash'], sort=False, group_keys=False)
-        blast_results = blast_results.apply(assign, tax_dict)
-
-        # Foreach ref rank:
-        # - merge with taxonomy, extract rank_id, rank_name
-        for rank in args.include_ref_rank:
-            blast_results[rank + '_id'] = blast_results.merge(
-                taxonomy, left_on='tax_id',
-                right_index=True,
-                how='left')[rank].fillna(0)
-            blast_results[rank + '_name'] = blast_results.merge(
-                taxonomy,
-                left_on=rank + '_id',
-                right_index=True,
-                how='left')['tax_name_y']
+        masks = partitions(blast_results['specimen'], args.threads)
+        columns = ['specimen', 'assignment_hash', 'condensed_id', 'pident']
+        names = pool_map('name_assignments',
+                         [blast_results.loc[m, columns] for m in masks])
+        for c in ['starred', 'assignment']:
+            values = np.empty(len(blast_results), dtype=names[0][c].dtype)
+            for m, n in zip(masks, names):
+                values[m] = n[c].values
+            blast_results[c] = values
+
+        blast_results = blast_results.sort_values(by='assignment_hash')
+
+        if args.include_ref_rank and args.details_out:
+            blast_results = include_ref_ranks(
+                blast_results, taxtable, args.include_ref_rank)
+
+        profiler.stop(stage, len(blast_results))
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    stage = profiler.start('summarize', len(blast_results))
 
     # merge qseqids that have no hits back into blast_results
     blast_results = blast_results.merge(qseqids, how='outer')
 
     # assign seqs that had no results to [no blast_result]
-    no_hits = blast_results['sseqid'].isnull()
+    no_hits = blast_results['assignment_hash'].isnull()
     blast_results.loc[no_hits, 'assignment'] = '[no blast result]'
     blast_results.loc[no_hits, 'assignment_hash'] = 0
 
@@ -868,8 +1486,7 @@ def action(args):
     output['max_percent'] = assignment_stats['pident'].max()
     output['min_percent'] = assignment_stats['pident'].min()
     output['min_threshold'] = assignment_stats['assignment_threshold'].min()
-    output['best_rank'] = assignment_stats['condensed_rank'].apply(
-        best_rank, ranks)
+    output['best_rank'] = best_rank(blast_results, index, ranks)
 
     # qseqid cluster stats
     weights = blast_results[
@@ -877,12 +1494,9 @@ def action(args):
     weights = weights.drop_duplicates().set_index('qseqid')
 
     if args.weights:
-        weights_file = pd.read_csv(
-            args.weights,
-            names=['qseqid', 'weight'],
-            dtype=dict(qseqid=str, weight=float),
-            index_col='qseqid')
-        weights = weights.join(weights_file)
+        weights_map = load_qseqid_map(args.weights, 'weight', float)
+        weights = weights_map.join(
+            weights.reset_index(), 'weight', how='left').set_index('qseqid')
         # enforce weight dtype as float and unlisted qseq's to weight of 1.0
         weights['weight'] = weights['weight'].fillna(1.0).astype(float)
     else:
@@ -897,23 +1511,21 @@ def action(args):
     output['clusters'] = cluster_stats.size()
 
     # specimen level stats
-    specimen_stats = output.groupby(level='specimen', sort=False)
-    output['pct_reads'] = specimen_stats['reads'].apply(pct)
+    output['pct_reads'] = pct(output, 'reads')
 
     # copy number corrections
     if args.copy_numbers:
         corrections = copy_corrections(args.copy_numbers, blast_results)
         output['corrected'] = output['reads'] / corrections
         # reset corrected counts to int before calculating pct_corrected
-        output['corrected'] = output['corrected'].apply(math.ceil)
+        output['corrected'] = np.ceil(output['corrected'])
         output['corrected'] = output['corrected'].fillna(1).astype(int)
         # create pct_corrected column
-        output['pct_corrected'] = specimen_stats['corrected'].apply(pct)
-        output['pct_corrected'] = output['pct_corrected'].map(round_up)
+        output['pct_corrected'] = round_up(pct(output, 'corrected'))
 
-    # round reads for output
-    output['reads'] = output['reads'].apply(round).astype(int)
-    output['pct_reads'] = output['pct_reads'].map(round_up)
+    # round reads (half away from zero) for output
+    output['reads'] = np.floor(output['reads'] + 0.5).astype(int)
+    output['pct_reads'] = round_up(output['pct_reads'])
 
     # sort output by:
     # 1) specimen -- Data Frame is already grouped by specimen
@@ -930,11 +1542,15 @@ def action(args):
     # default algorithm is not stable
     output = output.sort_index(kind='mergesort')
 
-    # one last grouping on the sorted output plus assignment ids by specimen
-    output = output.groupby(level="specimen", sort=False).apply(assignment_id)
+    # number assignment ids in sorted order within each specimen
+    output = assignment_ids(output)
+
+    profiler.stop(stage, len(output))
 
     # output to details.csv.bz2
     if args.details_out:
+        stage = profiler.start('write_details', len(blast_results))
+
         # Annotate details with classification columns
         blast_results = blast_results.merge(output.reset_index(), how='left')
 
@@ -943,23 +1559,15 @@ def action(args):
             by using the assignment_threshold we will get multiple 'largest'
             centroids for --max-group-size combined assignments
             """
-            # groupby will drop NA values so we must fill them with 0
-            weights['assignment_threshold'] = weights[
-                'assignment_threshold'].fillna(0)
-            largest = weights.groupby(
-                by=['specimen', 'assignment_hash', 'assignment_threshold'],
-                sort=False)
-            largest = largest.apply(lambda x: x['weight'].nlargest(1))
-            largest = largest.reset_index()
+            # first of the heaviest qseqids of each group
+            order = np.argsort(-weights['weight'].values, kind='mergesort')
+            largest = weights.iloc[order].reset_index()
+            largest = largest.drop_duplicates(
+                subset=['specimen', 'assignment_hash', 'assignment_threshold'])
             # assignment_threshold will conflict with blast_results NA values
             largest = largest.drop('assignment_threshold', axis=1)
             blast_results = blast_results.merge(largest)
 
-        details_columns = ['specimen', 'assignment_id', 'tax_name', 'rank',
-                           'assignment_tax_name', 'assignment_rank', 'pident',
-                           'tax_id', ASSIGNMENT_TAX_ID, 'condensed_id',
-                           'accession', 'qseqid', 'sseqid', 'starred',
-                           'assignment_threshold']
         ref_rank_columns = [rank + '_id' for rank in args.include_ref_rank]
         ref_rank_columns += [rank + '_name' for rank in args.include_ref_rank]
         details_columns += ref_rank_columns
@@ -968,9 +1576,6 @@ def action(args):
             """
             append assignment_thresholds and append to --details-out
             """
-            deets_cols = hits_below_threshold.columns
-            deets_cols &= set(details_columns)
-            hits_below_threshold = hits_below_threshold[list(deets_cols)]
             threshold_cols = ['specimen', 'qseqid', 'assignment_threshold']
             assignment_thresholds = blast_results[threshold_cols]
             assignment_thresholds = assignment_thresholds.drop_duplicates()
@@ -982,20 +1587,22 @@ def action(args):
         # sort details for consistency and ease of viewing
         blast_results = blast_results.sort_values(by=details_columns)
 
-        blast_results.to_csv(
-            args.details_out,
-            compression=get_compression(args.details_out),
-            columns=details_columns,
-            header=True,
-            index=False,
-            float_format='%.2f')
+        write_details(blast_results, args.details_out, details_columns,
+                      threads=args.threads)
+
+        profiler.stop(stage, len(blast_results))
 
     # was required to merge with details above but not needed now
     output = output.drop('assignment_hash', axis=1)
 
     # output results
-    output.to_csv(
-        args.out,
-        index=True,
-        float_format='%.2f',
-        compression=get_compression(args.out))
+    with profiler.stage('write_output', len(output)) as stage:
+        output.to_csv(
+            args.out,
+            index=True,
+            float_format='%.2f',
+            compression=get_compression(args.out))
+        stage['rows_out'] = len(output)
+
+    if args.profile_out:
+        profiler.write(args.profile_out)
@@ -59,7 +59,7 @@ def action(args):
         seqname = 'consensus' if args.infile is sys.stdin \
                   else splitext(basename(args.infile.name))[0]
 
-    seqs = list(fastalite(args.infile, 'fasta'))
+    seqs = list(fastalite(args.infile))
 
     if args.rlefile:
         rledict = json.load(args.rlefile)
@@ -33,8 +33,8 @@ from random import shuffle
 from collections import defaultdict, Counter
 from multiprocessing import Pool
 
-from bioy_pkg.sequtils import consensus, run_muscle, parse_uc, fastalite, from_ascii, homodecode
-from bioy_pkg.utils import chunker, Opener, Csv2Dict
+from bioy_pkg.sequtils import consensus, run_muscle, parse_uc, fastalite, homodecode, read_rle
+from bioy_pkg.utils import chunker, Opener
 
 log = logging.getLogger(__name__)
 
@@ -52,8 +52,8 @@ def build_parser(parser):
                         type = Opener(),
                         help = 'Clusters file (output of "usearch -uc")')
     parser.add_argument('-r','--rlefile', metavar='FILE',
-                        type = Csv2Dict('name', 'rle', fieldnames=['name','rle']),
-                        help='An optional file containing run length encoding for infile (.csv.bz2)')
+                        type = read_rle,
+                        help='An optional file containing run length encoding for infile (.csv.bz2 or a directory from `bioy rlepack`)')
     parser.add_argument('-g','--groups', metavar='FILE', type = Opener(),
                         help="""An optional file defining groups for
                              partitioning input reads. If provided,
@@ -108,10 +108,10 @@ def ichunker(seqs, rledict=None, min_clust_size=1, max_clust_size=sys.maxint):
             # half the target chunk size
             combine_last = max_clust_size * 0.5
             for chunk in chunker(cluster, max_clust_size, combine_last):
-                rlelist = [from_ascii(rledict[s.id]) for s in chunk] if rledict else None
+                rlelist = [rledict[s.id] for s in chunk] if rledict else None
                 yield (chunk, rlelist)
         else:
-            rlelist = [from_ascii(rledict[s.id]) for s in cluster] if rledict else None
+            rlelist = [rledict[s.id] for s in cluster] if rledict else None
             yield (cluster, rlelist)
 
 
@@ -127,7 +127,7 @@ def align_and_consensus(chunk):
         # no need to align...
         seq = cluster[0]
         rle = rlelist[0] if rlelist else None
-        cons = homodecode(seq, rle) if rle else seq.seq
+        cons = homodecode(seq.seq, rle) if rle else seq.seq
     else:
         log.debug('aligning cluster {} len {}'.format(i, len(cluster)))
         cons = consensus(run_muscle(cluster), rlelist)
@@ -27,8 +27,8 @@ from operator import itemgetter
 from subprocess import Popen, PIPE, CalledProcessError
 from csv import DictWriter
 
-from bioy_pkg.sequtils import parse_ssearch36, homodecodealignment, from_ascii
-from bioy_pkg.utils import Opener, Csv2Dict
+from bioy_pkg.sequtils import parse_ssearch36, homodecodealignment, read_rle
+from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
 
@@ -63,9 +63,8 @@ def build_parser(parser):
             type = Opener('w'),
             help = 'return raw ssearch output')
     parser.add_argument('--decode',
-            type = Csv2Dict(index = 'name', value = 'rle',
-                fieldnames = ['name', 'rle']),
-            help = 'Decode alignment')
+            type = read_rle,
+            help = 'Decode alignment with run length encodings in a csv file or directory from `bioy rlepack`')
     parser.add_argument('--fieldnames',
             type = lambda f: f.split(','),
             help = 'comma-delimited list of field names to include in output')
@@ -106,11 +105,11 @@ def action(args):
 
     # decode if appropriate
     if args.decode:
-        decoding = {k:v for d in args.decode for k,v in d.items()}
+        decoding = args.decode
         def decode(aligns):
             aligns['t_seq'], aligns['q_seq'] = homodecodealignment(
-                    aligns['t_seq'], from_ascii(decoding[aligns['t_name']]),
-                    aligns['q_seq'], from_ascii(decoding[aligns['q_name']]))
+                    aligns['t_seq'], decoding[aligns['t_name']],
+                    aligns['q_seq'], decoding[aligns['q_name']])
             return aligns
         aligns = imap(decode, aligns)
 
@@ -24,8 +24,8 @@ from csv import DictWriter, DictReader
 from itertools import groupby, ifilter
 from operator import itemgetter
 
-from bioy_pkg.sequtils import fastalite
-from bioy_pkg.utils import Opener, Csv2Dict
+from bioy_pkg.sequtils import fastalite, read_rle, to_ascii
+from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
 
@@ -58,9 +58,9 @@ def build_parser(parser):
                         default=sys.stdout,
                         help='trimmed fasta output file')
     parser.add_argument('--rle',
-                        type=Csv2Dict(
-                            'name', 'rle', fieldnames=['name', 'rle']),
-                        help='rle input file (required if --rle-out)')
+                        type=read_rle,
+                        help=('rle input file or directory from '
+                              '`bioy rlepack` (required if --rle-out)'))
     parser.add_argument('--rle-out',
                         type=lambda f: DictWriter(
                             Opener('w')(f), fieldnames=['name', 'rle']),
@@ -213,5 +213,5 @@ def action(args):
 
             if args.rle_out:
                 name = s.id
-                rle = args.rle[s.id][start:stop]
+                rle = to_ascii(args.rle[s.id][start:stop])
                 args.rle_out.writerow(dict(name=name, rle=rle))
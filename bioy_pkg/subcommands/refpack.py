@@ -0,0 +1,60 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compile classifier reference data into a refpack
+
+The seq_info, taxonomy and rank thresholds are parsed, joined and
+written to a directory of numpy arrays.  ``bioy classifier`` accepts
+the directory in place of its seq_info and taxonomy arguments and
+memory maps the arrays instead of parsing the csv files.
+"""
+
+import logging
+
+from bioy_pkg.references import (
+    read_seq_info, read_rank_thresholds, resolve_thresholds, write_refpack)
+from bioy_pkg.taxtable import TaxTable
+
+log = logging.getLogger(__name__)
+
+
+def build_parser(parser):
+    parser.add_argument(
+        'seq_info',
+        help='File mapping reference seq name to tax_id')
+    parser.add_argument(
+        'taxonomy',
+        help="""Table defining the taxonomy for each tax_id""")
+    parser.add_argument(
+        'outdir',
+        help='output directory for the refpack')
+    parser.add_argument(
+        '--rank-thresholds', metavar='CSV',
+        help="""Columns [tax_id,ranks...]""")
+
+
+def action(args):
+    log.info('loading seq_info file')
+    seq_info = read_seq_info(args.seq_info)
+
+    log.info('loading taxonomy file')
+    taxonomy = TaxTable.read_csv(args.taxonomy)
+
+    log.info('resolving rank thresholds')
+    thresholds = read_rank_thresholds(taxonomy.ranks, args.rank_thresholds)
+    resolved = resolve_thresholds(taxonomy, thresholds)
+
+    log.info('writing refpack ' + args.outdir)
+    write_refpack(args.outdir, taxonomy, seq_info, thresholds, resolved)
@@ -17,11 +17,11 @@
 
 import logging
 import sys
-import csv
 
+from itertools import chain
 from multiprocessing import Pool
 
-from bioy_pkg.sequtils import homodecode, from_ascii, fastalite
+from bioy_pkg.sequtils import homodecode_many, fastalite_batches, read_rle
 from bioy_pkg import utils
 from bioy_pkg.utils import Opener
 
@@ -30,23 +30,25 @@ log = logging.getLogger(__name__)
 
 def build_parser(parser):
     parser.add_argument('seqs',
-                        type=lambda f: fastalite(Opener()(f), readfile=False),
+                        type=lambda f: fastalite_batches(Opener()(f)),
                         help='Input fasta file')
     parser.add_argument('rle',
-                        type=Opener(),
-                        help='csv file (may be bzip encoded) containing columns "name","rle"')
+                        type=read_rle,
+                        help=('csv file (may be bzip encoded) containing '
+                              'columns "name","rle", or a directory from '
+                              '`bioy rlepack`'))
     parser.add_argument('-o', '--outfile',
                         type=Opener('w'),
                         default=sys.stdout,
                         help='Name of output file')
 
 
-def seq_and_homodecode(seq_rle):
-    seq, rle = seq_rle
+def seqs_and_homodecode(seqs_rles):
+    seqs, rles = zip(*seqs_rles)
 
-    assert len(seq.seq) == len(rle)
+    assert all(len(s.seq) == len(rle) for s, rle in seqs_rles)
 
-    return seq, homodecode(seq.seq, rle)
+    return zip(seqs, homodecode_many([s.seq for s in seqs], rles))
 
 
 def action(args):
@@ -54,11 +56,10 @@ def action(args):
     utils.exit_on_sigpipe()
     utils.exit_on_sigint()
 
-    rledict = {seqname: rle for seqname, rle in csv.reader(args.rle)}
-    seqs = ((s, from_ascii(rledict[s.id])) for s in args.seqs)
+    seqs = ([(s, args.rle[s.id]) for s in batch] for batch in args.seqs)
 
     pool = Pool(processes=args.threads)
-    seqs = pool.imap(seq_and_homodecode, seqs, chunksize=140)
+    seqs = pool.imap(seqs_and_homodecode, seqs)
 
-    for seq, decoded in seqs:
+    for seq, decoded in chain.from_iterable(seqs):
         args.outfile.write('>{}\n{}\n'.format(seq.description, decoded))
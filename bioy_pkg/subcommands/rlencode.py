@@ -22,7 +22,7 @@ from itertools import imap, chain
 from csv import DictWriter
 from multiprocessing import Pool
 
-from bioy_pkg.sequtils import homoencode, to_ascii, fastalite
+from bioy_pkg.sequtils import homoencode_many, to_ascii, fastalite_batches
 from bioy_pkg import utils
 from bioy_pkg.utils import Opener
 
@@ -46,8 +46,8 @@ def build_parser(parser):
                       append .csv.bz2 to --outfile basename.""")
 
 
-def seq_and_homoencode(seq):
-    return seq, homoencode(seq.seq)
+def seqs_and_homoencode(seqs):
+    return zip(seqs, homoencode_many([s.seq for s in seqs]))
 
 
 def action(args):
@@ -57,11 +57,11 @@ def action(args):
 
     pool = Pool(processes=args.threads)
 
-    seqs = imap(fastalite, args.infiles)
+    seqs = imap(fastalite_batches, args.infiles)
     seqs = chain.from_iterable(seqs)
-    seqs = pool.imap(seq_and_homoencode, seqs, chunksize=40)
+    seqs = pool.imap(seqs_and_homoencode, seqs)
 
-    for seq, (seqstr, count) in seqs:
+    for seq, (seqstr, count) in chain.from_iterable(seqs):
         assert len(seqstr) == len(count)
 
         args.outfile.write('>{}\n{}\n'.format(seq.description, seqstr))
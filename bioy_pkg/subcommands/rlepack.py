@@ -0,0 +1,56 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Convert run length encodings between csv and an indexed directory
+
+A csv file with columns name,rle (as written by ``bioy rlencode``) is
+written to a directory of numpy arrays holding the packed counts and
+an index of read names.  ``bioy denoise``, ``primer_trim``, ``ssearch``,
+``fasta``, ``ssearch2csv``, ``align_clusters`` and ``rldecode`` accept
+the directory in place of the csv file and memory map it.  With
+``--unpack`` the directory is written back to csv.
+"""
+
+import logging
+
+from bioy_pkg.sequtils import read_rle
+from bioy_pkg.utils import Opener
+
+log = logging.getLogger(__name__)
+
+
+def build_parser(parser):
+    parser.add_argument(
+        'infile',
+        help='csv file with columns name,rle or, with --unpack, an rle directory')
+    parser.add_argument(
+        'outfile',
+        help='output directory or, with --unpack, csv file')
+    parser.add_argument(
+        '--unpack', action='store_true', default=False,
+        help='write an rle directory to csv')
+
+
+def action(args):
+    log.info('reading ' + args.infile)
+    rles = read_rle(args.infile)
+
+    log.info('writing {} run length encodings to {}'.format(
+        len(rles), args.outfile))
+    if args.unpack:
+        with Opener('w')(args.outfile) as outfile:
+            rles.write_csv(outfile)
+    else:
+        rles.save(args.outfile)
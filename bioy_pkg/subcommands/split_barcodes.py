@@ -28,7 +28,7 @@ import bz2
 
 from Bio import SeqIO
 
-from bioy_pkg.sequtils import homoencode, to_ascii
+from bioy_pkg.sequtils import homoencode_many, to_ascii
 
 log = logging.getLogger(__name__)
 
@@ -135,6 +135,21 @@ def action(args):
         writer = csv.writer(mapout)
         writer.writerow(['name','label','barcode','ratio','bc_start','bc_stop','rle'])
 
+        # matched reads are run length encoded in batches; rows are
+        # held until then to keep the mapfile in input order
+        pending = []
+
+        def flush():
+            encoded = homoencode_many([s for s, _ in pending if s is not None])
+            encoded = iter(encoded)
+            for seq, row in pending:
+                if seq is not None:
+                    seq, counts = next(encoded)
+                    args.outfile.write('>%s %s\n%s\n' % (row[0], row[1], seq))
+                    row.append(to_ascii(counts))
+                writer.writerow(row)
+            del pending[:]
+
         for seq in SeqIO.parse(f, 'fastq'):
             if not args.min_length <= len(seq) <= args.max_length:
                 count['fail_len'] += 1
@@ -153,13 +168,18 @@ def action(args):
                     break
                 count['matched'] += 1
                 count[barcode] += 1
-                seq, counts = homoencode(seq.seq)
-                args.outfile.write('>%s %s\n%s\n' % (name, sample, seq))
-                writer.writerow([name, sample, barcode, ratio, bc_start, bc_stop, to_ascii(counts)])
+                pending.append(
+                    (seq.seq, [name, sample, barcode, ratio, bc_start, bc_stop]))
             elif args.unmatched:
                 count['no_match'] += 1
                 args.unmatched.write('>%s\n%s\n' % (name, seq.seq))
-                writer.writerow([name, sample, None, barcode, ratio, bc_start, bc_stop])
+                pending.append(
+                    (None, [name, sample, None, barcode, ratio, bc_start, bc_stop]))
+
+            if len(pending) >= 1000:
+                flush()
+
+        flush()
 
     stats = csv.writer(args.stats)
     rows = sorted((bc_dict[k], v) for k, v in count.items() if k in bc_dict)
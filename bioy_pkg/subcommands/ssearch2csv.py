@@ -25,8 +25,8 @@ import csv
 from itertools import islice, chain, groupby, imap
 from operator import itemgetter
 
-from bioy_pkg.sequtils import homodecodealignment, parse_ssearch36, from_ascii, CAPUI
-from bioy_pkg.utils import Opener, Csv2Dict, parse_extras
+from bioy_pkg.sequtils import homodecodealignment, parse_ssearch36, read_rle, CAPUI
+from bioy_pkg.utils import Opener, parse_extras
 
 log = logging.getLogger(__name__)
 
@@ -79,10 +79,9 @@ def build_parser(parser):
         dest='header',
         action = 'store_false')
     parser.add_argument('-r', '--rlefile',
-        type = Csv2Dict(index = 'name', value = 'rle',
-            fieldnames = ['name', 'rle']),
+        type = read_rle,
         nargs = '+',
-        help = 'CSV file containing run-length encoding')
+        help = 'CSV file or directory from `bioy rlepack` containing run-length encoding')
     parser.add_argument('--min-zscore',
         default = None,
         type = float,
@@ -114,11 +113,16 @@ def action(args):
         aligns = (a for _, i in aligns for a in i)  # flatten groupby iters
 
     if args.rlefile:
-        decoding = {k:v for d in args.rlefile for k,v in d.items()}
+        def decoding(name):
+            # later files take precedence
+            for rles in reversed(args.rlefile):
+                if name in rles:
+                    return rles[name]
+            raise KeyError(name)
         def decode(aligns):
             aligns['t_seq'], aligns['q_seq'] = homodecodealignment(
-                    aligns['t_seq'], from_ascii(decoding[aligns['t_name']]),
-                    aligns['q_seq'], from_ascii(decoding[aligns['q_name']]))
+                    aligns['t_seq'], decoding(aligns['t_name']),
+                    aligns['q_seq'], decoding(aligns['q_name']))
             return aligns
         aligns = imap(decode, aligns)
 
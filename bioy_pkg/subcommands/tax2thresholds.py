@@ -25,8 +25,10 @@ import logging
 
 from os import path
 
+import numpy as np
 import pandas as pd
 
+from bioy_pkg.taxtable import TaxTable
 from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
@@ -65,13 +67,12 @@ def action(args):
     # pd.set_option('display.max_columns', None)
     # pd.set_option('display.max_rows', None)
 
-    # load default_tresholds
-    taxonomy = read_csv(
+    # load taxonomy
+    taxonomy = TaxTable.read_csv(
         args.taxonomy,
         comment='#',
-        dtype=str,
         na_filter=True,  # False is faster
-        ).set_index('tax_id')
+        )
 
     # load default_tresholds
     default_thresholds = read_csv(
@@ -81,38 +82,37 @@ def action(args):
         na_filter=True,  # False is faster
         usecols=['tax_id', 'low', 'target_rank']
         )
+    default_thresholds = default_thresholds[
+        default_thresholds['low'].notnull()]
 
-    tax_cols = taxonomy.columns.tolist()
-    tax_cols = tax_cols[tax_cols.index('root'):]
+    tax_cols = taxonomy.ranks
+    nodes = np.arange(len(taxonomy))
 
     # out output data structure
-    full_tree = pd.DataFrame(index=taxonomy.index)
+    full_tree = pd.DataFrame(
+        index=pd.Index(taxonomy.tax_ids, name='tax_id'))
 
     # start with the root column and move right
     for index, rank in enumerate(tax_cols):
         defaults = default_thresholds[
             default_thresholds['target_rank'] == rank]
-        defaults = defaults.set_index('tax_id')
+        # the first listed threshold for a tax_id takes precedence
+        defaults = defaults.drop_duplicates(subset='tax_id')
 
-        # iterate taxonomy most to least specificity and join with defaults
-        target_thresholds = []
-        for specificity in reversed(tax_cols):
-            thresholds = taxonomy[[specificity]].join(
-                defaults[['low']], on=specificity, how='inner')
-            # append just the low column
-            target_thresholds.append(thresholds['low'])
+        codes = taxonomy.codes(defaults['tax_id'])
+        lows = np.empty(len(taxonomy))
+        lows.fill(np.nan)
+        lows[codes[codes >= 0]] = defaults['low'].values[codes >= 0]
 
-        # concat and take just the first(), most specific threshold
-        target_thresholds = pd.concat(target_thresholds)
-        target_thresholds = target_thresholds.groupby(
-            target_thresholds.index, sort=False).first()
+        # take the most specific threshold in each lineage
+        target_thresholds, _ = taxonomy.resolve(nodes, ~np.isnan(lows))
+        target_thresholds = np.where(
+            target_thresholds >= 0, lows[target_thresholds], np.nan)
 
         full_tree[rank] = target_thresholds
 
         # fill in tax holes
         index = max(index-1, 0)
-        blanks = full_tree[full_tree[rank].isnull()]
-        full_tree[rank] = full_tree[rank].fillna(
-            blanks[tax_cols[index]])
+        full_tree[rank] = full_tree[rank].fillna(full_tree[tax_cols[index]])
 
     full_tree.to_csv(args.out)
@@ -24,8 +24,11 @@ import csv
 
 from subprocess import Popen, PIPE, CalledProcessError
 
-from bioy_pkg.utils import Opener, named_tempfile
-from bioy_pkg.sequtils import USEARCH_HEADER
+import pandas
+
+from bioy_pkg.utils import (
+    Opener, named_tempfile, columnar_format, write_columnar)
+from bioy_pkg.sequtils import USEARCH_HEADER, BLAST_NUMERIC_FIELDS
 
 log = logging.getLogger(__name__)
 
@@ -52,7 +55,9 @@ def build_parser(parser):
     parser.add_argument('-o', '--out',
                         type=Opener('w'),
                         default=sys.stdout,
-                        help='tabulated ssearch results')
+                        help=('tabulated ssearch results; written as a '
+                              'typed columnar file if ending in .parquet, '
+                              '.pq or .feather (requires pyarrow)'))
     parser.add_argument('--no-header',
                         dest='header',
                         action='store_false',
@@ -95,6 +100,22 @@ def sw_ident_to_decimal(result):
 
 
 def action(args):
+    out_format = columnar_format(args.out.name)
+    if out_format:
+        try:
+            import pyarrow  # noqa
+        except ImportError:
+            sys.exit('{} --out requires pyarrow'.format(out_format))
+
+    numeric = BLAST_NUMERIC_FIELDS.union(
+        toSsearch[f] for f in BLAST_NUMERIC_FIELDS if f in toSsearch)
+
+    def write_table(results, columns, outfile):
+        results = pandas.DataFrame(list(results), columns=columns)
+        for field in numeric.intersection(columns):
+            results[field] = pandas.to_numeric(results[field])
+        write_columnar(results, outfile, out_format)
+
     with named_tempfile('rw') as tfile, args.out as outfile:
         # If query or library file is empty, don't bother executing ssearch.
         # Just print empty file
@@ -116,6 +137,12 @@ def action(args):
 
         if os.stat(args.query).st_size == 0 or \
            os.stat(args.library).st_size == 0:
+            if out_format:
+                # an empty table with the columns of the results
+                columns = args_fieldnames if args.fieldnames else fieldnames
+                write_table([], columns, outfile)
+                return
+
             # write empty header
             writer = csv.DictWriter(args.out,
                                     extrasaction='ignore',
@@ -167,6 +194,10 @@ def action(args):
             # convert to ssearch format
             results = (sw_ident_to_decimal(r) for r in results)
 
+        if out_format:
+            write_table(results, args_fieldnames, outfile)
+            return
+
         writer = csv.DictWriter(outfile,
                                 fieldnames=args_fieldnames,
                                 extrasaction='ignore')
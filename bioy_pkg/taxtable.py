@@ -0,0 +1,222 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Array-backed taxonomy table
+
+Each tax_id is assigned an integer code (its row in the taxonomy
+file). The lineage of every node is stored as a rank-by-node matrix of
+codes and parent pointers as an array of codes, so lookups over many
+tax_ids can be done with numpy indexing instead of nested dicts.
+"""
+
+import logging
+
+from collections import Mapping
+
+import numpy
+import pandas
+
+log = logging.getLogger(__name__)
+
+# columns preceding the rank columns in a taxonomy file
+TAX_COLUMNS = ['tax_id', 'parent_id', 'rank', 'tax_name']
+
+
+class TaxNode(Mapping):
+
+    """Read-only view of a single row of a TaxTable.
+
+    Behaves like the {column: value} dicts produced by
+    csv.DictReader, with missing rank values returned as ''.
+    """
+
+    __slots__ = ('table', 'code')
+
+    def __init__(self, table, code):
+        self.table = table
+        self.code = code
+
+    def __getitem__(self, key):
+        return self.table.value(self.code, key)
+
+    def __iter__(self):
+        return iter(self.table.columns)
+
+    def __len__(self):
+        return len(self.table.columns)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, dict(self))
+
+
+class TaxTable(Mapping):
+
+    """Taxonomy keyed by tax_id with integer coded nodes
+
+    Attributes:
+        - tax_ids -- array of tax_ids indexed by code
+        - index -- pandas.Index mapping tax_ids to codes
+        - parents -- array of parent codes (-1 if unknown)
+        - node_ranks -- array of the rank of each node
+        - names -- array of tax_names
+        - ranks -- rank columns ordered from least to most specific
+        - lineages -- node by rank matrix of ancestor codes (-1 if none)
+    """
+
+    def __init__(self, tax_ids, parents, node_ranks, names, ranks, lineages):
+        self.tax_ids = numpy.asarray(tax_ids, dtype=object)
+        self.index = pandas.Index(self.tax_ids)
+        self.parents = parents
+        self.node_ranks = numpy.asarray(node_ranks, dtype=object)
+        self.names = numpy.asarray(names, dtype=object)
+        self.ranks = list(ranks)
+        self.lineages = lineages
+
+        self.columns = TAX_COLUMNS + self.ranks
+        self._rank_columns = {r: i for i, r in enumerate(self.ranks)}
+
+    @classmethod
+    def read_csv(cls, filename, **kwargs):
+        """Build a TaxTable from a taxonomy csv file (or open file
+        object) in a single pass.
+        """
+
+        taxonomy = pandas.read_csv(filename, dtype=str, **kwargs)
+        return cls.from_frame(taxonomy)
+
+    @classmethod
+    def from_frame(cls, taxonomy):
+        """Build a TaxTable from a DataFrame with columns tax_id,
+        parent_id, rank, tax_name and rank columns starting at `root'.
+        tax_id may be either a column or the index.
+        """
+
+        if 'tax_id' in taxonomy.columns:
+            taxonomy = taxonomy.set_index('tax_id')
+
+        columns = taxonomy.columns.tolist()
+        ranks = columns[columns.index('root'):]
+
+        index = pandas.Index(taxonomy.index.values.astype(object))
+        if not index.is_unique:
+            raise ValueError('taxonomy contains duplicate tax_ids')
+
+        def codes(values):
+            values = numpy.asarray(values, dtype=object)
+            notnull = pandas.notnull(values)
+            result = numpy.empty(len(values), dtype=numpy.int32)
+            result.fill(-1)
+            result[notnull] = index.get_indexer(values[notnull])
+            return result
+
+        lineages = numpy.empty((len(index), len(ranks)), dtype=numpy.int32)
+        for i, r in enumerate(ranks):
+            lineages[:, i] = codes(taxonomy[r].values)
+
+        return cls(tax_ids=index.values,
+                   parents=codes(taxonomy['parent_id'].values),
+                   node_ranks=taxonomy['rank'].values,
+                   names=taxonomy['tax_name'].values,
+                   ranks=ranks,
+                   lineages=lineages)
+
+    def __getitem__(self, tax_id):
+        return TaxNode(self, self.index.get_loc(tax_id))
+
+    def __contains__(self, tax_id):
+        return tax_id in self.index
+
+    def __iter__(self):
+        return iter(self.tax_ids)
+
+    def __len__(self):
+        return len(self.tax_ids)
+
+    def value(self, code, column):
+        """Return the value of `column' for the node `code' as it would
+        appear in the taxonomy file ('' for missing rank ids).
+        """
+
+        if column in self._rank_columns:
+            ancestor = self.lineages[code, self._rank_columns[column]]
+            return self.tax_ids[ancestor] if ancestor >= 0 else ''
+        elif column == 'tax_id':
+            return self.tax_ids[code]
+        elif column == 'parent_id':
+            parent = self.parents[code]
+            return self.tax_ids[parent] if parent >= 0 else ''
+        elif column == 'rank':
+            return self.node_ranks[code]
+        elif column == 'tax_name':
+            return self.names[code]
+        else:
+            raise KeyError(column)
+
+    def codes(self, tax_ids):
+        """Return an array of codes for a sequence of tax_ids; tax_ids
+        not in the taxonomy are given -1.
+        """
+
+        return self.index.get_indexer(
+            numpy.asarray(tax_ids, dtype=object)).astype(numpy.int32)
+
+    def take(self, codes, column):
+        """Return an array of `column' values for an array of codes
+        with NaN in place of missing nodes or missing rank ids.
+        """
+
+        codes = numpy.asarray(codes)
+        if column in self._rank_columns:
+            codes = self.lineages[codes, self._rank_columns[column]]
+            values = self.tax_ids
+        elif column == 'tax_id':
+            values = self.tax_ids
+        elif column == 'parent_id':
+            codes = self.parents[codes]
+            values = self.tax_ids
+        elif column == 'rank':
+            values = self.node_ranks
+        elif column == 'tax_name':
+            values = self.names
+        else:
+            raise KeyError(column)
+
+        missing = codes < 0
+        result = values.take(codes)
+        result[missing] = numpy.nan
+        return result
+
+    def resolve(self, codes, defined):
+        """For each node in `codes' return the code of the most specific
+        member of its lineage for which the boolean array `defined'
+        (indexed by code) is True, and the index of the rank at which
+        it was found.  Nodes without a defined ancestor return -1 for
+        both.
+        """
+
+        codes, inverse = numpy.unique(numpy.asarray(codes), return_inverse=True)
+
+        lineages = self.lineages[codes.clip(0)]
+        found = (lineages >= 0) & defined[lineages]
+        found[codes < 0] = False
+
+        ranks = len(self.ranks) - 1 - found[:, ::-1].argmax(axis=1)
+        ranks[~found.any(axis=1)] = -1
+
+        resolved = lineages[numpy.arange(len(codes)), ranks]
+        resolved[ranks < 0] = -1
+
+        return resolved[inverse], ranks[inverse]
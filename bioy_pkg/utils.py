@@ -16,18 +16,25 @@
 import os
 import bz2
 import gzip
+import hashlib
+import json
 import logging
 import pandas
 import re
+import resource
 import shutil
 import sys
 import signal
 import contextlib
 import tempfile
+import threading
+import time
 
 from itertools import takewhile, izip_longest, groupby
 from csv import DictReader
 from collections import Iterable, OrderedDict
+from Queue import Queue
+from cStringIO import StringIO
 from os import path
 
 log = logging.getLogger(__name__)
@@ -266,6 +273,90 @@ def read_csv(filename, compression=None, limit=None, **kwargs):
     return pandas.read_csv(filename, **kwargs)
 
 
+# columnar file formats by extension, read and written with pyarrow
+COLUMNAR_FORMATS = {'.parquet': 'parquet', '.pq': 'parquet',
+                    '.feather': 'feather'}
+
+
+def columnar_format(filename):
+    """Return 'parquet' or 'feather' if `filename' has one of the
+    extensions in COLUMNAR_FORMATS, otherwise None.
+    """
+
+    return COLUMNAR_FORMATS.get(path.splitext(filename)[-1])
+
+
+def read_columnar(filename, columns=None, chunksize=None):
+    """Read `columns' of a parquet or feather file as a DataFrame.  With
+    `chunksize' return an iterator of DataFrames of at most `chunksize'
+    rows instead, reading parquet files one row group at a time and
+    feather files one record batch at a time.  Chunks are indexed by
+    row number in the file, as with pandas.read_csv.  Requires pyarrow.
+    """
+
+    fmt = columnar_format(filename)
+
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        if not chunksize:
+            return pq.read_table(filename, columns=columns).to_pandas()
+        parquet = pq.ParquetFile(filename)
+        tables = (parquet.read_row_group(i, columns=columns)
+                  for i in range(parquet.num_row_groups))
+    elif fmt == 'feather':
+        import pyarrow
+        import pyarrow.feather as feather
+        import pyarrow.ipc
+        if not chunksize:
+            return feather.read_feather(filename, columns=columns)
+        # feather version 2 files are arrow ipc files
+        try:
+            reader = pyarrow.ipc.open_file(pyarrow.memory_map(filename))
+        except pyarrow.ArrowInvalid:
+            log.warn('reading version 1 feather file {} in whole'.format(
+                filename))
+            tables = [feather.read_table(filename, columns=columns)]
+        else:
+            tables = (pyarrow.Table.from_batches([reader.get_batch(i)])
+                      for i in range(reader.num_record_batches))
+    else:
+        raise ValueError('{} is not a parquet or feather file'.format(
+            filename))
+
+    def chunks():
+        nrows = 0
+        for table in tables:
+            df = table.to_pandas()
+            if columns:
+                df = df[columns]
+            df.index = pandas.RangeIndex(nrows, nrows + len(df))
+            nrows += len(df)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+
+    return chunks()
+
+
+def write_columnar(df, dest, fmt):
+    """Write DataFrame `df' without its index to `dest', a file name or
+    object, in columnar format `fmt' ('parquet' or 'feather').
+    Requires pyarrow.
+    """
+
+    df = df.reset_index(drop=True)
+
+    if fmt == 'parquet':
+        import pyarrow
+        import pyarrow.parquet as pq
+        pq.write_table(pyarrow.Table.from_pandas(df, preserve_index=False),
+                       dest)
+    elif fmt == 'feather':
+        import pyarrow.feather as feather
+        feather.write_feather(df, dest)
+    else:
+        raise ValueError('unknown columnar format {}'.format(fmt))
+
+
 @contextlib.contextmanager
 def named_tempfile(*args, **kwargs):
     """Near-clone of tempfile.NamedTemporaryFile, but the file is deleted
@@ -280,3 +371,225 @@ def named_tempfile(*args, **kwargs):
             yield tf
     finally:
         os.unlink(tf.name)
+
+
+@contextlib.contextmanager
+def background_writer(fileobj, maxsize=4):
+    """Yield a function that queues strings to be written to `fileobj'
+    by a background thread.  Compressing file objects (bz2.BZ2File,
+    gzip.GzipFile) release the GIL while compressing so the caller can
+    format the next block meanwhile.  At most `maxsize' blocks are
+    queued.
+    """
+
+    blocks = Queue(maxsize=maxsize)
+    errors = []
+
+    def consume():
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            if not errors:
+                try:
+                    fileobj.write(block)
+                except Exception as e:
+                    errors.append(e)
+
+    thread = threading.Thread(target=consume)
+    thread.daemon = True
+    thread.start()
+
+    def write(block):
+        if errors:
+            raise errors[0]
+        blocks.put(block)
+
+    try:
+        yield write
+    finally:
+        blocks.put(None)
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def gzip_member(data, compresslevel=9):
+    """Return `data' compressed as a complete gzip member.  Members
+    may be concatenated into a single gzip file.
+    """
+
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb',
+                       compresslevel=compresslevel) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def checksum(*filenames):
+    """Return the sha1 hex digest of the contents of one or more files.
+    """
+
+    sha1 = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), ''):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+class LRUCache(object):
+    """Mapping of at most `maxsize' items that discards the least
+    recently used item when full, counting hits and misses.  A
+    `maxsize' of 0 disables caching.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.items = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.items[key] = value  # move to most recently used
+        return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        self.items.pop(key, None)
+        self.items[key] = value
+        if self.maxsize is not None and len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def stats(self):
+        """Return a description of hits and misses for logging
+        """
+
+        lookups = self.hits + self.misses
+        return '{} hits, {} misses ({:.0%} hit rate), {} cached'.format(
+            self.hits, self.misses,
+            self.hits / float(lookups) if lookups else 0, len(self))
+
+
+class StageProfiler(object):
+    """Record wall time, cpu time, peak memory and row counts of named
+    stages of a program.
+
+    Usage::
+
+        profiler = StageProfiler()
+        with profiler.stage('filter', rows_in=len(df)) as stage:
+            df = df[df['x'] > 0]
+            stage['rows_out'] = len(df)
+
+        record = profiler.start('summarize', rows_in=len(df))
+        ...
+        profiler.stop(record, rows_out=len(summary))
+
+        profiler.write('stages.json')
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    @staticmethod
+    def _usage():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # ru_maxrss is in kilobytes on linux
+        return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024.0
+
+    def start(self, name, rows_in=None):
+        """Start recording stage `name'.  Returns a record to be passed
+        to stop.
+        """
+
+        record = OrderedDict([('stage', name),
+                              ('pid', os.getpid()),
+                              ('rows_in', rows_in),
+                              ('rows_out', None)])
+        record['_start'] = (time.time(),) + self._usage()
+        return record
+
+    def stop(self, record, rows_out=None):
+        """Finish recording the stage `record' returned by start.
+        """
+
+        start, cpu, peak_rss = record.pop('_start')
+        wall = time.time() - start
+        cpu_end, peak_rss_end = self._usage()
+
+        if rows_out is not None:
+            record['rows_out'] = rows_out
+        for k in ['rows_in', 'rows_out']:
+            if record[k] is not None:
+                record[k] = int(record[k])
+
+        record['wall'] = round(wall, 4)
+        record['cpu'] = round(cpu_end - cpu, 4)
+        record['peak_rss_mb'] = round(peak_rss_end, 1)
+        record['peak_rss_delta_mb'] = round(peak_rss_end - peak_rss, 1)
+        self.stages.append(record)
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """Record the stage `name' run in a with block.  Yields the
+        record so that rows_out can be set.
+        """
+
+        record = self.start(name, rows_in)
+        yield record
+        self.stop(record)
+
+    def pop(self, start=0):
+        """Remove and return the stages recorded after the first
+        `start', for example to send them from a worker process to be
+        added with extend.
+        """
+
+        stages = self.stages[start:]
+        del self.stages[start:]
+        return stages
+
+    def extend(self, stages):
+        self.stages.extend(stages)
+
+    def totals(self):
+        """Return the calls, time and rows of each stage summed over all
+        of its calls in order of first appearance.
+        """
+
+        totals = OrderedDict()
+        for record in self.stages:
+            total = totals.setdefault(record['stage'], OrderedDict(
+                [('calls', 0), ('wall', 0), ('cpu', 0),
+                 ('rows_in', 0), ('rows_out', 0), ('peak_rss_mb', 0)]))
+            total['calls'] += 1
+            for k in ['wall', 'cpu', 'rows_in', 'rows_out']:
+                total[k] += record[k] or 0
+            total['peak_rss_mb'] = max(
+                total['peak_rss_mb'], record['peak_rss_mb'])
+        for total in totals.values():
+            total['wall'] = round(total['wall'], 4)
+            total['cpu'] = round(total['cpu'], 4)
+        return totals
+
+    def write(self, filename):
+        """Write the stages and their totals to `filename' as json
+        """
+
+        with open(filename, 'w') as f:
+            json.dump(OrderedDict([('stages', self.stages),
+                                   ('totals', self.totals())]),
+                      f, indent=2)
+            f.write('\n')
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark ``bioy classifier`` on synthetic data
+
+Generates a taxonomy, seq_info, blast results, specimen map and
+weights at the requested scale, runs the classifier on them and
+appends one json record per run to ``outfile`` with the parameters,
+git revision, end to end wall time and the per-stage totals recorded
+by ``--profile-out``.  For example::
+
+    dev/benchmark_classifier.py --queries 20000 --hits 25 --repeat 3 \\
+        --classifier-args '--threads 4' benchmarks.jsonl
+
+Generated data is reused if ``--datadir`` already holds data made with
+the same parameters.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from os import path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from bioy_pkg import main as bioy_main  # noqa
+from bioy_pkg.references import DEFAULT_RANK_THRESHOLDS  # noqa
+
+log = logging.getLogger(__name__)
+
+GENERATOR_VERSION = 1
+
+CANONICAL_RANKS = ['root', 'superkingdom', 'phylum', 'class', 'order',
+                   'family', 'genus', 'species']
+
+
+def choose_ranks(depth):
+    """Return `depth' ranks from root to species with default thresholds:
+    root and the most specific canonical ranks, then intermediate ranks
+    spread between them if `depth' is larger.
+    """
+
+    ranks = pd.read_csv(DEFAULT_RANK_THRESHOLDS, nrows=0).columns[1:]
+    ranks = ranks[:ranks.get_loc('species') + 1].tolist()
+    if not 2 <= depth <= len(ranks):
+        raise ValueError('depth must be from 2 to {}'.format(len(ranks)))
+
+    if depth <= len(CANONICAL_RANKS):
+        return CANONICAL_RANKS[:1] + CANONICAL_RANKS[1 - depth:]
+
+    others = [r for r in ranks if r not in CANONICAL_RANKS]
+    picks = np.linspace(0, len(others) - 1, depth - len(CANONICAL_RANKS))
+    chosen = set(CANONICAL_RANKS) | {others[int(i)] for i in picks.round()}
+    return [r for r in ranks if r in chosen]
+
+
+def make_taxonomy(rng, depth, taxa):
+    """Return a taxonomy DataFrame with `depth' ranks and about `taxa'
+    nodes at the most specific rank.  Nodes are numbered level by
+    level with the children of each parent contiguous.
+    """
+
+    ranks = choose_ranks(depth)
+
+    sizes = [1] + [max(1, int(round(taxa ** (i / (depth - 1.0)))))
+                   for i in range(1, depth)]
+
+    # lineage of each level as codes into the nodes of all levels
+    lineages = np.zeros((1, depth), dtype=np.int64) - 1
+    lineages[0, 0] = 0
+    levels = [np.zeros(1, dtype=np.int64)]
+    offset = 1
+    parents = [-1]
+    for i, size in enumerate(sizes[1:], 1):
+        parent = np.sort(rng.randint(0, len(levels[-1]), size))
+        codes = np.arange(offset, offset + size)
+        lineage = lineages[levels[-1][parent]]
+        lineage[:, i] = codes
+        lineages = np.vstack([lineages, lineage])
+        parents.extend(levels[-1][parent])
+        levels.append(codes)
+        offset += size
+
+    tax_ids = (np.arange(len(lineages)) + 1).astype(str)
+    node_ranks = np.repeat(ranks, sizes)
+
+    taxonomy = pd.DataFrame({
+        'tax_id': tax_ids,
+        'parent_id': np.where(np.array(parents) >= 0,
+                              tax_ids[np.array(parents)], ''),
+        'rank': node_ranks,
+        'tax_name': ['{} {}'.format(r, t)
+                     for r, t in zip(node_ranks, tax_ids)]},
+        columns=['tax_id', 'parent_id', 'rank', 'tax_name'])
+    for i, rank in enumerate(ranks):
+        taxonomy[rank] = np.where(
+            lineages[:, i] >= 0, tax_ids[lineages[:, i]], '')
+
+    return taxonomy, lineages, levels[-1]
+
+
+def make_seq_info(rng, leaves, lineages, refs_per_taxon, internal=0.05):
+    """Return seq_info with about `refs_per_taxon' reference sequences
+    for each leaf node, a fraction `internal' of which are assigned to
+    the leaf's parent instead.  Also returns the node code of each
+    reference, in order of their leaf.
+    """
+
+    counts = rng.poisson(max(refs_per_taxon - 1, 0), len(leaves)) + 1
+    nodes = np.repeat(leaves, counts)
+    parents = lineages[nodes, -2]
+    nodes = np.where(rng.rand(len(nodes)) < internal, parents, nodes)
+
+    seq_info = pd.DataFrame({
+        'seqname': ['S{:09d}'.format(i) for i in range(len(nodes))],
+        'tax_id': (nodes + 1).astype(str),
+        'accession': ['A{:09d}'.format(i) for i in range(len(nodes))]},
+        columns=['seqname', 'tax_id', 'accession'])
+
+    return seq_info, nodes
+
+
+def make_blast(rng, ref_nodes, lineages, queries, hits, specimens,
+               no_hits=0.02):
+    """Return blast results, a specimen map and weights for `queries'
+    query sequences with up to 2 * `hits' hits each.  Hits are drawn
+    from references near a random reference of each query in the
+    taxonomy and their identity falls with the depth of the lineage
+    they share with it.
+    """
+
+    depth = lineages.shape[1]
+    nrefs = len(ref_nodes)
+
+    counts = rng.randint(1, 2 * hits + 1, queries)
+    counts[rng.rand(queries) < no_hits] = 0
+    query = np.repeat(np.arange(queries), np.maximum(counts, 1))
+
+    # refs are ordered by leaf so nearby refs share most of a lineage
+    origin = rng.randint(0, nrefs, queries)[query]
+    spread = np.exp(rng.uniform(0, np.log(max(nrefs, 2)), len(query)))
+    refs = (origin + rng.normal(0, 1, len(query)) * spread / 4)
+    refs = refs.round().astype(int).clip(0, nrefs - 1)
+
+    shared = (lineages[ref_nodes[refs]] ==
+              lineages[ref_nodes[origin]]).sum(axis=1)
+    pident = 100 - (depth - shared) * 2.5 - rng.uniform(0, 1.5, len(query))
+    pident = pident.clip(75, 100).round(2)
+
+    qseqids = np.array(['q{:08d}'.format(i) for i in range(queries)])
+    blast = pd.DataFrame({
+        'qseqid': qseqids[query],
+        'sseqid': np.array(['S{:09d}'.format(i) for i in refs],
+                           dtype=object),
+        'pident': pident,
+        'qcovs': np.where(rng.rand(len(query)) < 0.9, 100.0, 95.0),
+        'mismatch': ((100 - pident) * 2.5).astype(int)},
+        columns=['qseqid', 'sseqid', 'pident', 'qcovs', 'mismatch'])
+
+    no_hit = (counts == 0)[query]
+    blast.loc[no_hit, ['sseqid', 'pident', 'qcovs', 'mismatch']] = None
+
+    specimen_map = pd.DataFrame({
+        'qseqid': qseqids,
+        'specimen': ['s{:04d}'.format(i)
+                     for i in rng.randint(0, specimens, queries)]},
+        columns=['qseqid', 'specimen'])
+
+    weights = pd.DataFrame({
+        'qseqid': qseqids,
+        'weight': rng.randint(1, 100, queries)},
+        columns=['qseqid', 'weight'])
+
+    return blast, specimen_map, weights
+
+
+def generate(datadir, params):
+    """Write the synthetic inputs described by `params' to `datadir'
+    unless already there.
+    """
+
+    params_file = path.join(datadir, 'params.json')
+    if path.exists(params_file):
+        with open(params_file) as f:
+            if json.load(f) == params:
+                log.info('using data in ' + datadir)
+                return
+        shutil.rmtree(datadir)
+
+    log.info('generating data in ' + datadir)
+    if not path.exists(datadir):
+        os.makedirs(datadir)
+
+    rng = np.random.RandomState(params['seed'])
+    taxonomy, lineages, leaves = make_taxonomy(
+        rng, params['depth'], params['taxa'])
+    seq_info, ref_nodes = make_seq_info(
+        rng, leaves, lineages, params['refs_per_taxon'])
+    blast, specimen_map, weights = make_blast(
+        rng, ref_nodes, lineages, params['queries'], params['hits'],
+        params['specimens'])
+
+    taxonomy.to_csv(path.join(datadir, 'taxonomy.csv'), index=False)
+    seq_info.to_csv(path.join(datadir, 'seq_info.csv'), index=False)
+    blast.to_csv(path.join(datadir, 'blast.csv'), index=False,
+                 float_format='%.2f')
+    specimen_map.to_csv(path.join(datadir, 'map.csv'),
+                        index=False, header=False)
+    weights.to_csv(path.join(datadir, 'weights.csv'),
+                   index=False, header=False)
+
+    # written last so partial data is regenerated
+    with open(params_file, 'w') as f:
+        json.dump(params, f)
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--tags', '--long', '--always', '--dirty'],
+            cwd=path.dirname(path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_classifier(datadir, outdir, classifier_args, refpack=False):
+    """Run the classifier on the data in `datadir' and return the wall
+    time and the stages recorded with --profile-out.
+    """
+
+    d = lambda f: path.join(datadir, f)
+
+    if refpack:
+        references = [d('refpack')]
+        if not path.exists(d('refpack')):
+            bioy_main(['refpack', d('seq_info.csv'), d('taxonomy.csv'),
+                       d('refpack')])
+    else:
+        references = [d('seq_info.csv'), d('taxonomy.csv')]
+
+    profile_out = path.join(outdir, 'stages.json')
+    args = (['classifier', '--has-header',
+             '--specimen-map', d('map.csv'),
+             '--weights', d('weights.csv'),
+             '--out', path.join(outdir, 'classifications.csv'),
+             '--details-out', path.join(outdir, 'details.csv'),
+             '--profile-out', profile_out] +
+            classifier_args + [d('blast.csv')] + references)
+
+    start = time.time()
+    bioy_main(args)
+    wall = time.time() - start
+
+    with open(profile_out) as f:
+        profile = json.load(f)
+
+    return wall, profile
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        'outfile', help='file to append json records of each run to')
+    parser.add_argument('--queries', type=int, default=5000,
+                        help='number of query sequences')
+    parser.add_argument('--hits', type=int, default=20,
+                        help='mean number of hits per query')
+    parser.add_argument('--depth', type=int, default=8,
+                        help='number of ranks in the taxonomy')
+    parser.add_argument('--taxa', type=int, default=5000,
+                        help='number of taxa at the most specific rank')
+    parser.add_argument('--refs-per-taxon', type=int, default=3,
+                        help='mean number of reference sequences per taxon')
+    parser.add_argument('--specimens', type=int, default=10,
+                        help='number of specimens')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of times to run the classifier')
+    parser.add_argument('--refpack', action='store_true',
+                        help='run the classifier on a refpack')
+    parser.add_argument('--classifier-args', default='',
+                        help='additional classifier arguments')
+    parser.add_argument('--datadir',
+                        help='directory for the generated data '
+                        '[a temporary directory]')
+    parser.add_argument('--name', help='label for the records of this run')
+    return parser
+
+
+def main(arguments=None):
+    args = build_parser().parse_args(arguments)
+    logging.basicConfig(
+        format='%(asctime)s %(message)s', level=logging.INFO)
+
+    params = dict(
+        generator=GENERATOR_VERSION,
+        queries=args.queries,
+        hits=args.hits,
+        depth=args.depth,
+        taxa=args.taxa,
+        refs_per_taxon=args.refs_per_taxon,
+        specimens=args.specimens,
+        seed=args.seed)
+
+    datadir = args.datadir or tempfile.mkdtemp(prefix='bioy-benchmark-')
+    outdir = tempfile.mkdtemp(prefix='bioy-benchmark-out-')
+    classifier_args = args.classifier_args.split()
+
+    try:
+        generate(datadir, params)
+        nrows = sum(1 for _ in open(path.join(datadir, 'blast.csv'))) - 1
+
+        for i in range(args.repeat):
+            wall, profile = run_classifier(
+                datadir, outdir, classifier_args, refpack=args.refpack)
+            record = dict(
+                name=args.name,
+                time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                revision=revision(),
+                params=params,
+                blast_rows=nrows,
+                refpack=args.refpack,
+                classifier_args=classifier_args,
+                run=i,
+                wall=round(wall, 4),
+                peak_rss_mb=max(s['peak_rss_mb'] for s in profile['stages']),
+                stages=profile['totals'])
+
+            with open(args.outfile, 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+
+            log.info('run {}: {:.2f}s, {} blast rows/s'.format(
+                i, wall, int(nrows / wall)))
+            for stage, total in profile['totals'].items():
+                log.info('  {:<20} {:>8.3f}s'.format(stage, total['wall']))
+    finally:
+        shutil.rmtree(outdir)
+        if not args.datadir:
+            shutil.rmtree(datadir)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,9 +8,22 @@ import csv
 from bz2 import BZ2File
 
 import filecmp
+import gzip
+import json
 import sys
+import unittest
 
-from bioy_pkg import main
+import numpy
+import pandas
+
+from bioy_pkg import main, sequtils, utils
+from bioy_pkg.subcommands import classifier
+from bioy_pkg.taxtable import TaxTable
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 from __init__ import TestBase, TestCaseSuppressOutput, datadir as datadir
 
@@ -547,3 +560,823 @@ class TestClassifier(TestBase, TestCaseSuppressOutput):
         # Normally we would expect 4 details rows spanning 3 tax_names, lending to the classification "Streptococcus infantarius/mutans*/troglodytae"
         # With --best-n-hits, we expect 3 details rows lending to the classification
         self.assertTrue(len(names) == 2)
+
+    def test16(self):
+        """
+        Test --chunksize gives the same results as test06
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test06', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test06', 'details.csv.bz2')
+
+        args = [
+            '--chunksize', 5,
+            '--max-identity', '100',
+            '--min-identity', '99',
+            '--specimen-map', specimen_map,
+            '--weights', weights,
+            '--copy-numbers', self.copy_numbers,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test17(self):
+        """
+        Test --chunksize with --hits-below-threshold gives the same
+        results as test14
+        """
+
+        thisdatadir = self.thisdatadir
+
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test14', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test14', 'details.csv.bz2')
+
+        args = ['--chunksize', 5,
+                '--hits-below-threshold',
+                '--details-out', details_out,
+                '--out', classify_out,
+                blast, seq_info, taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test18(self):
+        """
+        Test --threads gives the same results as test06
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test06', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test06', 'details.csv.bz2')
+
+        args = [
+            '--threads', 3,
+            '--max-identity', '100',
+            '--min-identity', '99',
+            '--specimen-map', specimen_map,
+            '--weights', weights,
+            '--copy-numbers', self.copy_numbers,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test19(self):
+        """
+        Test --threads with --chunksize gives the same results as test14
+        """
+
+        thisdatadir = self.thisdatadir
+
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test14', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test14', 'details.csv.bz2')
+
+        args = ['--threads', 2,
+                '--chunksize', 5,
+                '--hits-below-threshold',
+                '--details-out', details_out,
+                '--out', classify_out,
+                blast, seq_info, taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test20(self):
+        """
+        Test --cache-dir gives the same results as test01 when the
+        resolved thresholds are computed and when they are cached
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+        cache_dir = os.path.join(outdir, 'cache')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test01', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test01', 'details.csv.bz2')
+
+        for i in range(2):
+            classify_out = os.path.join(
+                outdir, 'classifications{}.csv.bz2'.format(i))
+            details_out = os.path.join(outdir, 'details{}.csv.bz2'.format(i))
+
+            args = [
+                '--cache-dir', cache_dir,
+                '--out', classify_out,
+                '--details-out', details_out,
+                blast,
+                seq_info,
+                taxonomy]
+
+            log.info(self.log_info.format(' '.join(map(str, args))))
+
+            self.main(args)
+
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+            self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test21(self):
+        """
+        Test a refpack in place of seq_info and taxonomy gives the same
+        results as test06
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+        refpack = os.path.join(outdir, 'refpack')
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test06', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test06', 'details.csv.bz2')
+
+        main(['refpack', seq_info, taxonomy, refpack])
+
+        args = [
+            '--max-identity', '100',
+            '--min-identity', '99',
+            '--specimen-map', specimen_map,
+            '--weights', weights,
+            '--copy-numbers', self.copy_numbers,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            refpack]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test22(self):
+        """
+        Test --incremental gives the results of test06 when specimens
+        are classified and when they are loaded from --cache-dir
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+        cache_dir = os.path.join(outdir, 'cache')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test06', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test06', 'details.csv.bz2')
+
+        for run in ['classified', 'cached']:
+            classify_out = os.path.join(
+                outdir, run + '.classifications.csv.bz2')
+            details_out = os.path.join(outdir, run + '.details.csv.bz2')
+
+            args = [
+                '--max-identity', '100',
+                '--min-identity', '99',
+                '--specimen-map', specimen_map,
+                '--weights', weights,
+                '--copy-numbers', self.copy_numbers,
+                '--incremental',
+                '--cache-dir', cache_dir,
+                '--out', classify_out,
+                '--details-out', details_out,
+                blast,
+                seq_info,
+                taxonomy]
+
+            log.info(self.log_info.format(' '.join(map(str, args))))
+
+            self.main(args)
+
+            self.assertTrue(os.listdir(cache_dir))
+            self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+            self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test23(self):
+        """
+        Test --profile-out records each stage
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+        profile_out = os.path.join(outdir, 'stages.json')
+
+        args = [
+            '--out', os.path.join(outdir, 'classifications.csv'),
+            '--details-out', os.path.join(outdir, 'details.csv'),
+            '--profile-out', profile_out,
+            blast, seq_info, taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        with open(profile_out) as f:
+            profile = json.load(f)
+
+        stages = [s['stage'] for s in profile['stages']]
+        for stage in ['load_blast', 'load_references', 'raw_filtering',
+                      'select_valid_hits', 'condense', 'assign',
+                      'summarize', 'write_details', 'write_output']:
+            self.assertIn(stage, stages)
+        self.assertEqual(set(stages), set(profile['totals'].keys()))
+
+        totals = profile['totals']
+        self.assertEqual(totals['load_blast']['rows_out'],
+                         totals['raw_filtering']['rows_in'])
+
+    def parquet_blast(self, outdir):
+        blast = pandas.read_csv(
+            os.path.join(self.thisdatadir, 'blast.csv.bz2'),
+            names=sequtils.BLAST_HEADER_DEFAULT,
+            dtype=dict(qseqid=str, sseqid=str))
+        blast_parquet = os.path.join(outdir, 'blast.parquet')
+        utils.write_columnar(blast, blast_parquet, 'parquet')
+        return blast_parquet
+
+    @unittest.skipIf(pyarrow is None, 'requires pyarrow')
+    def test24(self):
+        """
+        Test a parquet blast_file gives the same results as test06, in
+        whole and in chunks
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+
+        outdir = self.mkoutdir()
+        blast = self.parquet_blast(outdir)
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test06', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test06', 'details.csv.bz2')
+
+        for chunksize in [None, 1000]:
+            classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+            details_out = os.path.join(outdir, 'details.csv.bz2')
+
+            args = [
+                '--max-identity', '100',
+                '--min-identity', '99',
+                '--specimen-map', specimen_map,
+                '--weights', weights,
+                '--copy-numbers', self.copy_numbers,
+                '--out', classify_out,
+                '--details-out', details_out,
+                blast,
+                seq_info,
+                taxonomy]
+            if chunksize:
+                args = ['--chunksize', chunksize] + args
+
+            log.info(self.log_info.format(' '.join(map(str, args))))
+
+            self.main(args)
+
+            self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+            self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    @unittest.skipIf(pyarrow is not None, 'pyarrow is installed')
+    def test25(self):
+        """
+        Test a parquet blast_file exits without pyarrow
+        """
+
+        thisdatadir = self.thisdatadir
+        outdir = self.mkoutdir()
+
+        args = [
+            '--out', os.path.join(outdir, 'classifications.csv'),
+            os.path.join(outdir, 'blast.parquet'),
+            os.path.join(thisdatadir, 'seq_info.csv.bz2'),
+            os.path.join(thisdatadir, 'taxonomy.csv.bz2')]
+
+        self.assertRaises(SystemExit, self.main, args)
+
+    def test26(self):
+        """
+        Test --weights with --cache-dir gives the same results as test02
+        when the weights are read and when they are memory mapped, with
+        a weight for every qseqid
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+        cache_dir = os.path.join(outdir, 'cache')
+
+        # unlisted qseqids have a weight of 1
+        weights = os.path.join(outdir, 'weights.csv')
+        with open(weights, 'w') as f:
+            f.write(BZ2File(
+                os.path.join(thisdatadir, 'weights.csv.bz2')).read())
+            f.write('no:result:test:seq,1\n')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test02', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test02', 'details.csv.bz2')
+
+        for i in range(2):
+            classify_out = os.path.join(
+                outdir, 'classifications{}.csv.bz2'.format(i))
+            details_out = os.path.join(outdir, 'details{}.csv.bz2'.format(i))
+
+            args = [
+                '--weights', weights,
+                '--cache-dir', cache_dir,
+                '--out', classify_out,
+                '--details-out', details_out,
+                blast,
+                seq_info,
+                taxonomy]
+
+            log.info(self.log_info.format(' '.join(map(str, args))))
+
+            self.main(args)
+
+            self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+            self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test27(self):
+        """
+        Test --chunksize without --details-out gives the classifications
+        of test06
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test06', 'classifications.csv.bz2')
+
+        args = [
+            '--chunksize', 5,
+            '--max-identity', '100',
+            '--min-identity', '99',
+            '--specimen-map', specimen_map,
+            '--weights', weights,
+            '--copy-numbers', self.copy_numbers,
+            '--out', classify_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+
+    def test28(self):
+        """
+        Test hits of a seqname listed twice in seq_info are detailed
+        for each of its seq_info rows
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        # list the subject of the first hit again with another accession
+        seq_info = pandas.read_csv(
+            os.path.join(thisdatadir, 'seq_info.csv.bz2'), dtype=str)
+        sseqid = pandas.read_csv(blast, header=None, dtype=str).iloc[0, 1]
+        duplicate = seq_info[seq_info['seqname'] == sseqid]
+        seq_info = seq_info.append(duplicate.assign(accession='duplicate'))
+        seq_info_out = os.path.join(outdir, 'seq_info.csv')
+        seq_info.to_csv(seq_info_out, index=False)
+
+        classify_out = os.path.join(outdir, 'classifications.csv')
+        details_out = os.path.join(outdir, 'details.csv')
+
+        args = [
+            '--details-full',
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info_out,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        details = pandas.read_csv(details_out, dtype=str)
+        details = details[details['sseqid'] == sseqid]
+        accessions = details['accession'].value_counts()
+        self.assertEqual(
+            sorted(accessions.index),
+            sorted([duplicate['accession'].iloc[0], 'duplicate']))
+        self.assertEqual(accessions.nunique(), 1)
+
+
+class TestQseqidChunks(TestBase):
+
+    qseqids = numpy.repeat(['q{}'.format(i) for i in range(30)],
+                           numpy.arange(1, 31))
+    df = pandas.DataFrame({'qseqid': qseqids,
+                           'pident': numpy.arange(len(qseqids))})
+
+    def test01(self):
+        """
+        every qseqid is in one chunk and all rows are kept in order
+        """
+
+        for size in [1, 7, 100, 1000]:
+            chunks = [self.df.iloc[i:i + size]
+                      for i in range(0, len(self.df), size)]
+            chunks = list(classifier.qseqid_chunks(chunks))
+            self.assertTrue(pandas.concat(chunks).equals(self.df))
+            qseqids = [q for c in chunks for q in c['qseqid'].unique()]
+            self.assertEqual(len(qseqids), len(set(qseqids)))
+
+    def test02(self):
+        """
+        hits of a qseqid that are not contiguous are an error
+        """
+
+        df = pandas.concat([self.df, self.df.iloc[:1]])
+        chunks = [df.iloc[i:i + 50] for i in range(0, len(df), 50)]
+        self.assertRaises(
+            ValueError, list, classifier.qseqid_chunks(chunks))
+
+
+class TestBestNHits(TestBase):
+
+    def test01(self):
+        """
+        best_n_hits keeps hits with no more mismatches than the Nth
+        best hit of each query, as a groupby with nsmallest would
+        """
+
+        rng = numpy.random.RandomState(0)
+        df = pandas.DataFrame({
+            'specimen': rng.choice(['a', 'b'], 500),
+            'qseqid': rng.choice(['q{}'.format(i) for i in range(40)], 500),
+            'mismatch': rng.randint(0, 6, 500)})
+        df = df.sort_values(by=['specimen', 'qseqid'])
+
+        def filter_mismatches(g, best_n):
+            threshold = g['mismatch'].nsmallest(best_n).iloc[-1]
+            return g[g['mismatch'] <= threshold]
+
+        for best_n in [1, 3, 20]:
+            expected = df.groupby(
+                by=['specimen', 'qseqid'],
+                group_keys=False).apply(filter_mismatches, best_n)
+            self.assertTrue(
+                classifier.best_n_hits(df, best_n).equals(expected))
+
+
+class TestBestRank(TestBase):
+
+    ranks = ['root', 'family', 'genus', 'species']
+
+    def test01(self):
+        """
+        best_rank is the most common condensed_rank of each group with
+        ties going to the most specific rank
+        """
+
+        df = pandas.DataFrame({
+            'specimen': ['a'] * 5 + ['b'] * 4 + ['c'],
+            'assignment_hash': [1, 1, 1, 2, 2, 1, 1, 1, 1, 0],
+            'condensed_rank': ['genus', 'species', 'genus', 'family',
+                               'species', 'genus', 'species', 'species',
+                               'genus', numpy.nan]})
+
+        best = classifier.best_rank(
+            df, ['specimen', 'assignment_hash'], self.ranks)
+
+        self.assertEqual(best[('a', 1)], 'genus')
+        self.assertEqual(best[('a', 2)], 'species')
+        self.assertEqual(best[('b', 1)], 'species')
+        self.assertNotIn(('c', 0), best.index)
+
+    def test02(self):
+        """
+        ranks missing from ranks are the least specific
+        """
+
+        df = pandas.DataFrame({
+            'specimen': ['a', 'a'],
+            'assignment_hash': [1, 1],
+            'condensed_rank': ['species', 'no_rank']})
+
+        best = classifier.best_rank(
+            df, ['specimen', 'assignment_hash'], self.ranks)
+        self.assertEqual(best[('a', 1)], 'species')
+
+
+class TestSummary(TestBase):
+
+    output = pandas.DataFrame(
+        {'reads': [3.0, 1.0, 0.0001, 5.0]},
+        index=pandas.Index(['b', 'b', 'b', 'a'], name='specimen'))
+
+    def test01(self):
+        """
+        pct is the percent of each specimen's total
+        """
+
+        pct = classifier.pct(self.output, 'reads')
+        for specimen, group in self.output.groupby(level='specimen'):
+            expected = group['reads'] / group['reads'].sum() * 100
+            self.assertTrue(numpy.allclose(pct[specimen], expected))
+
+    def test02(self):
+        """
+        round_up raises values below 0.01 to 0.01
+        """
+
+        pct = classifier.round_up(classifier.pct(self.output, 'reads'))
+        self.assertEqual(pct.min(), 0.01)
+        self.assertEqual(pct.iloc[0], 3.0 / 4.0001 * 100)
+
+    def test03(self):
+        """
+        assignment_ids number rows within each specimen
+        """
+
+        output = classifier.assignment_ids(self.output.sort_index(
+            kind='mergesort'))
+        self.assertEqual(output.index.names, ['specimen', 'assignment_id'])
+        self.assertEqual(output.index.tolist(),
+                         [('a', '0'), ('b', '0'), ('b', '1'), ('b', '2')])
+
+
+class TestNameAssignments(TestBase):
+
+    def test01(self):
+        """
+        name_assignments stars and names each (specimen, assignment_hash)
+        group as compound_assignment of its set of starred condensed ids
+        """
+
+        taxonomy_file = os.path.join(
+            datadir, 'classifier', 'TestClassifier', 'taxonomy.csv.bz2')
+        taxtable = TaxTable.read_csv(taxonomy_file)
+        species = [r['tax_id'] for r in csv.DictReader(BZ2File(taxonomy_file))
+                   if r['rank'] == 'species']
+
+        rng = numpy.random.RandomState(0)
+        df = pandas.DataFrame({
+            'specimen': rng.choice(['s1', 's2', 's3'], 300),
+            'assignment_hash': rng.randint(1, 5, 300),
+            'pident': rng.choice([97.5, 99.0, 100.0, numpy.nan], 300)})
+        # condensed ids are a function of the assignment hash
+        df['condensed_id'] = [
+            species[h * 3 + rng.randint(0, h)] for h in df['assignment_hash']]
+
+        names = classifier.name_assignments(df, taxtable, starred=100)
+        self.assertTrue(names.index.equals(df.index))
+
+        df = df.join(names)
+        for _, group in df.groupby(by=['specimen', 'assignment_hash']):
+            stars = group.groupby('condensed_id')['pident'].max() >= 100
+            for condensed_id, starred in stars.iteritems():
+                self.assertTrue((group.loc[group['condensed_id'] ==
+                                 condensed_id, 'starred'] == starred).all())
+            expected = sequtils.compound_assignment(
+                stars.iteritems(), taxtable)
+            self.assertTrue((group['assignment'] == expected).all())
+
+
+class TestIncludeRefRanks(TestBase):
+
+    def test01(self):
+        """
+        {rank}_id and {rank}_name are the ancestor of each tax_id at
+        rank, or 0 and no name
+        """
+
+        taxonomy_file = os.path.join(
+            datadir, 'classifier', 'TestClassifier', 'taxonomy.csv.bz2')
+        taxtable = TaxTable.read_csv(taxonomy_file)
+        rows = {r['tax_id']: r for r in csv.DictReader(BZ2File(taxonomy_file))}
+
+        rng = numpy.random.RandomState(0)
+        df = pandas.DataFrame({'tax_id': rng.choice(sorted(rows), 100)})
+        df = classifier.include_ref_ranks(df, taxtable, ['genus', 'species'])
+
+        for _, hit in df.iterrows():
+            for rank in ['genus', 'species']:
+                ancestor = rows[hit['tax_id']][rank]
+                if ancestor:
+                    self.assertEqual(hit[rank + '_id'], ancestor)
+                    self.assertEqual(hit[rank + '_name'],
+                                     rows[ancestor]['tax_name'])
+                else:
+                    self.assertEqual(hit[rank + '_id'], 0)
+                    self.assertTrue(pandas.isnull(hit[rank + '_name']))
+
+
+class TestSelectValidHits(TestBase):
+
+    def test01(self):
+        """
+        valid hits and hits below threshold partition the hits with
+        specimen and qseqid, even with duplicate index labels
+        """
+
+        taxonomy_file = os.path.join(
+            datadir, 'classifier', 'TestClassifier', 'taxonomy.csv.bz2')
+        taxtable = TaxTable.read_csv(taxonomy_file)
+        thresholds = pandas.DataFrame(
+            {'{}_threshold'.format(r): [95.0] for r in taxtable.ranks})
+        thresholds['species_threshold'] = 99.0
+
+        rng = numpy.random.RandomState(0)
+        tax_ids = [r['tax_id'] for r in csv.DictReader(BZ2File(taxonomy_file))]
+        df = pandas.DataFrame({
+            'specimen': rng.choice(['s1', 's2', None], 200),
+            'qseqid': rng.choice(['q1', 'q2', 'q3', 'q4'], 200),
+            'tax_code': taxtable.codes(rng.choice(tax_ids, 200)),
+            'threshold_row': 0,
+            'pident': rng.choice([90.0, 97.0, 99.5], 200)},
+            index=numpy.arange(200) % 150)
+
+        valid, below = classifier.select_valid_hits(
+            df, taxtable, thresholds, below_threshold=True)
+
+        self.assertTrue((valid[classifier.ASSIGNMENT_TAX_ID].notnull()).all())
+        self.assertNotIn(classifier.ASSIGNMENT_TAX_ID, below.columns)
+        self.assertEqual(
+            sorted(valid.index.tolist() + below.index.tolist()),
+            sorted(df.index[df['specimen'].notnull()].tolist()))
+        self.assertTrue(len(valid) and len(below))
+
+        valid_only, none = classifier.select_valid_hits(
+            df, taxtable, thresholds)
+        self.assertIsNone(none)
+        self.assertTrue(valid_only.equals(valid))
+
+
+class TestWriteDetails(TestBase):
+
+    columns = ['specimen', 'assignment_id', 'pident', 'starred', 'qseqid']
+
+    rng = numpy.random.RandomState(0)
+    df = pandas.DataFrame({
+        'specimen': rng.choice(['s1', 's2', None], 200),
+        'assignment_id': rng.choice(['0', '1', '10', '2'], 200),
+        'pident': rng.choice([99.5, 97.25, numpy.nan, 100], 200),
+        'starred': rng.choice([True, False, numpy.nan], 200),
+        'qseqid': ['q{}'.format(i % 13) for i in range(200)]})
+
+    def test01(self):
+        """
+        csv written in blocks is the same as with to_csv
+        """
+
+        outdir = self.mkoutdir()
+        for ext in ['.csv', '.csv.bz2']:
+            expected = os.path.join(outdir, 'expected' + ext)
+            out = os.path.join(outdir, 'details' + ext)
+            self.df.to_csv(expected, columns=self.columns, index=False,
+                           float_format='%.2f',
+                           compression=classifier.get_compression(expected))
+            for threads in [1, 2]:
+                classifier.write_details(self.df, out, self.columns,
+                                         threads=threads, blocksize=7)
+                self.assertTrue(filecmp.cmp(expected, out, shallow=False))
+
+    def test02(self):
+        """
+        gzip blocks compressed in parallel decompress to the same csv
+        """
+
+        out = os.path.join(self.mkoutdir(), 'details.csv.gz')
+        classifier.write_details(self.df, out, self.columns,
+                                 threads=3, blocksize=7)
+        self.assertEqual(
+            gzip.open(out).read(),
+            self.df.to_csv(None, columns=self.columns, index=False,
+                           float_format='%.2f'))
@@ -0,0 +1,203 @@
+"""
+Test references module.
+"""
+
+import logging
+from os import path
+
+import numpy
+import pandas
+
+from bioy_pkg import references
+from bioy_pkg.taxtable import TaxTable
+
+from __init__ import TestBase, datadir as datadir
+
+log = logging.getLogger(__name__)
+
+classifierdir = path.join(datadir, 'classifier', 'TestClassifier')
+
+
+class TestRefpack(TestBase):
+
+    seq_info = references.read_seq_info(
+        path.join(classifierdir, 'seq_info.csv.bz2'))
+    taxonomy = TaxTable.read_csv(path.join(classifierdir, 'taxonomy.csv.bz2'))
+    thresholds = references.read_rank_thresholds(taxonomy.ranks)
+    resolved = references.resolve_thresholds(taxonomy, thresholds)
+
+    def test01(self):
+        """
+        read_refpack returns what was given to write_refpack
+        """
+
+        outdir = path.join(self.mkoutdir(), 'refpack')
+        references.write_refpack(
+            outdir, self.taxonomy, self.seq_info, self.thresholds,
+            self.resolved)
+
+        taxonomy, seq_info, thresholds, resolved = references.read_refpack(
+            outdir)
+
+        self.assertEqual(taxonomy.ranks, self.taxonomy.ranks)
+        for tax_id in self.taxonomy:
+            self.assertEqual(dict(taxonomy[tax_id]),
+                             dict(self.taxonomy[tax_id]))
+
+        expected = references.SeqInfo.from_frame(self.seq_info, self.taxonomy)
+        for a, b in [(seq_info.seqnames.qseqids, expected.seqnames.qseqids),
+                     (seq_info.seqnames.offsets, expected.seqnames.offsets),
+                     (seq_info.seqnames.values, expected.seqnames.values),
+                     (seq_info.tax_codes, expected.tax_codes),
+                     (seq_info.accessions, expected.accessions)]:
+            # memory mapped rather than decoded
+            self.assertIsInstance(a, numpy.memmap)
+            self.assertTrue(numpy.array_equal(a, b))
+        self.assertTrue(thresholds.equals(self.thresholds))
+        for a, b in zip(resolved, self.resolved):
+            self.assertTrue(numpy.array_equal(a, b))
+
+    def test02(self):
+        """
+        resolved thresholds come from the most specific listed tax_id
+        """
+
+        rows, ranks = self.resolved
+        listed = set(self.thresholds.index)
+
+        for code, tax_id in enumerate(self.taxonomy.tax_ids):
+            node = self.taxonomy[tax_id]
+            lineage = [node[r] for r in self.taxonomy.ranks]
+            lineage = [t for t in lineage if t in listed]
+            if lineage:
+                self.assertEqual(self.thresholds.index[rows[code]],
+                                 lineage[-1])
+                self.assertEqual(
+                    node[self.taxonomy.ranks[ranks[code]]], lineage[-1])
+            else:
+                self.assertEqual((rows[code], ranks[code]), (-1, -1))
+
+
+class TestSeqInfo(TestBase):
+
+    seq_info = references.read_seq_info(
+        path.join(classifierdir, 'seq_info.csv.bz2'))
+    taxonomy = TaxTable.read_csv(path.join(classifierdir, 'taxonomy.csv.bz2'))
+
+    def test01(self):
+        """
+        lookup repeats hits for each seq_info row of their seqname, as
+        DataFrame.join does
+        """
+
+        # list some seqnames again with other accessions
+        seq_info = self.seq_info.append(
+            self.seq_info.iloc[::100].assign(accession='duplicate'))
+        rng = numpy.random.RandomState(0)
+        hits = pandas.DataFrame({'sseqid': rng.choice(
+            list(seq_info.index[:300]) + ['missing'], 1000)})
+
+        expected = hits.join(seq_info, on='sseqid', how='inner')
+        expected = expected.sort_index(kind='mergesort')
+
+        info = references.SeqInfo.from_frame(seq_info, self.taxonomy)
+        rows, seq_codes = info.lookup(hits['sseqid'].values)
+
+        self.assertTrue(numpy.array_equal(rows, expected.index))
+        self.assertTrue(numpy.array_equal(
+            info.tax_codes.take(seq_codes),
+            self.taxonomy.codes(expected['tax_id'])))
+        self.assertEqual(info.accession(seq_codes).tolist(),
+                         expected['accession'].tolist())
+
+
+class TestQseqidMap(TestBase):
+
+    rng = numpy.random.RandomState(0)
+    qseqids = ['q{}'.format(i) for i in range(30)]
+
+    specimens = pandas.DataFrame({
+        'qseqid': rng.choice(qseqids[:20], 40),
+        'specimen': rng.choice(['s1', 's2', 's3', None], 40)},
+        columns=['qseqid', 'specimen']).drop_duplicates()
+
+    hits = pandas.DataFrame({
+        'qseqid': rng.choice(qseqids, 100),
+        'pident': rng.uniform(90, 100, 100)},
+        columns=['qseqid', 'pident'])
+
+    def check(self, qseqid_map, values, column):
+        for how in ['inner', 'left']:
+            expected = self.hits.join(
+                values.set_index('qseqid'), on='qseqid', how=how)
+            joined = qseqid_map.join(self.hits, column, how=how)
+            self.assertTrue(
+                joined.sort_index(kind='mergesort').equals(
+                    expected.sort_index(kind='mergesort')))
+
+    def test01(self):
+        """
+        join gives the same rows as DataFrame.join
+        """
+
+        qseqid_map = references.QseqidMap.from_series(
+            self.specimens.set_index('qseqid')['specimen'])
+        self.check(qseqid_map, self.specimens, 'specimen')
+
+        weights = pandas.DataFrame({
+            'qseqid': self.qseqids[5:],
+            'weight': self.rng.randint(1, 10, 25).astype(float)},
+            columns=['qseqid', 'weight'])
+        qseqid_map = references.QseqidMap.from_series(
+            weights.set_index('qseqid')['weight'])
+        self.check(qseqid_map, weights, 'weight')
+
+    def test02(self):
+        """
+        cached maps are memory mapped and join as read
+        """
+
+        outdir = self.mkoutdir()
+        filename = path.join(outdir, 'map.csv')
+        self.specimens.to_csv(filename, index=False, header=False)
+        cache_dir = path.join(outdir, 'cache')
+
+        qseqid_map = references.read_qseqid_map(filename, 'specimen', str)
+        for i in range(2):
+            cached = references.cached_qseqid_map(
+                cache_dir, filename, 'specimen', str)
+            self.assertIsInstance(cached.values, numpy.memmap)
+            self.assertTrue(cached.join(self.hits, 'specimen').equals(
+                qseqid_map.join(self.hits, 'specimen')))
+
+    def test04(self):
+        """
+        cached float maps join when every qseqid has a value
+        """
+
+        outdir = self.mkoutdir()
+        filename = path.join(outdir, 'weights.csv')
+        weights = pandas.DataFrame({
+            'qseqid': self.qseqids,
+            'weight': self.rng.randint(1, 10, 30).astype(float)},
+            columns=['qseqid', 'weight'])
+        weights.to_csv(filename, index=False, header=False)
+        cache_dir = path.join(outdir, 'cache')
+
+        for i in range(2):
+            cached = references.cached_qseqid_map(
+                cache_dir, filename, 'weight', float)
+            self.assertIsInstance(cached.values, numpy.memmap)
+            self.check(cached, weights, 'weight')
+
+    def test03(self):
+        """
+        an empty map joins no rows
+        """
+
+        qseqid_map = references.QseqidMap.from_series(
+            pandas.Series([], index=pandas.Index([], name='qseqid')))
+        self.assertTrue(qseqid_map.join(self.hits, 'specimen').empty)
+        self.assertEqual(
+            len(qseqid_map.join(self.hits, 'specimen', how='left')),
+            len(self.hits))
@@ -6,11 +6,13 @@ import cPickle
 import csv
 import logging
 import pprint
+import random
 import sys
 import unittest
 
 from bz2 import BZ2File
 from collections import Counter
+from cStringIO import StringIO
 from os import path
 
 from bioy_pkg import sequtils
@@ -129,6 +131,30 @@ class TestEncodeAndDecode(TestBase):
 
         self.assertEquals(seq, sequtils.homodecode(e, c))
 
+    def test02(self):
+        """
+        homoencode_many and homodecode_many are inverses for a batch
+        including empty sequences
+        """
+
+        seqs = ['TCTGGACCGTGTCTTTCAG', '', 'A', 'AAAAC', 'GGGG', '']
+
+        encoded = sequtils.homoencode_many(seqs)
+        self.assertEqual(encoded[3][0], 'AC')
+        self.assertEqual(list(encoded[3][1]), [4, 1])
+        self.assertEqual(encoded[1][0], '')
+
+        rle_seqs, counts = zip(*encoded)
+        self.assertEqual(seqs, sequtils.homodecode_many(rle_seqs, counts))
+
+    def test03(self):
+        """
+        gaps and insertions are expanded as single gaps
+        """
+
+        self.assertEqual(
+            sequtils.homodecode('A-C=G', [2, 1, 3]), 'AA-C-GGG')
+
 
 class TestRle(TestBase):
 
@@ -146,7 +172,19 @@ class TestRle(TestBase):
 class TestDecodeAlignment(TestBase):
 
     def test01(self):
-        pass
+        self.assertEqual(
+            sequtils.homodecodealignment('A-CG', [2, 1, 3], 'ATC-', [1, 2, 2]),
+            ('AA--C=GGG', 'A=TTCC---'))
+
+    def test02(self):
+        """
+        alignments longer than the recursion limit
+        """
+
+        seq = 'ACGT' * 1000
+        counts = [1, 2] * 2000
+        decoded, _ = sequtils.homodecodealignment(seq, counts, seq, counts)
+        self.assertEqual(decoded, sequtils.homodecode(seq, counts))
 
 
 class TestErrorCounting(TestBase):
@@ -286,6 +324,95 @@ class TestAsciiEncoding(TestBase):
         self.assertRaises(ValueError, sequtils.to_ascii, v)
 
 
+class TestConsensus(TestBase):
+
+    rng = random.Random(0)
+    seqs = [sequtils.SeqLite(str(i), str(i), ''.join(
+        [rng.choice('ACGTNMR--') for _ in range(rng.choice([40, 40, 35]))]))
+        for i in range(25)]
+    rlelist = [[rng.randint(1, 4) for _ in s.seq.replace('-', '')]
+               for s in seqs]
+
+    def test01(self):
+        """
+        consensus is cons_char of each column of get_char_counts
+        """
+
+        cons = [sequtils.cons_char(c)
+                for c in sequtils.get_char_counts(self.seqs)]
+        self.assertEqual(sequtils.consensus(self.seqs, degap=False),
+                         ''.join(cons))
+
+    def test02(self):
+        """
+        consensus with run lengths uses cons_rle of get_rle_counts
+        """
+
+        cons = [sequtils.cons_char(c) * sequtils.cons_rle(n) for c, n in
+                sequtils.get_rle_counts(self.seqs, self.rlelist)]
+        self.assertEqual(sequtils.consensus(self.seqs, self.rlelist),
+                         ''.join(cons).replace('-', ''))
+
+    def test03(self):
+        """
+        ties are IUPAC codes; ties in run length choose the shortest
+        """
+
+        seqs = [sequtils.SeqLite(n, n, s) for n, s in
+                [('a', 'AC-'), ('b', 'GC-'), ('c', 'G-T')]]
+        self.assertEqual(sequtils.consensus(seqs, degap=False), 'GC-')
+        self.assertEqual(
+            sequtils.consensus(seqs, [[1, 2], [3, 2], [3, 5]]), 'GGGCC')
+
+        seqs = seqs[:2]
+        self.assertEqual(
+            sequtils.consensus(seqs, [[2, 1], [3, 3]], degap=False), 'RRC-')
+
+
+class TestRleIndex(TestBase):
+
+    rle_file = path.join(datadir, 'rle_100.csv.bz2')
+    rles = dict(csv.reader(BZ2File(rle_file)))
+
+    def test01(self):
+        """
+        counts are as from_ascii of the csv values, also when saved and
+        memory mapped
+        """
+
+        index = sequtils.read_rle(self.rle_file)
+        outdir = path.join(self.mkoutdir(), 'rle')
+        index.save(outdir)
+
+        for index in [index, sequtils.read_rle(outdir)]:
+            self.assertEqual(len(index), len(self.rles))
+            for name, rle in self.rles.items():
+                self.assertIn(name, index)
+                self.assertEqual(index[name], sequtils.from_ascii(rle))
+            self.assertNotIn('not_a_read', index)
+            self.assertIsNone(index.get('not_a_read'))
+            self.assertRaises(KeyError, lambda: index['not_a_read'])
+
+    def test02(self):
+        """
+        write_csv is the inverse of read_csv, skipping a header row
+        """
+
+        rows = [['name', 'rle'], ['r2', '12'], ['r1', '311'], ['r3', '']]
+        handle = StringIO()
+        csv.writer(handle).writerows(rows)
+        handle.seek(0)
+
+        index = sequtils.RleIndex.read_csv(handle)
+        self.assertEqual(index['r1'], [3, 1, 1])
+        self.assertEqual(index['r3'], [])
+
+        handle = StringIO()
+        index.write_csv(handle)
+        handle.seek(0)
+        self.assertEqual(sorted(csv.reader(handle)), sorted(rows[1:]))
+
+
 class TestFastaLite(TestBase):
 
     def test01(self):
@@ -308,6 +435,41 @@ class TestFastaLite(TestBase):
             for seq in seqs:
                 pass
 
+    def test03(self):
+        """
+        Sequences wrapped over several lines are joined
+        """
+
+        fasta = '>a one\nAC\n GT \n\n>b\nTT\n>c\n'
+        seqs = list(sequtils.fastalite(StringIO(fasta)))
+        self.assertEquals(
+            seqs, [('a', 'a one', 'ACGT'), ('b', 'b', 'TT')])
+
+    def test04(self):
+        """
+        Records are the same however the file is split into blocks
+        """
+
+        with open(self.data('16S_random.fasta')) as f:
+            fasta = f.read()
+
+        expected = list(sequtils.fastalite(StringIO(fasta)))
+        for blocksize in [1, 7, 100, 4096]:
+            seqs = sequtils.fastalite(StringIO(fasta), blocksize=blocksize)
+            self.assertEquals(list(seqs), expected)
+
+        seqs = sequtils.fastalite(StringIO(fasta), limit=5, blocksize=7)
+        self.assertEquals(list(seqs), expected[:5])
+
+    def test05(self):
+        with open(self.data('16S_random.fasta')) as f:
+            expected = list(sequtils.fastalite(f))
+            f.seek(0)
+            batches = list(sequtils.fastalite_batches(f, size=3))
+
+        self.assertEquals(sum(batches, []), expected)
+        self.assertTrue(all(len(b) == 3 for b in batches[:-1]))
+
 
 class TestParseClusters(TestBase):
 
@@ -376,6 +538,19 @@ class TestCompoundAssignment(TestBase):
         for a in self.assignments:
             self.assertRaises(TypeError, sequtils.compound_assignment, a, {})
 
+    def test04(self):
+        """
+        compound_assignments names repeated sets as compound_assignment
+        """
+
+        taxonomy = self.taxonomy
+        assignments = self.assignments * 2 + [
+            list(reversed(list(a))) for a in self.assignments]
+
+        self.assertEquals(
+            sequtils.compound_assignments(assignments, taxonomy),
+            [sequtils.compound_assignment(a, taxonomy) for a in assignments])
+
 
 class TestCondenseAssignment(TestBase):
 
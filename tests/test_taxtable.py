@@ -0,0 +1,109 @@
+"""
+Test taxtable module.
+"""
+
+import cPickle
+import csv
+import logging
+
+from bz2 import BZ2File
+from os import path
+
+import numpy
+
+from bioy_pkg import sequtils
+from bioy_pkg.taxtable import TaxTable
+
+from __init__ import TestBase, datadir as datadir
+
+log = logging.getLogger(__name__)
+
+sequtilsdir = path.join(datadir, 'sequtils')
+
+
+class TestTaxTable(TestBase):
+
+    taxonomy_file = path.join(datadir, 'taxonomy.csv.bz2')
+
+    rows = list(csv.DictReader(BZ2File(taxonomy_file)))
+    taxonomy = {t['tax_id']: t for t in rows}
+    taxtable = TaxTable.read_csv(taxonomy_file)
+
+    def test01(self):
+        """
+        nodes are equivalent to csv.DictReader rows
+        """
+
+        self.assertEqual(len(self.taxtable), len(self.rows))
+        for row in self.rows:
+            self.assertEqual(dict(self.taxtable[row['tax_id']]), row)
+
+    def test02(self):
+        """
+        condense_ids gives the same result as with a dict
+        """
+
+        assignments = path.join(
+            sequtilsdir, 'TestCondenseAssignment', 'assignments.pkl.bz2')
+        assignments = cPickle.load(BZ2File(assignments))
+
+        for max_size in [0, 1, 3]:
+            for a in assignments:
+                self.assertEqual(
+                    sequtils.condense_ids(a, self.taxtable, max_size=max_size),
+                    sequtils.condense_ids(a, self.taxonomy, max_size=max_size))
+
+    def test03(self):
+        """
+        compound_assignment gives the same result as with a dict
+        """
+
+        assignments = path.join(
+            sequtilsdir, 'TestCompoundAssignment', 'assignments.pkl.bz2')
+        assignments = cPickle.load(BZ2File(assignments))
+
+        for a in assignments:
+            self.assertEqual(
+                sequtils.compound_assignment(a, self.taxtable),
+                sequtils.compound_assignment(a, self.taxonomy))
+
+    def test04(self):
+        """
+        resolve to the most specific defined member of each lineage
+        """
+
+        taxtable = self.taxtable
+        genera = [r['tax_id'] for r in self.rows if r['rank'] == 'genus']
+
+        defined = numpy.zeros(len(taxtable), dtype=bool)
+        defined[taxtable.codes(genera)] = True
+        defined[taxtable.codes(['1'])] = True
+
+        tax_ids = [r['tax_id'] for r in self.rows] + ['not_a_tax_id']
+        resolved, ranks = taxtable.resolve(taxtable.codes(tax_ids), defined)
+
+        for tax_id, code, rank in zip(tax_ids, resolved, ranks):
+            row = self.taxonomy.get(tax_id)
+            if row is None:
+                self.assertEqual((code, rank), (-1, -1))
+            elif row['genus']:
+                self.assertEqual(taxtable.tax_ids[code], row['genus'])
+                self.assertEqual(taxtable.ranks[rank], 'genus')
+            else:
+                self.assertEqual(taxtable.tax_ids[code], '1')
+                self.assertEqual(taxtable.ranks[rank], 'root')
+
+    def test05(self):
+        """
+        take returns NaN for missing values
+        """
+
+        taxtable = self.taxtable
+        codes = taxtable.codes(['1', 'not_a_tax_id'])
+
+        names = taxtable.take(codes, 'tax_name')
+        self.assertEqual(names[0], self.taxonomy['1']['tax_name'])
+        self.assertTrue(numpy.isnan(names[1]))
+
+        parents = taxtable.take(codes[:1], 'parent_id')
+        self.assertEqual(parents[0], self.taxonomy['1']['parent_id'])
@@ -0,0 +1,74 @@
+"""
+Test usearch
+"""
+
+import logging
+import unittest
+
+from os import path
+
+from bioy_pkg import main, utils
+from bioy_pkg.sequtils import USEARCH_HEADER
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from __init__ import TestBase, TestCaseSuppressOutput, datadir
+
+log = logging.getLogger(__name__)
+
+
+class TestUsearch(TestBase, TestCaseSuppressOutput):
+
+    def main(self, arguments):
+        main(['usearch'] + arguments)
+
+    fieldnames = ['qseqid', 'sseqid', 'pident', 'length']
+
+    def empty_query(self, outdir):
+        query = path.join(outdir, 'query.fasta')
+        open(query, 'w').close()
+        return query
+
+    def test01(self):
+        """
+        An empty query writes only a header
+        """
+
+        outdir = self.mkoutdir()
+        out = path.join(outdir, 'usearch.csv')
+        self.main([self.empty_query(outdir), path.join(datadir, 'two.fasta'),
+                   '--out', out])
+
+        with open(out) as f:
+            self.assertEqual(f.read().strip(), ','.join(USEARCH_HEADER))
+
+    @unittest.skipIf(pyarrow is None, 'requires pyarrow')
+    def test02(self):
+        """
+        An empty query writes a parquet file without rows
+        """
+
+        outdir = self.mkoutdir()
+        out = path.join(outdir, 'usearch.parquet')
+        self.main([self.empty_query(outdir), path.join(datadir, 'two.fasta'),
+                   '--fieldnames', ','.join(self.fieldnames),
+                   '--out', out])
+
+        df = utils.read_columnar(out)
+        self.assertTrue(df.empty)
+        self.assertEqual(df.columns.tolist(), self.fieldnames)
+
+    @unittest.skipIf(pyarrow is not None, 'pyarrow is installed')
+    def test03(self):
+        """
+        A parquet --out exits without pyarrow
+        """
+
+        outdir = self.mkoutdir()
+        self.assertRaises(
+            SystemExit, self.main,
+            [self.empty_query(outdir), path.join(datadir, 'two.fasta'),
+             '--out', path.join(outdir, 'usearch.parquet')])
@@ -6,8 +6,15 @@ from os import path
 import unittest
 import logging
 
+import pandas
+
 from bioy_pkg import utils
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
 from __init__ import TestBase
 log = logging.getLogger(__name__)
 
@@ -15,3 +22,129 @@ class TestUtils(TestBase):
 
     def test01(self):
         pass
+
+
+class TestLRUCache(TestBase):
+
+    def test01(self):
+        """
+        least recently used items are discarded
+        """
+
+        cache = utils.LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        self.assertEqual(len(cache), 2)
+
+    def test02(self):
+        """
+        maxsize 0 caches nothing
+        """
+
+        cache = utils.LRUCache(maxsize=0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class TestStageProfiler(TestBase):
+
+    def test01(self):
+        """
+        stages are recorded in order and totaled by name
+        """
+
+        profiler = utils.StageProfiler()
+        for i in range(3):
+            with profiler.stage('a', rows_in=10) as stage:
+                stage['rows_out'] = 5
+            record = profiler.start('b')
+            profiler.stop(record, rows_out=i)
+
+        self.assertEqual([s['stage'] for s in profiler.stages],
+                         ['a', 'b'] * 3)
+        totals = profiler.totals()
+        self.assertEqual(totals.keys(), ['a', 'b'])
+        self.assertEqual(totals['a']['calls'], 3)
+        self.assertEqual(totals['a']['rows_in'], 30)
+        self.assertEqual(totals['a']['rows_out'], 15)
+        self.assertEqual(totals['b']['rows_out'], 3)
+
+        self.assertEqual(len(profiler.pop(4)), 2)
+        self.assertEqual(len(profiler.stages), 4)
+
+
+class TestColumnar(TestBase):
+
+    df = pandas.DataFrame({
+        'qseqid': ['q{}'.format(i // 3) for i in range(10)],
+        'sseqid': ['s{}'.format(i) for i in range(9)] + [None],
+        'pident': [99.5, 97.25, 100.0] * 3 + [float('nan')]},
+        columns=['qseqid', 'sseqid', 'pident'])
+
+    def test01(self):
+        """
+        columnar formats are chosen by file extension
+        """
+
+        self.assertEqual(utils.columnar_format('a/b.parquet'), 'parquet')
+        self.assertEqual(utils.columnar_format('b.pq'), 'parquet')
+        self.assertEqual(utils.columnar_format('b.feather'), 'feather')
+        self.assertIsNone(utils.columnar_format('b.csv'))
+        self.assertIsNone(utils.columnar_format('b.parquet.gz'))
+
+    @unittest.skipIf(pyarrow is None, 'requires pyarrow')
+    def test02(self):
+        """
+        parquet and feather files read back in whole, in chunks and by
+        column
+        """
+
+        outdir = self.mkoutdir()
+        for ext in ['.parquet', '.feather']:
+            filename = path.join(outdir, 'blast' + ext)
+            utils.write_columnar(
+                self.df, filename, utils.columnar_format(filename))
+
+            df = utils.read_columnar(filename)
+            self.assertTrue(df.equals(self.df))
+
+            chunks = list(utils.read_columnar(filename, chunksize=4))
+            self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+            self.assertTrue(pandas.concat(chunks).equals(self.df))
+
+            df = utils.read_columnar(filename, columns=['qseqid', 'pident'])
+            self.assertEqual(df.columns.tolist(), ['qseqid', 'pident'])
+
+    @unittest.skipIf(pyarrow is None, 'requires pyarrow')
+    def test03(self):
+        """
+        chunks of multiple row groups and record batches are indexed by
+        row number in the file
+        """
+
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+
+        outdir = self.mkoutdir()
+        table = pyarrow.Table.from_pandas(self.df, preserve_index=False)
+
+        parquet = path.join(outdir, 'blast.parquet')
+        pq.write_table(table, parquet, row_group_size=3)
+        feather_file = path.join(outdir, 'blast.feather')
+        feather.write_feather(table, feather_file, chunksize=3)
+
+        for filename in [parquet, feather_file]:
+            chunks = list(utils.read_columnar(
+                filename, columns=['qseqid'], chunksize=2))
+            self.assertEqual([len(c) for c in chunks], [2, 1] * 3 + [1])
+            df = pandas.concat(chunks)
+            self.assertEqual(df.index.tolist(), list(range(10)))
+            self.assertTrue(df.equals(self.df[['qseqid']]))